@@ -65,11 +65,6 @@ if __name__ == '__main__':
         sys.exit(255)
 
     token = module.create_assets_request(pdql=args.pdql, group_ids=[])
-    content = module.get_assets_list_csv(token)
-    if content is not None:
-        with open(args.filename, 'w', encoding='utf-8-sig') as output_file:
-            # next(content)
-            for line in content:
-                output_file.write(line + "\n")
+    module.export_assets_csv(token, args.filename, add_bom=True)
 
     module.close()
@@ -73,10 +73,12 @@ if __name__ == '__main__':
         log.error(f'No group id for group name "{args.group}"')
         raise SystemExit()
 
-    with open(args.filename, 'rb') as content:
-        status, count, logfile = module.import_assets_from_csv(content=content, scope_id=scope, group_id=group)
-        if args.showerrors:
-            log.info('rows with errors for source file:')
+    result = module.import_assets_from_csv_parts(args.filename, scope_id=scope, group_id=group)
+    if result['failedParts']:
+        log.error(f'Parts not imported: {result["failedParts"]}')
+    if args.showerrors:
+        for part, logfile in sorted(result['errors'].items()):
+            log.info(f'rows with errors for source file part {part}:')
             print(logfile)
 
     module.close()
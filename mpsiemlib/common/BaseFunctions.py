@@ -5,6 +5,8 @@ import requests
 import logging
 import logging.config
 
+from typing import BinaryIO, Callable, Optional
+
 from urllib3.exceptions import InsecureRequestWarning
 
 urllib3.disable_warnings(InsecureRequestWarning)
@@ -94,6 +96,39 @@ def exec_request(session: requests.Session, url: str, method='GET', timeout=30,
     return response
 
 
+class UploadReader:
+    """Файлоподобная обертка для потоковой загрузки файла через requests.
+
+    Файл отправляется по мере чтения, on_progress(sent, total) вызывается
+    после каждых progress_step отправленных байт и в конце загрузки. За счет
+    __len__ requests выставляет Content-Length и не читает файл в память.
+    """
+
+    def __init__(self, fileobj: BinaryIO, on_progress: Optional[Callable[[int, int], None]] = None,
+                 progress_step: int = 1024 * 1024):
+        self.__fileobj = fileobj
+        self.__on_progress = on_progress
+        self.__progress_step = progress_step
+        self.__reported = 0
+        position = fileobj.tell()
+        self.total = fileobj.seek(0, os.SEEK_END) - position
+        fileobj.seek(position)
+        self.sent = 0
+
+    def __len__(self):
+        return self.total - self.sent
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.__fileobj.read(size)
+        self.sent += len(chunk)
+        if self.__on_progress is not None and \
+                (self.sent - self.__reported >= self.__progress_step or self.sent >= self.total) and \
+                self.sent != self.__reported:
+            self.__reported = self.sent
+            self.__on_progress(self.sent, self.total)
+        return chunk
+
+
 def get_metrics_start_time():
     return int(time.time() * 1000)
 
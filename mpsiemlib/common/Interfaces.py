@@ -15,7 +15,27 @@ class Settings:
     incidents_batch_size = 100  # размер выгружаемой пачки инцидентов
     source_monitor_batch_size = 1000  # размер выгружаемой пачки источников
     assets_batch_size = 1000  # размер выгружаемой пачки активов
+    assets_export_chunk_size = 1024 * 1024  # размер блока при выгрузке активов в CSV (байт)
+    assets_export_retries = 3  # количество повторных запросов выгрузки активов при обрыве соединения
+    assets_concurrency = 8  # количество одновременных запросов в пакетных операциях с активами
+    assets_delete_batch_size = 1000  # количество активов в одной операции пакетного удаления
+    assets_import_part_rows = 10000  # количество строк CSV в одной части импорта активов
     events_batch_size = 1000  # размер выгружаемой пачки событий через EventsAPI
+    operations_poll_first = 1  # задержка перед первой проверкой статуса длительной операции (сек)
+    operations_poll_max = 10  # максимальный интервал между проверками статуса операции (сек)
+    operations_poll_factor = 2  # коэффициент увеличения интервала между проверками
+    operations_timeout = 360  # максимальное время ожидания длительной операции (сек)
+    kb_deploy_timeout = 3600  # максимальное время ожидания установки контента в KB (сек)
+    kb_transfer_chunk_size = 1024 * 1024  # размер блока при выгрузке/загрузке наборов установки KB (байт)
+    kb_deploy_concurrency = 1  # количество одновременных установок контента (KB выполняет их последовательно)
+    kb_table_prefetch = 4  # количество одновременно запрашиваемых страниц содержимого табличного списка KB
+    tables_upload_batch_bytes = 8 * 1024 * 1024  # размер пачки CSV при загрузке данных в табличный список
+    tables_upload_concurrency = 2  # количество пачек, одновременно загружаемых в табличный список
+    tables_upload_retries = 0  # повторные отправки пачки при ошибке сети или 5xx, строки могут задублироваться
+    tables_rows_request_size = 5000  # количество строк в одном запросе построчного изменения табличного списка
+    tables_schema_ttl = 300  # время жизни кэша списка табличных списков и их схем (сек)
+    whitelist_batch_size = 1000  # количество строк в одном запросе к API белых списков
+    whitelist_concurrency = 4  # количество одновременных запросов к API белых списков
 
 
 class AuthType:
@@ -0,0 +1,130 @@
+import time
+import heapq
+import itertools
+import threading
+
+from concurrent.futures import Future
+from typing import Callable, Tuple, Any, Optional
+
+from .Interfaces import LoggingHandler, Settings
+
+
+class OperationWaiter(LoggingHandler):
+    """Ожидание завершения длительных операций MP SIEM (установка контента,
+    импорт и удаление активов и т.п.).
+
+    Все операции опрашиваются одним фоновым потоком. Первая проверка
+    выполняется через Settings.operations_poll_first сек, далее интервал
+    растет в Settings.operations_poll_factor раз, но не больше
+    Settings.operations_poll_max. Если операция не завершилась за отведенное
+    время, Future завершается с TimeoutError. Результат последней проверки
+    доступен в Future.last_result.
+
+    Usage:
+        def check():
+            status = module.get_status(operation_id)
+            return status is not None, status
+
+        future = waiter.submit(check)
+        status = future.result()
+    """
+
+    def __init__(self, settings: Settings):
+        LoggingHandler.__init__(self)
+        self.settings = settings
+        self.__queue = []  # heap: (время следующей проверки, порядковый номер, операция)
+        self.__counter = itertools.count()
+        self.__condition = threading.Condition()
+        self.__thread = None
+
+    def submit(self, check: Callable[[], Tuple[bool, Any]], timeout: Optional[float] = None,
+               name: Optional[str] = None) -> Future:
+        """Поставить операцию на ожидание.
+
+        :param check: функция проверки статуса, возвращает (done, result)
+        :param timeout: максимальное время ожидания (сек), по умолчанию
+            Settings.operations_timeout
+        :param name: название операции для журнала
+        :return: Future с result последней проверки
+        """
+        future = Future()
+        future.last_result = None
+        future.set_running_or_notify_cancel()
+
+        now = time.monotonic()
+        operation = {'check': check,
+                     'future': future,
+                     'name': name,
+                     'deadline': now + (timeout if timeout is not None else self.settings.operations_timeout),
+                     'interval': self.settings.operations_poll_first}
+
+        with self.__condition:
+            heapq.heappush(self.__queue, (now + operation['interval'], next(self.__counter), operation))
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__poll, name='OperationWaiter', daemon=True)
+                self.__thread.start()
+            self.__condition.notify()
+
+        self.log.debug('status=prepare, action=submit, msg="Wait for operation {}"'.format(name))
+
+        return future
+
+    def wait(self, check: Callable[[], Tuple[bool, Any]], timeout: Optional[float] = None,
+             name: Optional[str] = None, raise_on_timeout: bool = True) -> Any:
+        """Синхронное ожидание операции, см submit.
+
+        :param raise_on_timeout: False - по истечении timeout вернуть
+            result последней проверки вместо TimeoutError
+        :return: result последней проверки
+        """
+        future = self.submit(check, timeout, name)
+        try:
+            return future.result()
+        except TimeoutError:
+            if raise_on_timeout:
+                raise
+            return future.last_result
+
+    def __poll(self):
+        while True:
+            with self.__condition:
+                while True:
+                    if len(self.__queue) == 0:
+                        # все операции завершены, поток будет создан заново при следующем submit
+                        self.__thread = None
+                        return
+                    delay = self.__queue[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self.__condition.wait(delay)
+                _, _, operation = heapq.heappop(self.__queue)
+
+            self.__check(operation)
+
+    def __check(self, operation: dict):
+        future = operation['future']
+        try:
+            done, result = operation['check']()
+        except Exception as err:
+            self.log.error('status=failed, action=check_operation, msg="Operation {} check failed", '
+                           'error="{}"'.format(operation['name'], err))
+            future.set_exception(err)
+            return
+
+        future.last_result = result
+        if done:
+            future.set_result(result)
+            return
+
+        now = time.monotonic()
+        if now >= operation['deadline']:
+            self.log.error('status=failed, action=check_operation, msg="Operation {} timed out", '
+                           'last_status="{}"'.format(operation['name'], result))
+            future.set_exception(TimeoutError(f'Operation {operation["name"]} timed out'))
+            return
+
+        operation['interval'] = min(operation['interval'] * self.settings.operations_poll_factor,
+                                    self.settings.operations_poll_max)
+        next_check = min(now + operation['interval'], operation['deadline'])
+        with self.__condition:
+            heapq.heappush(self.__queue, (next_check, next(self.__counter), operation))
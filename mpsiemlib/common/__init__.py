@@ -2,11 +2,14 @@ from .MPSIEMAuth import MPSIEMAuth
 from .Interfaces import LoggingHandler, WorkerInterface, ModuleInterface, AuthInterface
 from .Interfaces import AuthType, ModuleNames, MPComponents, Creds, Settings, StorageVersion, MPContentTypes
 from .BaseFunctions import setup_logging, exec_request, get_metrics_took_time, get_metrics_start_time
+from .BaseFunctions import UploadReader
+from .Operations import OperationWaiter
 
 __all__ = ['setup_logging',
-           'exec_request', 'get_metrics_took_time', 'get_metrics_start_time',
+           'exec_request', 'get_metrics_took_time', 'get_metrics_start_time', 'UploadReader',
            'LoggingHandler',
            'WorkerInterface', 'ModuleInterface', 'AuthInterface',
            'MPComponents', 'ModuleNames', 'AuthType', 'Creds', 'Settings', 'MPContentTypes', 'StorageVersion',
-           'MPSIEMAuth']
+           'MPSIEMAuth',
+           'OperationWaiter']
 
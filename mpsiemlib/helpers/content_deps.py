@@ -0,0 +1,156 @@
+# coding: utf-8
+
+from collections import deque
+
+
+class ContentDependencyIndex:
+    """
+    Граф зависимостей контента набора установки.
+
+    Ребра ведут от правила (ObjectId) к используемым им объектам:
+    табличным спискам (чтение/запись), макросам и полям события,
+    которые заполняет формула нормализации.
+
+    Usage:
+        index = ContentDependencyIndex(ContentPack('dev.kb'))
+        index.get_dependents(ContentDependencyIndex.READS_TABLE, 'Suspicious_IP')
+        index.get_deploy_closure({'LOC-TL-1'}, macros={'Macro_Name'})
+    """
+
+    READS_TABLE = 'reads_table'
+    WRITES_TABLE = 'writes_table'
+    USES_MACRO = 'uses_macro'
+    SETS_FIELD = 'sets_field'
+
+    TABLE_RELATIONS = (READS_TABLE, WRITES_TABLE)
+
+    # Атрибуты правил ContentPack, из которых строятся ребра
+    RULE_ATTRIBUTES = {
+        'query_tlists': READS_TABLE,
+        'insert_into_tables': WRITES_TABLE,
+        'remove_from_tables': WRITES_TABLE,
+        'macros': USES_MACRO,
+        'event_fields': SETS_FIELD,
+    }
+
+    def __init__(self, pack=None):
+        # {'ObjectId': {relation: {'name'}}}
+        self.dependencies = {}
+        # {relation: {'name': {'ObjectId'}}}
+        self.dependents = {}
+        # {'имя табличного списка': 'ObjectId'}
+        self.tables = {}
+
+        if pack is not None:
+            self.add_pack(pack)
+
+    def add_pack(self, pack):
+        """
+        Добавить в граф все правила и табличные списки набора установки
+
+        :param pack: ContentPack
+        :return:
+        """
+        for tlist in pack.tlists.values():
+            self.tables[tlist.name] = tlist.ObjectId
+
+        for obj_type in pack.NAMES:
+            for rule in pack.NAMES[obj_type]['LIST'].values():
+                self.dependencies.setdefault(rule.ObjectId, {})
+                for attribute, relation in self.RULE_ATTRIBUTES.items():
+                    self.add_dependencies(rule.ObjectId, relation, getattr(rule, attribute, ()))
+
+    def add_dependencies(self, object_id, relation, names):
+        """
+        Добавить ребра графа
+
+        :param object_id: ObjectId правила
+        :param relation: тип связи, например READS_TABLE
+        :param names: имена используемых объектов
+        :return:
+        """
+        forward = self.dependencies.setdefault(object_id, {}).setdefault(relation, set())
+        reverse = self.dependents.setdefault(relation, {})
+        for name in names:
+            forward.add(name)
+            reverse.setdefault(name, set()).add(object_id)
+
+    def get_dependencies(self, object_id, relation):
+        """
+        Объекты, которые использует правило
+
+        :param object_id: ObjectId правила
+        :param relation: тип связи
+        :return: {'name'}
+        """
+        return set(self.dependencies.get(object_id, {}).get(relation, ()))
+
+    def get_dependents(self, relation, name):
+        """
+        Правила, использующие объект, например правила, читающие табличный список
+
+        :param relation: тип связи
+        :param name: имя табличного списка, макроса или поля события
+        :return: {'ObjectId'}
+        """
+        return set(self.dependents.get(relation, {}).get(name, ()))
+
+    def get_table_users(self, name):
+        """
+        Правила, читающие или изменяющие табличный список
+
+        :param name: имя табличного списка
+        :return: {'ObjectId'}
+        """
+        ret = set()
+        for relation in self.TABLE_RELATIONS:
+            ret |= self.get_dependents(relation, name)
+
+        return ret
+
+    def get_closure(self, object_ids, reverse=False):
+        """
+        Транзитивное замыкание по табличным спискам
+
+        :param object_ids: ObjectId правил и табличных списков
+        :param reverse: False - объекты, от которых зависят object_ids (используемые
+            табличные списки), True - объекты, зависящие от object_ids (правила,
+            использующие табличные списки)
+        :return: {'ObjectId'}, включая object_ids
+        """
+        table_names = {v: k for k, v in self.tables.items()}
+
+        ret = set(object_ids)
+        queue = deque(ret)
+        while queue:
+            object_id = queue.popleft()
+            if reverse:
+                name = table_names.get(object_id)
+                linked = self.get_table_users(name) if name is not None else set()
+            else:
+                linked = set()
+                for relation in self.TABLE_RELATIONS:
+                    linked |= {self.tables[i] for i in self.get_dependencies(object_id, relation) if i in self.tables}
+
+            for i in linked - ret:
+                ret.add(i)
+                queue.append(i)
+
+        return ret
+
+    def get_deploy_closure(self, object_ids, macros=()):
+        """
+        Минимальный набор объектов для установки изменений: измененные объекты,
+        правила, использующие измененные табличные списки и макросы, и табличные
+        списки, без которых эти правила не установятся
+
+        :param object_ids: ObjectId измененных правил и табличных списков
+        :param macros: имена измененных макросов (макросы не входят в набор установки
+            и задаются по имени)
+        :return: {'ObjectId'}, сами макросы не включаются
+        """
+        changed = set(object_ids)
+        for name in macros:
+            changed |= self.get_dependents(self.USES_MACRO, name)
+
+        return self.get_closure(self.get_closure(changed, reverse=True))
@@ -1,30 +1,140 @@
 # coding: utf-8
 
+import io
 import os
 import re
 import sys
 import json
+import stat
 import yaml
-import uuid
-import time
 import shutil
+import marshal
+import posixpath
 
-from zipfile import ZipFile
-from tempfile import TemporaryDirectory
+from hashlib import sha256
+from zipfile import ZipFile, ZIP_DEFLATED
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
+from .pack_fs import PackFS, DirFS, ZipFS
+from .content_deps import ContentDependencyIndex
 
-class AggregationRule:
+try:
+    # libyaml в разы быстрее реализации на Python
+    from yaml import CSafeLoader as YAMLLoader, CSafeDumper as YAMLDumper
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader, SafeDumper as YAMLDumper
+
+
+class RuleLexer:
+    """
+    Лексер кода правил.
+
+    Выражения лексем компилируются один раз и общие для всех типов правил.
+    Выражение запускается, только если в коде есть его ключевое слово, а для
+    имени правила поиск останавливается на первом совпадении.
+
+    Выражения не объединяются в одно с именованными группами: лексемы разных
+    типов пересекаются (строка id = "Name" формулы нормализации - и имя
+    формулы, и поле события), а в альтернации на каждой позиции совпадает
+    только одна ветка. Поэтому код просматривается отдельно для каждой
+    лексемы, ключевое слово которой в нем есть.
+    """
+
+    COMMENT_PATTERN = re.compile('#.*')
+
+    # {'имя лексемы': (ключевое слово, выражение, только первое совпадение)}
+    TOKEN_PATTERNS = {
+        'aggregate_name': ('aggregate', re.compile(r'^aggregate\s+(.+?)[\r\n\t]', re.MULTILINE), True),
+        'enrichment_name': ('enrichment', re.compile(r'^enrichment\s+(.+?)[\r\n\t]', re.MULTILINE), True),
+        'rule_name': ('rule', re.compile(r'rule\s+(.+):', re.MULTILINE), True),
+        'formula_name': ('id', re.compile(r'^id\s*=\s*(?:\'|\"|)([a-zA-Z0-9_]+)', re.MULTILINE), True),
+        'remove_from': ('remove_from', re.compile(r'remove_from\s(\w+)', re.MULTILINE), False),
+        'insert_into': ('insert_into', re.compile(r'insert_into\s(\w+)', re.MULTILINE), False),
+        'query': ('query', re.compile(r'query\s+.+?from\s+(\w+)', re.MULTILINE), False),
+        # Вызов макроса, как в Macros.unpack_macros
+        'macro': ('filter::', re.compile(r'filter::(\S+)\(\)', re.MULTILINE), False),
+        'event_field': ('=', re.compile(r'^[ \t]*([a-z_][\w.]*)[ \t]*=(?!=)', re.MULTILINE), False),
+    }
+
+    def __init__(self, *token_names):
+        self.token_names = token_names
+
+    @staticmethod
+    def strip_comments(code):
+        if '#' not in code:
+            return code
+        return RuleLexer.COMMENT_PATTERN.sub('', code)
+
+    def scan(self, code):
+        """
+        Извлечение лексем
+
+        :param code: код правила без комментариев
+        :return: {'имя лексемы': [значения в порядке появления в коде]}
+        """
+        tokens = {}
+        for name in self.token_names:
+            keyword, regex, first_only = self.TOKEN_PATTERNS[name]
+            if keyword not in code:
+                tokens[name] = []
+            elif first_only:
+                res = regex.search(code)
+                tokens[name] = [res.group(1)] if res else []
+            else:
+                tokens[name] = regex.findall(code)
+
+        return tokens
+
+
+class ContentRule:
+    """
+    Базовый класс правила с кодом
+    """
+
+    LEXER = None
+    _code = None
+    _code_without_comments = None
+
+    @property
+    def code(self):
+        return self._code
+
+    @code.setter
+    def code(self, value):
+        # код без комментариев пересчитывается при следующем обращении
+        self._code = value
+        self._code_without_comments = None
+
+    @property
+    def code_without_comments(self):
+        """
+        Код правила без комментариев, вычисляется при первом обращении
+        """
+        if self._code_without_comments is None:
+            self._code_without_comments = RuleLexer.strip_comments(self.code)
+        return self._code_without_comments
+
+    def scan_tokens(self):
+        return self.LEXER.scan(self.code_without_comments)
+
+
+class AggregationRule(ContentRule):
     """
     Правило агрегации
     """
 
+    LEXER = RuleLexer('aggregate_name', 'macro')
+
     def parse_tokens(self):
-        code_without_comments = re.sub('#.*', '', self.code)
+        tokens = self.scan_tokens()
 
         # Find rule name
-        res = re.search(r'^aggregate\s+(.+?)[\r\n\t]', code_without_comments, re.MULTILINE)
-        if res and res.group(1):
-            self.name = res.group(1)
+        if tokens['aggregate_name']:
+            self.name = tokens['aggregate_name'][0]
+
+        # Find macros
+        self.macros.update(tokens['macro'])
 
     def __init__(self, meta, code, i18n_ru=None):
         self.meta = meta
@@ -32,6 +142,7 @@ class AggregationRule:
         self.code = code
         self.name = 'Unknown'
         self.i18n_ru = i18n_ru
+        self.macros = set()
 
         self.parse_tokens()
 
@@ -42,30 +153,27 @@ class AggregationRule:
         return self.__str__()
 
 
-class EnrichmentRule:
+class EnrichmentRule(ContentRule):
     """
     Правило обогащения
     """
 
+    LEXER = RuleLexer('enrichment_name', 'remove_from', 'insert_into', 'query', 'macro')
+
     def parse_tokens(self):
-        code_without_comments = re.sub('#.*', '', self.code)
+        tokens = self.scan_tokens()
 
         # Find rule name
-        res = re.search(r'^enrichment\s+(.+?)[\r\n\t]', code_without_comments, re.MULTILINE)
-        if res and res.group(1):
-            self.name = res.group(1)
-
-        # Find remove_from statements
-        for res in re.finditer('remove_from\s(\w+)', code_without_comments, re.MULTILINE):
-            self.remove_from_tables.add(res.group(1))
+        if tokens['enrichment_name']:
+            self.name = tokens['enrichment_name'][0]
 
-        # Find insert_into statements
-        for res in re.finditer('insert_into\s(\w+)', code_without_comments, re.MULTILINE):
-            self.insert_into_tables.add(res.group(1))
+        # Find remove_from, insert_into and query statements
+        self.remove_from_tables.update(tokens['remove_from'])
+        self.insert_into_tables.update(tokens['insert_into'])
+        self.query_tlists.update(tokens['query'])
 
-        # Find query statements
-        for res in re.finditer('query\s+.+?from\s+(\w+)', code_without_comments, re.MULTILINE):
-            self.query_tlists.add(res.group(1))
+        # Find macros
+        self.macros.update(tokens['macro'])
 
     def __init__(self, meta, code, i18n_ru=None):
         self.meta = meta
@@ -76,6 +184,7 @@ class EnrichmentRule:
         self.query_tlists = set()
         self.insert_into_tables = set()
         self.remove_from_tables = set()
+        self.macros = set()
 
         self.parse_tokens()
 
@@ -93,22 +202,25 @@ class EnrichmentRule:
         print()
 
 
-class CorrelationRule:
+class CorrelationRule(ContentRule):
     """
     Правило корреляции
     """
 
+    LEXER = RuleLexer('rule_name', 'query', 'macro')
+
     def parse_tokens(self):
-        code_without_comments = re.sub('#.*', '', self.code)
+        tokens = self.scan_tokens()
 
         # Find rule name
-        res = re.search(r'rule\s+(.+):', code_without_comments, re.MULTILINE)
-        if res and res.group(1):
-            self.name = res.group(1)
+        if tokens['rule_name']:
+            self.name = tokens['rule_name'][0]
 
         # Find query statements
-        for res in re.finditer('query\s+.+?from\s+(\w+)', code_without_comments, re.MULTILINE):
-            self.query_tlists.add(res.group(1))
+        self.query_tlists.update(tokens['query'])
+
+        # Find macros
+        self.macros.update(tokens['macro'])
 
     def __init__(self, meta, code, i18n_ru):
         self.meta = meta
@@ -116,6 +228,7 @@ class CorrelationRule:
         self.code = code
         self.name = 'Unknown'
         self.query_tlists = set()
+        self.macros = set()
         self.i18n_ru = i18n_ru
 
         self.parse_tokens()
@@ -158,18 +271,22 @@ class TablularList:
             print('\t{}'.format(row))
 
 
-class NormalizationFormula:
+class NormalizationFormula(ContentRule):
     """
     Формула нормализации
     """
 
+    LEXER = RuleLexer('formula_name', 'event_field')
+
     def parse_tokens(self):
-        code_without_comments = re.sub('#.*', '', self.code)
+        tokens = self.scan_tokens()
 
         # Find rule name
-        res = re.search('^id\s*=\s*(\'|\"|)([a-zA-Z0-9_]+)', code_without_comments, re.MULTILINE)
-        if res and res.group(2):
-            self.name = res.group(2)
+        if tokens['formula_name']:
+            self.name = tokens['formula_name'][0]
+
+        # Find event fields assignments
+        self.event_fields.update(i for i in tokens['event_field'] if i != 'id')
 
     def __init__(self, meta, code, i18n_ru=None):
         self.meta = meta
@@ -177,10 +294,184 @@ class NormalizationFormula:
         self.code = code
         self.name = 'Unknown'
         self.i18n_ru = i18n_ru
+        self.event_fields = set()
 
         self.parse_tokens()
 
 
+class LazyRule:
+    """
+    Правило, загружаемое при первом обращении.
+
+    Хранит только ObjectId, путь в файловой системе набора установки и имя. Для
+    имени читается только файл кода правила, само правило при этом не загружается.
+    Код, метаданные и остальные атрибуты правила читаются при первом обращении и
+    освобождаются evict().
+    """
+
+    __slots__ = ('ObjectId', 'path', '_name', '_pack', '_obj_type', '_rule')
+
+    def __init__(self, pack, obj_type, object_id, path):
+        self.ObjectId = object_id
+        self.path = path
+        self._name = None
+        self._pack = pack
+        self._obj_type = obj_type
+        self._rule = None
+
+    @property
+    def is_loaded(self):
+        return self._rule is not None
+
+    @property
+    def name(self):
+        if self._name is None:
+            if self._rule is not None:
+                self._name = self._rule.name
+            else:
+                self._name = self._pack.load_rule_name(self._obj_type, self.ObjectId, self.path)
+        return self._name
+
+    def load(self):
+        """
+        Загрузить правило
+
+        :return: объект правила (CorrelationRule, TablularList и т.д.)
+        """
+        if self._rule is None:
+            self._rule = self._pack.load_rule(self._obj_type, self.path)
+            self._name = self._rule.name
+        return self._rule
+
+    def evict(self):
+        """
+        Освободить загруженные данные правила
+
+        :return:
+        """
+        self._rule = None
+
+    def __getattr__(self, item):
+        # Вызывается только для атрибутов, которых нет у LazyRule
+        if item in LazyRule.__slots__ or item.startswith('__'):
+            raise AttributeError(item)
+        return getattr(self.load(), item)
+
+    def __str__(self):
+        return str(self.load())
+
+    def __repr__(self):
+        return f'LAZY RULE [{self.ObjectId}] {self.path}'
+
+
+def _read_text(data, encoding, newline=None):
+    """
+    Декодирование содержимого файла так же, как при чтении через open(path, 'rt')
+
+    :param data: содержимое файла
+    :param encoding: кодировка
+    :param newline: см open
+    :return: str
+    """
+    return io.TextIOWrapper(io.BytesIO(data), encoding=encoding, newline=newline).read()
+
+
+def _yaml_load(stream):
+    return yaml.load(stream, Loader=YAMLLoader)
+
+
+def _yaml_dump(data, stream=None):
+    return yaml.dump(data, stream, Dumper=YAMLDumper, allow_unicode=True)
+
+
+class YAMLParseCache:
+    """
+    Дисковый кэш разобранных YAML-файлов.
+
+    Ключ - sha256 содержимого файла, поэтому неизменившиеся файлы не разбираются
+    повторно между запусками. Объект можно передавать в пул процессов.
+
+    Записи хранятся в формате marshal: при чтении восстанавливаются только
+    данные, код не выполняется. Значения с типами, которые marshal не
+    поддерживает (например даты), не кэшируются. Каталог кэша должен быть
+    доступен на запись только текущему пользователю: подмененная запись
+    меняет разобранный контент, поэтому общий каталог не принимается.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        self.__check_permissions(cache_dir)
+
+    @staticmethod
+    def __check_permissions(cache_dir):
+        if os.name != 'posix':
+            return
+        st = os.stat(cache_dir)
+        if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise Exception(f'YAML cache directory {cache_dir} must be owned by the current user '
+                            f'and not writable by group or others')
+
+    def load(self, data):
+        """
+        Разбор YAML-файла (кодировка utf-8-sig) с использованием кэша
+
+        :param data: содержимое файла
+        :return: разобранный объект
+        """
+        key = sha256(data).hexdigest()
+        cache_path = os.path.join(self.cache_dir, key[:2], key + '.marshal')
+        if os.path.isfile(cache_path):
+            try:
+                with open(cache_path, 'rb') as cache_file:
+                    return marshal.load(cache_file)
+            except (OSError, EOFError, ValueError, TypeError):
+                pass  # поврежденная запись будет перезаписана
+
+        value = _yaml_load(_read_text(data, 'utf-8-sig'))
+
+        try:
+            dump = marshal.dumps(value)
+        except ValueError:
+            return value  # тип значения не поддерживается marshal
+
+        os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(tmp_path, 'wb') as cache_file:
+            cache_file.write(dump)
+        os.replace(tmp_path, cache_path)
+
+        return value
+
+
+def _load_yaml_bytes(data, cache=None):
+    if cache is not None:
+        return cache.load(data)
+    return _yaml_load(_read_text(data, 'utf-8-sig'))
+
+
+def _parse_rule(task, meta=None):
+    """
+    Разбор файлов правила. Функция уровня модуля, чтобы выполнять ее в пуле процессов
+
+    :param task: (конструктор, тип файла правила, код, metainfo.yaml, i18n_ru.yaml или None в bytes,
+        YAMLParseCache или None)
+    :param meta: разобранный metainfo.yaml вместо metainfo.yaml из task
+    :return: объект правила
+    """
+    constructor, rule_file_type, code, meta_data, i18n_ru, cache = task
+    if rule_file_type == 'text':
+        code = _read_text(code, 'utf-8-sig', newline='\n')
+    else:
+        code = _load_yaml_bytes(code, cache)
+    if meta is None:
+        meta = _load_yaml_bytes(meta_data, cache)
+    if i18n_ru is not None:
+        i18n_ru = _load_yaml_bytes(i18n_ru, cache)
+
+    return constructor(meta, code, i18n_ru)
+
+
 class ContentPack:
     """
     Набор установки
@@ -241,8 +532,18 @@ class ContentPack:
     # Properties
     PROPS_FILENAME = 'properties.txt'
 
-    # Инициализируется каталогом или паком
-    def __init__(self, input_object):
+    # Инициализируется каталогом или паком.
+    # workers - количество процессов для разбора правил, None - разбор в текущем процессе
+    # cache_dir - каталог кэша разобранных YAML-файлов (см. YAMLParseCache), None - без кэша
+    # lazy - правила загружаются при первом обращении (см. LazyRule), архив .kb остается открытым до close()
+    # None вместо input_object - пустой набор установки
+    def __init__(self, input_object, workers=None, cache_dir=None, lazy=False):
+        self.workers = workers
+        self.yaml_cache = YAMLParseCache(cache_dir) if cache_dir is not None else None
+        self.lazy = lazy
+        # Файловая система набора установки, в ленивом режиме используется для загрузки правил
+        self.fs = None
+        self.__own_fs = False
         # Правила агрегации
         self.ar_rules = {}
         # Правила обогащения
@@ -322,15 +623,72 @@ class ContentPack:
         self.DESCR_PATH = 'i18n'
         self.DESCR_RU_FILENAME = 'i18n_ru.yaml'
 
-        if os.path.isfile(input_object):
-            # Извлечение начинки пака во временный каталог
-            with TemporaryDirectory() as tempdir:
-                with ZipFile(input_object) as content_pack:
-                    content_pack.extractall(path=tempdir)
-                self.load_pack_from_dir(tempdir)
+        if input_object is None:
+            # Пустой набор установки, заполняется вызывающим кодом (см. subset)
+            pass
+        elif isinstance(input_object, PackFS):
+            if input_object.isfile(ContentPack.KB_TREE_FILENAME):
+                self.load_pack_from_fs(input_object)
+            else:
+                self.load_tree_from_fs(input_object)
+        elif os.path.isfile(input_object):
+            # Начинка пака читается напрямую из архива
+            content_pack = ZipFS(input_object)
+            try:
+                self.load_pack_from_fs(content_pack)
+            finally:
+                if not lazy:
+                    content_pack.close()
+            self.__own_fs = lazy
         else:
             self.load_pack_from_tree_folder(input_object)
 
+    def close(self):
+        """
+        Закрыть архив .kb, открытый в ленивом режиме
+
+        :return:
+        """
+        if self.__own_fs:
+            self.fs.close()
+            self.__own_fs = False
+
+    def evict(self):
+        """
+        Освободить данные загруженных правил в ленивом режиме
+
+        :return:
+        """
+        for obj_type in self.NAMES:
+            for rule in self.NAMES[obj_type]['LIST'].values():
+                if isinstance(rule, LazyRule):
+                    rule.evict()
+
+    def load_rule(self, obj_type, path):
+        """
+        Загрузить правило из файловой системы набора установки
+
+        :param obj_type: тип правила
+        :param path: каталог правила
+        :return: объект правила
+        """
+        return _parse_rule(self.__read_rule(self.fs, path, obj_type))
+
+    def load_rule_name(self, obj_type, object_id, path):
+        """
+        Имя правила по файлу кода, без чтения метаданных и описаний
+
+        :param obj_type: тип правила
+        :param object_id: ObjectId правила
+        :param path: каталог правила
+        :return: имя правила
+        """
+        code = self.fs.read_bytes(self.fs.join(path, self.NAMES[obj_type]['FILENAME']))
+        task = (self.NAMES[obj_type]['CONSTRUCTOR'], self.NAMES[obj_type]['RULE_FILE_TYPE'], code,
+                None, None, self.yaml_cache)
+
+        return _parse_rule(task, {'ObjectId': object_id}).name
+
     # ------------------------------- Loaders (PT structure) ----------------------------------------------------
 
     def load_pack_from_dir(self, base_path):
@@ -340,142 +698,169 @@ class ContentPack:
         :param base_path: каталог с начинкой набора установки
         :return:
         """
-        self.__load_event_categories(base_path)
-        self.__load_origins(base_path)
-        self.__load_tags(base_path)
-        self.__load_taxonomy(base_path)
-        self.__load_kb_tree(base_path)
-        self.__load_props(base_path)
+        self.load_pack_from_fs(DirFS(base_path))
+
+    def load_pack_from_fs(self, fs):
+        """
+        Загрузка структуры набора установки из PT-структуры
 
+        :param fs: PackFS с начинкой набора установки (каталог или архив .kb)
+        :return:
+        """
+        # ссылка на PackFS нужна только ленивому режиму, иначе набор установки нельзя передать в пул процессов
+        self.fs = fs if self.lazy else None
+        self.__load_event_categories(fs)
+        self.__load_origins(fs)
+        self.__load_tags(fs)
+        self.__load_taxonomy(fs)
+        self.__load_kb_tree(fs)
+        self.__load_props(fs)
+
+        tasks = []
         for obj_type in self.NAMES:
-            self.__load_rules(base_path, obj_type)
+            self.__load_rules(fs, obj_type, tasks)
+        self.__parse_rules(tasks)
 
-    def __load_rules(self, base_path, obj_type):
+    def __load_rules(self, fs, obj_type, tasks):
         """
         Загрузка правил и табличных списков
 
-        :param base_path: каталог с начинкой набора установки
+        :param fs: PackFS с начинкой набора установки
         :param obj_type:
+        :param tasks: список, в который добавляются задачи на разбор правил
         :return:
         """
-        data_path = os.path.join(base_path, self.NAMES[obj_type]['PATH'])
-        if os.path.exists(data_path):
-            base_dirs = os.listdir(data_path)
+        data_path = self.NAMES[obj_type]['PATH']
+        if fs.exists(data_path):
+            base_dirs = fs.listdir(data_path)
             for base_dir in base_dirs:
-                current_path = os.path.join(data_path, base_dir)
-                rule_path = os.path.join(current_path, self.NAMES[obj_type]['FILENAME'])
-
-                if self.NAMES[obj_type]['RULE_FILE_TYPE'] == 'text':
-                    with open(rule_path, 'rt', encoding='utf-8-sig', newline='\n') as rulefile:
-                        code = rulefile.read()
+                current_path = fs.join(data_path, base_dir)
+                if self.lazy:
+                    self.NAMES[obj_type]['LIST'][base_dir] = LazyRule(self, obj_type, base_dir, current_path)
                 else:
-                    with open(rule_path, 'rt', encoding='utf-8-sig') as rulefile:
-                        code = yaml.full_load(rulefile)
+                    tasks.append((obj_type, base_dir, self.__read_rule(fs, current_path, obj_type)))
+
+    def __read_rule(self, fs, current_path, obj_type):
+        """
+        Чтение файлов правила
 
-                meta_path = os.path.join(current_path, self.METADATA_FILENAME)
-                with open(meta_path, 'rt', encoding='utf-8-sig') as metafile:
-                    meta = yaml.full_load(metafile)
+        :param fs: PackFS с начинкой набора установки
+        :param current_path: каталог правила
+        :param obj_type:
+        :return: задача для _parse_rule
+        """
+        code = fs.read_bytes(fs.join(current_path, self.NAMES[obj_type]['FILENAME']))
+        meta = fs.read_bytes(fs.join(current_path, self.METADATA_FILENAME))
 
-                descr_path = os.path.join(current_path,
-                                          self.DESCR_PATH,
-                                          self.DESCR_RU_FILENAME)
-                i18n_ru = None
-                if os.path.isfile(descr_path):
-                    with open(descr_path, 'rt', encoding='utf-8-sig') as desc_file:
-                        i18n_ru = yaml.full_load(desc_file)
+        descr_path = fs.join(current_path,
+                             self.DESCR_PATH,
+                             self.DESCR_RU_FILENAME)
+        i18n_ru = fs.read_bytes(descr_path) if fs.isfile(descr_path) else None
 
-                rule = self.NAMES[obj_type]['CONSTRUCTOR'](meta, code, i18n_ru)
-                self.NAMES[obj_type]['LIST'][base_dir] = rule
+        return (self.NAMES[obj_type]['CONSTRUCTOR'], self.NAMES[obj_type]['RULE_FILE_TYPE'], code, meta, i18n_ru,
+                self.yaml_cache)
+
+    def __parse_rules(self, tasks):
+        """
+        Разбор прочитанных правил, при self.workers > 1 - в пуле процессов
 
-    def __load_event_categories(self, base_path):
+        :param tasks: [(obj_type, ключ правила, задача для _parse_rule)]
+        :return:
+        """
+        if self.workers is not None and self.workers > 1 and len(tasks) > 1:
+            chunksize = max(1, len(tasks) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                rules = list(executor.map(_parse_rule, [i[2] for i in tasks], chunksize=chunksize))
+        else:
+            rules = [_parse_rule(i[2]) for i in tasks]
+
+        for (obj_type, key, _), rule in zip(tasks, rules):
+            self.NAMES[obj_type]['LIST'][key] = rule
+
+    def __load_event_categories(self, fs):
         """
         Загрузка категорий
 
-        :param base_path: каталог с начинкой набора установки
+        :param fs: PackFS с начинкой набора установки
         :return:
         """
-        ec_path = os.path.join(base_path, ContentPack.EC_PATH, ContentPack.EC_FILENAME)
-        if os.path.exists(ec_path):
-            with open(ec_path, 'rt', encoding='utf-8-sig') as ec_file:
-                self.event_categories = yaml.full_load(ec_file)
+        ec_path = fs.join(ContentPack.EC_PATH, ContentPack.EC_FILENAME)
+        if fs.exists(ec_path):
+            with fs.open(ec_path, encoding='utf-8-sig') as ec_file:
+                self.event_categories = _yaml_load(ec_file)
 
-    def __load_origins(self, base_path):
+    def __load_origins(self, fs):
         """
         Загрузка Origins
 
-        :param base_path: каталог с начинкой набора установки
+        :param fs: PackFS с начинкой набора установки
         :return:
         """
-        origins_path = os.path.join(base_path, ContentPack.ORIGINS_PATH, ContentPack.ORIGINS_FILENAME)
-        if os.path.exists(origins_path):
-            with open(origins_path, 'rt', encoding='utf-8-sig') as origins_file:
+        origins_path = fs.join(ContentPack.ORIGINS_PATH, ContentPack.ORIGINS_FILENAME)
+        if fs.exists(origins_path):
+            with fs.open(origins_path, encoding='utf-8-sig') as origins_file:
                 self.origins = json.load(origins_file)
 
-    def __load_tags(self, base_path):
+    def __load_tags(self, fs):
         """
         Загрузка tags
 
-        :param base_path: каталог с начинкой набора установки
+        :param fs: PackFS с начинкой набора установки
         :return:
         """
-        tags_path = os.path.join(base_path, ContentPack.TAGS_PATH, ContentPack.TAGS_FILENAME)
-        if os.path.exists(tags_path):
-            with open(tags_path, 'rt', encoding='utf-8-sig') as tags_file:
-                self.tags = yaml.full_load(tags_file)
+        tags_path = fs.join(ContentPack.TAGS_PATH, ContentPack.TAGS_FILENAME)
+        if fs.exists(tags_path):
+            with fs.open(tags_path, encoding='utf-8-sig') as tags_file:
+                self.tags = _yaml_load(tags_file)
 
-    def __load_taxonomy(self, base_path):
+    def __load_taxonomy(self, fs):
         """
         Загрузка таксономии событий
 
-        :param base_path: каталог с начинкой набора установки
+        :param fs: PackFS с начинкой набора установки
         :return:
         """
-        taxonomy_path = os.path.join(base_path, ContentPack.TAXONOMY_PATH, ContentPack.TAXONOMY_FILENAME)
-        if os.path.exists(taxonomy_path):
-            with open(taxonomy_path, 'rt', encoding='utf-8') as taxonomy_file:
+        taxonomy_path = fs.join(ContentPack.TAXONOMY_PATH, ContentPack.TAXONOMY_FILENAME)
+        if fs.exists(taxonomy_path):
+            with fs.open(taxonomy_path, encoding='utf-8') as taxonomy_file:
                 self.taxonomy = json.load(taxonomy_file)
 
-    def __load_kb_tree(self, base_path):
+    def __load_kb_tree(self, fs):
         """
         Загрузка структуры набора установки
 
-        :param base_path:
+        :param fs: PackFS с начинкой набора установки
         :return:
         """
-        kb_tree_path = os.path.join(base_path, ContentPack.KB_TREE_FILENAME)
-        if os.path.exists(kb_tree_path):
-            with open(kb_tree_path, 'rt', encoding='utf-8-sig') as kb_tree_file:
+        if fs.exists(ContentPack.KB_TREE_FILENAME):
+            with fs.open(ContentPack.KB_TREE_FILENAME, encoding='utf-8-sig') as kb_tree_file:
                 self.kb_tree = json.load(kb_tree_file)
 
-    def __load_props(self, base_path):
+    def __load_props(self, fs):
         """
         Загрузка props
 
-        :param base_path:
+        :param fs: PackFS с начинкой набора установки
         :return:
         """
-        props_path = os.path.join(base_path, ContentPack.PROPS_FILENAME)
-        if os.path.exists(props_path):
-            with open(props_path, 'rt', encoding='utf-8') as props_file:
+        if fs.exists(ContentPack.PROPS_FILENAME):
+            with fs.open(ContentPack.PROPS_FILENAME, encoding='utf-8') as props_file:
                 self.properties = props_file.read()
 
     # ------------------------------- Dumpers (PT structure) ----------------------------------------------------
-    def dump_to_kb_file(self, kb_file_path):
+    def dump_to_kb_file(self, kb_file):
         """
-        Упаковка каталога с контентом в файл набора установки
+        Упаковка набора установки в файл .kb
+
+        Файлы пишутся напрямую в архив, без временного каталога.
 
-        :param kb_file_path: каталог с контентом
+        :param kb_file: путь к файлу набора установки или бинарный файловый объект,
+            открытый на запись (например, io.BytesIO для KnowledgeBase.import_group)
         :return:
         """
-        with TemporaryDirectory() as tempdir:
-            arch_dir = os.path.join(tempdir, 'arch')
-            self.dump_pack_to_dir(arch_dir)
-            arch_filename = str(uuid.uuid4())
-            shutil.make_archive(os.path.join(tempdir, arch_filename), 'zip', root_dir=arch_dir)
-            arch_filename += '.zip'
-            shutil.copyfile(os.path.join(tempdir, arch_filename), kb_file_path)
-            shutil.rmtree(tempdir, ignore_errors=True)
-            time.sleep(2)
+        with ZipFile(kb_file, 'w', compression=ZIP_DEFLATED) as content_pack:
+            for path, data in self.__iter_pack_files():
+                content_pack.writestr(path, data)
 
     def dump_pack_to_dir(self, base_path):
         """
@@ -488,119 +873,72 @@ class ContentPack:
             os.mkdir(base_path)
 
         for obj_type in self.NAMES:
-            self.__dump_rule(base_path, obj_type)
-
-        self.__dump_event_categories(base_path)
-        self.__dump_origins(base_path)
-        self.__dump_tags(base_path)
-        self.__dump_taxonomy(base_path)
-        self.__dump_kb_tree(base_path)
-        self.__dump_props(base_path)
-
-    def __dump_rule(self, base_path, obj_type):
-        """
-        Дамп правил
-
-        :param base_path: каталог для дампа
-        :param obj_type:
-        :return:
-        """
-        data_path = os.path.join(base_path, self.NAMES[obj_type]['PATH'])
-        if os.path.exists(data_path):
-            shutil.rmtree(data_path)
-        if self.NAMES[obj_type]['LIST']:
-            os.mkdir(data_path)
-            for rule in self.NAMES[obj_type]['LIST'].values():
-                base_dir = os.path.join(data_path, rule.ObjectId)
-                os.mkdir(base_dir)
-                code_filename = os.path.join(base_dir, self.NAMES[obj_type]['FILENAME'])
-
-                if self.NAMES[obj_type]['RULE_FILE_TYPE'] == 'text':
-                    with open(code_filename, 'wt', encoding='utf-8-sig', newline='\n') as code_file:
-                        code_file.write(rule.code)
-                else:
-                    with open(code_filename, 'wt', encoding='utf-8-sig') as code_file:
-                        yaml.safe_dump(rule.code, code_file, allow_unicode=True)
+            data_path = os.path.join(base_path, self.NAMES[obj_type]['PATH'])
+            if os.path.exists(data_path):
+                shutil.rmtree(data_path)
 
-                meta_filename = os.path.join(base_dir, self.METADATA_FILENAME)
-                with open(meta_filename, 'wt', encoding='utf-8-sig') as meta_file:
-                    yaml.safe_dump(rule.meta, meta_file, allow_unicode=True)
+        for path, data in self.__iter_pack_files():
+            file_path = os.path.join(base_path, *path.split('/'))
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as data_file:
+                data_file.write(data)
 
-                if rule.i18n_ru:
-                    i18n_dir = os.path.join(base_dir, self.DESCR_PATH)
-                    os.mkdir(i18n_dir)
-                    descr_path = os.path.join(i18n_dir, self.DESCR_RU_FILENAME)
-                    with open(descr_path, 'wt', encoding='utf-8-sig') as desc_file:
-                        yaml.safe_dump(rule.i18n_ru, desc_file, allow_unicode=True)
-
-    def __dump_event_categories(self, base_path):
+    def __iter_pack_files(self):
         """
-        Дамп категорий
+        Файлы набора установки в PT-структуре
 
-        :param base_path: каталог для дампа
-        :return:
+        :return: генератор (относительный путь, содержимое)
         """
-        ec_path = os.path.join(base_path, ContentPack.EC_PATH)
-        os.mkdir(ec_path)
-        ec_filename = os.path.join(ec_path, ContentPack.EC_FILENAME)
-        with open(ec_filename, 'wt', encoding='utf-8-sig') as ec_file:
-            yaml.safe_dump(self.event_categories, ec_file, allow_unicode=True)
-
-    def __dump_origins(self, base_path):
+        for obj_type in self.NAMES:
+            yield from self.__iter_rule_files(obj_type)
+
+        yield (posixpath.join(ContentPack.EC_PATH, ContentPack.EC_FILENAME),
+               self.__yaml_bytes(self.event_categories, 'utf-8-sig'))
+        yield (posixpath.join(ContentPack.ORIGINS_PATH, ContentPack.ORIGINS_FILENAME),
+               json.dumps(self.origins, ensure_ascii=False).encode('utf-8-sig'))
+        yield (posixpath.join(ContentPack.TAGS_PATH, ContentPack.TAGS_FILENAME),
+               self.__yaml_bytes(self.tags, 'utf-8-sig'))
+        yield (posixpath.join(ContentPack.TAXONOMY_PATH, ContentPack.TAXONOMY_FILENAME),
+               json.dumps(self.taxonomy).encode('utf-8'))
+        yield ContentPack.KB_TREE_FILENAME, json.dumps(self.kb_tree, indent=2, ensure_ascii=False).encode('utf-8-sig')
+        yield ContentPack.PROPS_FILENAME, self.properties.encode('utf-8')
+
+    def __iter_rule_files(self, obj_type):
         """
-        Дамп Origins
+        Файлы правил
 
-        :param base_path: каталог для дампа
-        :return:
+        :param obj_type:
+        :return: генератор (относительный путь, содержимое)
         """
-        origins_path = os.path.join(base_path, ContentPack.ORIGINS_PATH)
-        os.mkdir(origins_path)
-        origins_filename = os.path.join(origins_path, ContentPack.ORIGINS_FILENAME)
-        with open(origins_filename, 'wt', encoding='utf-8-sig') as origins_file:
-            json.dump(self.origins, origins_file, ensure_ascii=False)
+        data_path = self.NAMES[obj_type]['PATH']
+        for rule in self.NAMES[obj_type]['LIST'].values():
+            loaded_for_dump = isinstance(rule, LazyRule) and not rule.is_loaded
+            base_dir = posixpath.join(data_path, rule.ObjectId)
+            code_filename = posixpath.join(base_dir, self.NAMES[obj_type]['FILENAME'])
 
-    def __dump_tags(self, base_path):
-        """
-        Дамп tags
+            if self.NAMES[obj_type]['RULE_FILE_TYPE'] == 'text':
+                yield code_filename, rule.code.encode('utf-8-sig')
+            else:
+                yield code_filename, self.__yaml_bytes(rule.code, 'utf-8-sig')
 
-        :param base_path: каталог для дампа
-        :return:
-        """
-        tags_path = os.path.join(base_path, ContentPack.TAGS_PATH)
-        os.mkdir(tags_path)
-        tags_filename = os.path.join(tags_path, ContentPack.TAGS_FILENAME)
-        with open(tags_filename, 'wt', encoding='utf-8-sig') as tags_file:
-            yaml.safe_dump(self.tags, tags_file, allow_unicode=True)
-
-    def __dump_taxonomy(self, base_path):
-        """
-        Дамп таксономии
+            yield posixpath.join(base_dir, self.METADATA_FILENAME), self.__yaml_bytes(rule.meta, 'utf-8-sig')
 
-        :param base_path: каталог для дампа
-        :return:
-        """
-        taxonomy_path = os.path.join(base_path, ContentPack.TAXONOMY_PATH)
-        os.mkdir(taxonomy_path)
-        taxonomy_filename = os.path.join(taxonomy_path, ContentPack.TAXONOMY_FILENAME)
-        with open(taxonomy_filename, 'wt', encoding='utf-8') as taxonomy_file:
-            json.dump(self.taxonomy, taxonomy_file)
+            if rule.i18n_ru:
+                yield (posixpath.join(base_dir, self.DESCR_PATH, self.DESCR_RU_FILENAME),
+                       self.__yaml_bytes(rule.i18n_ru, 'utf-8-sig'))
 
-    def __dump_kb_tree(self, base_path):
-        """
-        Дамп структуры набора установки
+            if loaded_for_dump:
+                rule.evict()
 
-        :param base_path: каталог для дампа
-        :return:
-        """
-        kb_tree_path = os.path.join(base_path, ContentPack.KB_TREE_FILENAME)
-        with open(kb_tree_path, 'wt', encoding='utf-8-sig') as kb_tree_file:
-            json.dump(self.kb_tree, kb_tree_file, indent=2, ensure_ascii=False)
+    @staticmethod
+    def __yaml_bytes(data, encoding):
+        return _yaml_dump(data).encode(encoding)
 
     def __dump_props(self, base_path):
         """
         Дамп props
 
-        :param base_path: каталог для дампа
+        :param base_path:
         :return:
         """
         props_path = os.path.join(base_path, ContentPack.PROPS_FILENAME)
@@ -640,7 +978,7 @@ class ContentPack:
         """
         ec_filename = os.path.join(ec_path, ContentPack.EC_FILENAME)
         with open(ec_filename, 'wt', encoding='utf-8') as ec_file:
-            yaml.safe_dump(self.event_categories, ec_file, allow_unicode=True)
+            _yaml_dump(self.event_categories, ec_file)
 
     def __dump_tags_tree(self, tags_path):
         """
@@ -651,7 +989,7 @@ class ContentPack:
         """
         tags_filename = os.path.join(tags_path, ContentPack.TAGS_FILENAME)
         with open(tags_filename, 'wt', encoding='utf-8') as tags_file:
-            yaml.safe_dump(self.tags, tags_file, allow_unicode=True)
+            _yaml_dump(self.tags, tags_file)
 
     def __dump_rule_tree(self, id, name, path, obj_type):
         """
@@ -664,13 +1002,14 @@ class ContentPack:
         :return:
         """
         rule = self.NAMES[obj_type]['LIST'][id]
+        loaded_for_dump = isinstance(rule, LazyRule) and not rule.is_loaded
         base_dir = os.path.join(path, name)
 
         if not os.path.isdir(base_dir):
             os.mkdir(base_dir)
 
         with open(os.path.join(base_dir, 'id.yaml'), 'wt') as idfile:
-            yaml.safe_dump({'id': rule.ObjectId}, idfile, allow_unicode=True)
+            _yaml_dump({'id': rule.ObjectId}, idfile)
 
         rule_path = os.path.join(base_dir, self.NAMES[obj_type]['FILENAME'])
         if self.NAMES[obj_type]['RULE_FILE_TYPE'] == 'text':
@@ -678,11 +1017,11 @@ class ContentPack:
                 rule_file.write(rule.code)
         else:
             with open(rule_path, 'wt', encoding='utf-8') as rule_file:
-                yaml.safe_dump(rule.code, rule_file, allow_unicode=True)
+                _yaml_dump(rule.code, rule_file)
 
         meta_path = os.path.join(base_dir, self.METADATA_FILENAME)
         with open(meta_path, 'wt', encoding='utf-8') as meta_file:
-            yaml.safe_dump(rule.meta, meta_file, allow_unicode=True)
+            _yaml_dump(rule.meta, meta_file)
 
         if rule.i18n_ru:
             i18n_dir = os.path.join(base_dir, self.DESCR_PATH)
@@ -690,14 +1029,18 @@ class ContentPack:
                 os.mkdir(i18n_dir)
             desc_path = os.path.join(i18n_dir, self.DESCR_RU_FILENAME)
             with open(desc_path, 'wt', encoding='utf-8') as desc_file:
-                yaml.safe_dump(rule.i18n_ru, desc_file, allow_unicode=True)
+                _yaml_dump(rule.i18n_ru, desc_file)
 
-    def __dump_tree_level(self, level, path):
+        if loaded_for_dump:
+            rule.evict()
+
+    def __dump_tree_level(self, level, path, object_ids=None):
         """
         Дамп уровня в дереве
 
         :param level: уровень
         :param path: путь
+        :param object_ids: ObjectId правил для дампа, None - все правила
         :return:
         """
         for element in level:
@@ -716,6 +1059,8 @@ class ContentPack:
                     rule_type = self.TREE_TO_NAME[kind]
                     name = element['Name']
                     object_id = element['Id']
+                    if object_ids is not None and object_id not in object_ids:
+                        continue
                     self.__dump_rule_tree(object_id, name, path, rule_type)
 
             elif 'Items' in element:
@@ -724,19 +1069,21 @@ class ContentPack:
                 items_path = os.path.join(path, name)
                 if not os.path.isdir(items_path):
                     os.mkdir(items_path)
-                self.__dump_tree_level(items, items_path)
+                self.__dump_tree_level(items, items_path, object_ids)
 
-    def dump_pack_to_tree_folder(self, base_path):
+    def dump_pack_to_tree_folder(self, base_path, object_ids=None):
         """
         Дамп набора установки в иерархическую структуру
 
         :param base_path: путь для дампа
+        :param object_ids: ObjectId правил, которые надо выгрузить (например, изменившиеся
+            с прошлой синхронизации, см. KBDeltaSync). None - выгрузить все правила
         :return:
         """
         if not os.path.isdir(base_path):
             os.mkdir(base_path)
 
-        self.__dump_tree_level(self.kb_tree, base_path)
+        self.__dump_tree_level(self.kb_tree, base_path, object_ids)
         self.__dump_props(base_path)
 
     # ------------------------------- Loaders (Иерархическая структура) --------------------------------------------
@@ -747,6 +1094,16 @@ class ContentPack:
         :param base_path: каталог для загрузки
         :return:
         """
+        self.load_tree_from_fs(DirFS(base_path))
+
+    def load_tree_from_fs(self, fs):
+        """
+        Загрузка набора установки из иерархической структуры
+
+        :param fs: PackFS с иерархической структурой
+        :return:
+        """
+        self.fs = fs if self.lazy else None
         tree = [
             {
                 'Kind': 'Taxonomy',
@@ -766,128 +1123,111 @@ class ContentPack:
             },
         ]
 
-        self.__load_tree_taxonomy(base_path)
-        self.__load_tree_origins(base_path)
-        self.__load_tree_event_categories(base_path)
-        self.__load_tree_tags(base_path)
-        tree.extend(self.__load_tree_level(base_path)['Items'])
+        self.__load_tree_taxonomy(fs)
+        self.__load_tree_origins(fs)
+        self.__load_tree_event_categories(fs)
+        self.__load_tree_tags(fs)
+        tasks = []
+        tree.extend(self.__load_tree_level(fs, '', tasks)['Items'])
+        self.__parse_rules(tasks)
 
         self.kb_tree = tree
 
-    def __load_tree_taxonomy(self, taxonomy_path):
+    def __load_tree_taxonomy(self, fs):
         """
         Загрузка таксономии из иерархической структуры
 
-        :param taxonomy_path: каталог для загрузки
+        :param fs: PackFS для загрузки
         :return:
         """
-        taxonomy_filename = os.path.join(taxonomy_path, ContentPack.TAXONOMY_FILENAME)
-        with open(taxonomy_filename, 'rt', encoding='utf-8') as taxonomy_file:
+        with fs.open(ContentPack.TAXONOMY_FILENAME, encoding='utf-8') as taxonomy_file:
             self.taxonomy = json.load(taxonomy_file)
 
-    def __load_tree_origins(self, origins_path):
+    def __load_tree_origins(self, fs):
         """
         Загрузка Origins
 
-        :param origins_path: каталог для загрузки
+        :param fs: PackFS для загрузки
         :return:
         """
-        origins_filename = os.path.join(origins_path, ContentPack.ORIGINS_FILENAME)
-        with open(origins_filename, 'rt', encoding='utf-8-sig') as origins_file:
+        with fs.open(ContentPack.ORIGINS_FILENAME, encoding='utf-8-sig') as origins_file:
             self.origins = json.load(origins_file)
 
-    def __load_tree_event_categories(self, ec_path):
+    def __load_tree_event_categories(self, fs):
         """
         Загрузка категорий
 
-        :param ec_path: каталог для загрузки
+        :param fs: PackFS для загрузки
         :return:
         """
-        ec_filename = os.path.join(ec_path, ContentPack.EC_FILENAME)
-        with open(ec_filename, 'rt', encoding='utf-8') as ec_file:
-            self.event_categories = yaml.full_load(ec_file)
+        with fs.open(ContentPack.EC_FILENAME, encoding='utf-8') as ec_file:
+            self.event_categories = _yaml_load(ec_file)
 
-    def __load_tree_tags(self, tags_path):
+    def __load_tree_tags(self, fs):
         """
         Загрузка tags
 
-        :param tags_path: каталог для загрузки
+        :param fs: PackFS для загрузки
         :return:
         """
-        tags_filename = os.path.join(tags_path, ContentPack.TAGS_FILENAME)
-        with open(tags_filename, 'rt', encoding='utf-8') as tags_file:
-            self.tags = yaml.full_load(tags_file)
+        with fs.open(ContentPack.TAGS_FILENAME, encoding='utf-8') as tags_file:
+            self.tags = _yaml_load(tags_file)
 
-    def __load_tree_rule(self, current_path, obj_id, obj_type):
+    def __load_tree_rule(self, fs, current_path, obj_id, obj_type, tasks):
         """
         Загрузка правила из иерархической структуры
 
+        :param fs: PackFS для загрузки
         :param current_path: текущий путь
         :param obj_id: ID объекта
         :param obj_type: тип правила
+        :param tasks: список, в который добавляется задача на разбор правила
         :return:
         """
-        rule_path = os.path.join(current_path, self.NAMES[obj_type]['FILENAME'])
-        if self.NAMES[obj_type]['RULE_FILE_TYPE'] == 'text':
-            with open(rule_path, 'rt', encoding='utf-8-sig', newline='\n') as rule_file:
-                code = rule_file.read()
+        if self.lazy:
+            self.NAMES[obj_type]['LIST'][obj_id] = LazyRule(self, obj_type, obj_id, current_path)
         else:
-            with open(rule_path, 'rt', encoding='utf-8-sig') as rule_file:
-                code = yaml.full_load(rule_file)
-
-        meta_path = os.path.join(current_path, self.METADATA_FILENAME)
-        with open(meta_path, 'rt', encoding='utf-8-sig') as meta_file:
-            meta = yaml.full_load(meta_file)
-
-        descr_path = os.path.join(current_path,
-                                  self.DESCR_PATH,
-                                  self.DESCR_RU_FILENAME)
-        i18n_ru = None
-        if os.path.isfile(descr_path):
-            with open(descr_path, 'rt', encoding='utf-8-sig') as desc_file:
-                i18n_ru = yaml.full_load(desc_file)
-
-        rule = self.NAMES[obj_type]['CONSTRUCTOR'](meta, code, i18n_ru)
-
-        self.NAMES[obj_type]['LIST'][obj_id] = rule
+            tasks.append((obj_type, obj_id, self.__read_rule(fs, current_path, obj_type)))
 
         return {
             'Kind': self.NAMES[obj_type]['KIND'],
             'Id': obj_id,
-            'Name': os.path.basename(current_path)
+            'Name': posixpath.basename(current_path)
         }
 
-    def __load_tree_level(self, current_path):
+    def __load_tree_level(self, fs, current_path, tasks):
         """
         Загрузка уровня дерева
 
+        :param fs: PackFS для загрузки
         :param current_path: путь
+        :param tasks: список, в который добавляются задачи на разбор правил
         :return:
         """
 
-        items = os.listdir(current_path)
+        items = fs.listdir(current_path)
         if 'id.yaml' in items:
             # load object
-            with open(os.path.join(current_path, 'id.yaml'), 'rt') as idfile:
-                obj_id = yaml.full_load(idfile)['id']
+            with fs.open(fs.join(current_path, 'id.yaml')) as idfile:
+                obj_id = _yaml_load(idfile)['id']
             if '-CR-' in obj_id:
-                return self.__load_tree_rule(current_path, obj_id, 'CorrelationRule')
+                return self.__load_tree_rule(fs, current_path, obj_id, 'CorrelationRule', tasks)
             elif '-ER-' in obj_id:
-                return self.__load_tree_rule(current_path, obj_id, 'EnrichmentRule')
+                return self.__load_tree_rule(fs, current_path, obj_id, 'EnrichmentRule', tasks)
             elif '-AR-' in obj_id:
-                return self.__load_tree_rule(current_path, obj_id, 'AggregationRule')
+                return self.__load_tree_rule(fs, current_path, obj_id, 'AggregationRule', tasks)
             elif '-NF-' in obj_id:
-                return self.__load_tree_rule(current_path, obj_id, 'NormalizationRule')
+                return self.__load_tree_rule(fs, current_path, obj_id, 'NormalizationRule', tasks)
             elif '-TL-' in obj_id:
-                return self.__load_tree_rule(current_path, obj_id, 'TabularList')
+                return self.__load_tree_rule(fs, current_path, obj_id, 'TabularList', tasks)
         else:
             # iterate over folders
-            base = os.path.basename(current_path)
+            base = posixpath.basename(current_path)
             objs = []
             for item in items:
-                item_path = os.path.join(current_path, item)
-                if os.path.isdir(item_path):
-                    nested_obj = self.__load_tree_level(item_path)
+                item_path = fs.join(current_path, item)
+                if fs.isdir(item_path):
+                    nested_obj = self.__load_tree_level(fs, item_path, tasks)
                     objs.append(nested_obj)
 
             return {
@@ -936,6 +1276,53 @@ class ContentPack:
 
         return nf_list, cr_list, er_list, tl_list, ar_list
 
+    def get_dependency_index(self):
+        """
+        Граф зависимостей правил набора установки от табличных списков, макросов и полей событий
+
+        :return: ContentDependencyIndex
+        """
+        return ContentDependencyIndex(self)
+
+    def subset(self, object_ids):
+        """
+        Набор установки, содержащий только указанные правила и табличные списки.
+        Таксономия, origins, категории событий и теги копируются целиком, из дерева
+        каталогов удаляются остальные правила и опустевшие каталоги.
+
+        :param object_ids: ObjectId правил и табличных списков
+        :return: ContentPack
+        """
+        object_ids = set(object_ids)
+        pack = ContentPack(None)
+        for obj_type in self.NAMES:
+            for object_id, rule in self.NAMES[obj_type]['LIST'].items():
+                if object_id in object_ids:
+                    pack.NAMES[obj_type]['LIST'][object_id] = rule
+
+        pack.event_categories = self.event_categories
+        pack.origins = self.origins
+        pack.tags = self.tags
+        pack.taxonomy = self.taxonomy
+        pack.properties = self.properties
+        pack.kb_tree = self.__subset_tree_level(self.kb_tree, object_ids)
+
+        return pack
+
+    def __subset_tree_level(self, level, object_ids):
+        ret = []
+        for element in level:
+            if 'Kind' in element:
+                if element['Kind'] in self.TREE_TO_NAME and element['Id'] not in object_ids:
+                    continue
+                ret.append(element)
+            elif 'Items' in element:
+                items = self.__subset_tree_level(element['Items'], object_ids)
+                if items:
+                    ret.append(dict(element, Items=items))
+
+        return ret
+
     def get_content_links(self):
         nf_list, cr_list, er_list, tl_list, ar_list = self.__get_folder_paths(self.kb_tree, '')
         return {
@@ -949,12 +1336,20 @@ class ContentPack:
 
 # --------------- Вспомогательные функции для работы с рабочей копией ----------------
 
-def content_folder_to_work_copy(contend_folder: str, work_copy):
+# Файл с хэшами входных данных наборов установки для инкрементальной сборки
+BUILD_STATE_FILENAME = '.build_state.json'
+
+
+def content_folder_to_work_copy(contend_folder: str, work_copy, workers=None, cache_dir=None):
     """
     Преобразование папки с выгруженным контентом в рабочую копию для Git
 
     :param contend_folder:
     :param work_copy:
+    :param workers: количество процессов для параллельного разбора файлов .kb,
+        None - разбор в текущем процессе. Выгрузка в рабочую копию выполняется
+        последовательно в порядке файлов
+    :param cache_dir: каталог кэша разобранных YAML-файлов, см. YAMLParseCache
     :return:
     """
     if os.path.isdir(contend_folder):
@@ -970,26 +1365,44 @@ def content_folder_to_work_copy(contend_folder: str, work_copy):
         if not os.path.isdir(work_copy_groups):
             os.mkdir(work_copy_groups)
 
+        kb_filenames = []
         for filename in os.listdir(contend_folder):
             if filename.endswith('.kb'):
-                sys.stdout.write('Dumping {}\n'.format(filename))
-                pack = ContentPack(os.path.join(contend_folder, filename))
-                pack.dump_pack_to_tree_folder(work_copy_content)
+                kb_filenames.append(filename)
             elif filename.endswith('.yaml'):
                 shutil.copyfile(
                     os.path.join(contend_folder, filename),
                     os.path.join(work_copy_groups, filename)
                 )
 
+        kb_paths = [os.path.join(contend_folder, i) for i in kb_filenames]
+        load_pack = partial(ContentPack, cache_dir=cache_dir)
+        if workers is not None and workers > 1 and len(kb_paths) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                _dump_packs_to_work_copy(kb_filenames, executor.map(load_pack, kb_paths), work_copy_content)
+        else:
+            _dump_packs_to_work_copy(kb_filenames, map(load_pack, kb_paths), work_copy_content)
+
+
+def _dump_packs_to_work_copy(kb_filenames, packs, work_copy_content):
+    for filename, pack in zip(kb_filenames, packs):
+        sys.stdout.write('Dumping {}\n'.format(filename))
+        pack.dump_pack_to_tree_folder(work_copy_content)
 
-def work_copy_to_content_folder(work_copy, content_folder, filters=[], optimize=False):
+
+def work_copy_to_content_folder(work_copy, content_folder, filters=[], optimize=False, incremental=False):
     """
     Преобразование рабочей копиии в структуру для загрузки в SIEM
 
+    Контент читается напрямую из рабочей копии, без копирования во временный каталог.
+
     :param work_copy: каталог рабочей копии
     :param content_folder: каталог со структурой для загрузки в SIEM
     :param filters: перечень наборов установки для загрузки в SIEM
     :param optimize: оптимизация kb-файлов
+    :param incremental: пересобирать только kb-файлы, входные данные которых (описание набора,
+        каталоги правил и статические файлы) изменились с прошлой сборки. Хэши входных данных
+        хранятся в content_folder в файле BUILD_STATE_FILENAME
     :return:
     """
     if os.path.isdir(work_copy):
@@ -1001,6 +1414,7 @@ def work_copy_to_content_folder(work_copy, content_folder, filters=[], optimize=
             'taxonomy.json'
         ]
         global_path_list = []
+        global_group_files = []
 
         work_copy_content = os.path.join(work_copy, 'Content')
         work_copy_groups = os.path.join(work_copy, 'Groups')
@@ -1008,6 +1422,27 @@ def work_copy_to_content_folder(work_copy, content_folder, filters=[], optimize=
         if not os.path.isdir(content_folder):
             os.mkdir(content_folder)
 
+        state_path = os.path.join(content_folder, BUILD_STATE_FILENAME)
+        build_state = {}
+        if incremental and os.path.isfile(state_path):
+            with open(state_path, 'rt', encoding='utf-8') as state_file:
+                build_state = json.load(state_file)
+
+        def build(kb_filename, group_files, path_list):
+            kb_path = os.path.join(content_folder, kb_filename)
+            inputs_hash = None
+            if incremental:
+                inputs_hash = _hash_work_copy_inputs(work_copy_content, group_files, path_list + STATIC_FILES)
+                if build_state.get(kb_filename) == inputs_hash and os.path.isfile(kb_path):
+                    sys.stdout.write('Skipping {}, not changed\n'.format(kb_filename))
+                    return
+
+            pack = ContentPack(DirFS(work_copy_content, include=path_list + STATIC_FILES))
+            pack.dump_to_kb_file(kb_path)
+
+            if incremental:
+                build_state[kb_filename] = inputs_hash
+
         for group in os.listdir(work_copy_groups):
 
             if filters and group not in filters:
@@ -1015,51 +1450,63 @@ def work_copy_to_content_folder(work_copy, content_folder, filters=[], optimize=
 
             group_filepath = os.path.join(work_copy_groups, group)
             with open(group_filepath, 'rt', encoding='utf-8') as kb_meta_file:
-                kb_meta = yaml.full_load(kb_meta_file)
+                kb_meta = _yaml_load(kb_meta_file)
                 shutil.copyfile(group_filepath,
                                 os.path.join(content_folder, group)
                                 )
                 if 'kb_tree' in kb_meta:
-                    if optimize:
-                        for content_type in kb_meta['kb_tree']:
-                            global_path_list.extend(kb_meta['kb_tree'][content_type])
+                    path_list = []
+                    for content_type in kb_meta['kb_tree']:
+                        path_list.extend(kb_meta['kb_tree'][content_type])
 
+                    if optimize:
+                        global_path_list.extend(path_list)
+                        global_group_files.append(group_filepath)
                     else:
                         # По файлу kb на каждый набор установки
-                        with TemporaryDirectory() as tmp_dir:
-                            path_list = []
-                            for content_type in kb_meta['kb_tree']:
-                                path_list.extend(kb_meta['kb_tree'][content_type])
-
-                            for path_item in path_list:
-                                src_path = os.path.normpath(os.path.join(work_copy_content, path_item))
-                                dst_path = os.path.normpath(os.path.join(tmp_dir, path_item))
-                                shutil.copytree(src_path, dst_path)
-
-                            for static_file in STATIC_FILES:
-                                src_file = os.path.join(work_copy_content, static_file)
-                                dst_file = os.path.join(tmp_dir, static_file)
-                                shutil.copyfile(src_file, dst_file)
-
-                            pack = ContentPack(tmp_dir)
-                            pack.dump_to_kb_file(
-                                os.path.join(content_folder, group.replace('.yaml', '.kb'))
-                            )
+                        build(group.replace('.yaml', '.kb'), [group_filepath], path_list)
 
         if optimize:
             # Оптимизация контента. Весь контент загружается в единый файл kb
-            with TemporaryDirectory() as tmp_dir:
-                for path_item in global_path_list:
-                    src_path = os.path.normpath(os.path.join(work_copy_content, path_item))
-                    dst_path = os.path.normpath(os.path.join(tmp_dir, path_item))
-                    shutil.copytree(src_path, dst_path)
-
-                for static_file in STATIC_FILES:
-                    src_file = os.path.join(work_copy_content, static_file)
-                    dst_file = os.path.join(tmp_dir, static_file)
-                    shutil.copyfile(src_file, dst_file)
-
-                pack = ContentPack(tmp_dir)
-                pack.dump_to_kb_file(
-                    os.path.join(content_folder, 'ContentPack.kb')
-                )
+            build('ContentPack.kb', global_group_files, global_path_list)
+
+        if incremental:
+            tmp_path = state_path + '.tmp'
+            with open(tmp_path, 'wt', encoding='utf-8') as state_file:
+                json.dump(build_state, state_file, indent=2, sort_keys=True)
+            os.replace(tmp_path, state_path)
+
+
+def _hash_work_copy_inputs(work_copy_content, group_files, path_list):
+    """
+    Хэш входных данных сборки набора установки
+
+    :param work_copy_content: каталог Content рабочей копии
+    :param group_files: файлы описания наборов установки
+    :param path_list: пути в рабочей копии (каталоги правил и файлы)
+    :return: sha256 hexdigest
+    """
+    digest = sha256()
+
+    def update_file(file_path, name):
+        digest.update(name.encode('utf-8') + b'\0')
+        with open(file_path, 'rb') as data_file:
+            digest.update(data_file.read())
+
+    for group_file in sorted(group_files):
+        update_file(group_file, os.path.basename(group_file))
+
+    for path_item in sorted(set(path_list)):
+        full_path = os.path.normpath(os.path.join(work_copy_content, path_item))
+        if os.path.isfile(full_path):
+            update_file(full_path, path_item)
+        elif os.path.isdir(full_path):
+            for dir_path, dir_names, file_names in os.walk(full_path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    file_path = os.path.join(dir_path, file_name)
+                    update_file(file_path, os.path.relpath(file_path, work_copy_content).replace(os.sep, '/'))
+        else:
+            digest.update(path_item.encode('utf-8') + b'\0missing')
+
+    return digest.hexdigest()
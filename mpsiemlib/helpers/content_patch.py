@@ -0,0 +1,281 @@
+# coding: utf-8
+
+import io
+import os
+import json
+
+from hashlib import sha256
+from tempfile import TemporaryDirectory
+
+from mpsiemlib.common import LoggingHandler
+
+from .kb_delta import KBSnapshot, OBJECT_KIND_TO_CONTENT_TYPE
+from .content_helpers import ContentPack, LazyRule
+
+
+class ContentPatchError(Exception):
+    """
+    Ошибка загрузки изменений в KB
+    """
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        # код ответа KnowledgeBase.import_group
+        self.status_code = status_code
+
+
+def content_hash(code) -> str:
+    """
+    Хэш тела правила или схемы табличного списка, не зависящий от переводов строк
+
+    :param code: код правила (str) или схема табличного списка (dict)
+    :return: sha256
+    """
+    if isinstance(code, str):
+        data = code.replace('\r\n', '\n').strip()
+    else:
+        data = json.dumps(code, sort_keys=True, ensure_ascii=False, default=str)
+
+    return sha256(data.encode('utf-8')).hexdigest()
+
+
+def object_hash(rule) -> str:
+    """
+    Хэш объекта набора установки: код или схема табличного списка вместе с
+    metainfo.yaml и i18n_ru.yaml
+
+    :param rule: правило или табличный список ContentPack
+    :return: sha256
+    """
+    return content_hash({'code': content_hash(rule.code),
+                         'meta': rule.meta,
+                         'i18n_ru': rule.i18n_ru or {}})
+
+
+class ContentPatch(LoggingHandler):
+    """
+    Минимальный набор изменений между локальным набором установки и KB.
+
+    Объекты сравниваются по хэшу object_hash: код правила или схема табличного
+    списка, metainfo.yaml и описания. Объекты KB для сравнения берутся из экспорта
+    набора установки (без group_id - всех корневых наборов установки), поэтому
+    хэш с обеих сторон считается одинаково. Хэши объектов KB сохраняются в снимке
+    вместе с листингом, экспорт запрашивается, только если у какого-либо объекта
+    изменилась строка листинга. Объект, которого нет в экспорте, считается измененным.
+
+    В KB загружается .kb только с добавленными и измененными объектами.
+    Удаление объектов, которых нет в локальном наборе, выполняется только по запросу.
+
+    Usage:
+        patch = ContentPatch(kb_module, 'dev', ContentPack('work_copy.kb'), 'dev.patch.json')
+        patch.diff(group_id=group_id)
+        patch.apply()
+        patch.commit()
+    """
+
+    def __init__(self, kb_module, db_name: str, pack, store_path: str = None):
+        """
+        :param kb_module: модуль KnowledgeBase
+        :param db_name: имя БД
+        :param pack: ContentPack с локальным контентом
+        :param store_path: файл снимка KB для следующих запусков, None - без снимка
+        """
+        LoggingHandler.__init__(self)
+        self.kb = kb_module
+        self.db_name = db_name
+        self.pack = pack
+        self.store_path = store_path
+        self.snapshot = KBSnapshot.load(store_path) if store_path is not None else KBSnapshot()
+        self.current = None
+        # {'added': {'ObjectId'}, 'modified': {'ObjectId'}, 'unchanged': {'ObjectId'}, 'removed': {'KB ID'}}
+        self.changes = None
+        # {'ObjectId': хэш локального тела}
+        self.__local = {}
+        self.__scope = (None, None)
+
+    def diff(self, filters=None, group_id: str = None) -> dict:
+        """
+        Сравнить локальный набор установки с KB
+
+        :param filters: см KnowledgeBase.get_all_objects
+        :param group_id: ID набора установки в KB, с которым идет сравнение. None - вся БД
+        :return: {'added': {'ObjectId'}, 'modified': {'ObjectId'}, 'unchanged': {'ObjectId'},
+            'removed': {'KB ID'}}
+        """
+        self.__scope = (filters, group_id)
+        self.__local = self.__local_hashes()
+
+        current = KBSnapshot()
+        remote = {}
+        for i in self.__list_objects():
+            current.objects[i.get('id')] = i
+            remote[i.get('guid')] = i
+
+        changes = {'added': set(self.__local) - set(remote),
+                   'modified': set(),
+                   'unchanged': set(),
+                   'removed': {remote[i].get('id') for i in set(remote) - set(self.__local)}}
+        remote_hashes = self.__remote_hashes([remote[i] for i in set(self.__local) & set(remote)])
+        for guid in set(self.__local) & set(remote):
+            obj = remote[guid]
+            body_hash = remote_hashes.get(guid)
+            if body_hash is not None:
+                current.bodies[obj.get('id')] = body_hash
+            if body_hash == self.__local[guid]:
+                changes['unchanged'].add(guid)
+            else:
+                changes['modified'].add(guid)
+
+        self.current = current
+        self.changes = changes
+
+        self.log.info('status=success, action=diff, msg="Got content patch", db="{}", '
+                      'added={}, modified={}, removed={}'.format(self.db_name,
+                                                                 len(changes['added']),
+                                                                 len(changes['modified']),
+                                                                 len(changes['removed'])))
+
+        return changes
+
+    def get_deletions(self) -> list:
+        """
+        Объекты KB, которых нет в локальном наборе установки
+
+        :return: [{'id': 'KB ID', 'item_type': 'CorrelationRule', 'name': 'rule_name'}],
+            см KnowledgeBase.delete_content_item
+        """
+        return [{'id': i,
+                 'item_type': self.current.objects[i].get('object_kind'),
+                 'name': self.current.objects[i].get('name')} for i in sorted(self.changes['removed'])]
+
+    def build(self, kb_file=None):
+        """
+        Собрать .kb с добавленными и измененными объектами
+
+        :param kb_file: путь к файлу или бинарный файловый объект, None - io.BytesIO
+        :return: kb_file, файловый объект перемотан в начало
+        """
+        if kb_file is None:
+            kb_file = io.BytesIO()
+
+        self.pack.subset(self.changes['added'] | self.changes['modified']).dump_to_kb_file(kb_file)
+        if not isinstance(kb_file, str):
+            kb_file.seek(0)
+
+        return kb_file
+
+    def apply(self, mode: str = None, remove_deleted: bool = False, on_progress=None) -> dict:
+        """
+        Загрузить изменения в KB
+
+        :param mode: режим импорта, по умолчанию KnowledgeBase.IMPORT_ADD_AND_UPDATE
+        :param remove_deleted: удалить из KB объекты, которых нет в локальном наборе установки
+        :param on_progress: см KnowledgeBase.import_group
+        :return: {'imported': {'ObjectId'}, 'removed': {'KB ID'}}
+        """
+        ret = {'imported': set(), 'removed': set()}
+
+        object_ids = self.changes['added'] | self.changes['modified']
+        if object_ids:
+            status_code = self.kb.import_group(self.db_name, self.build(),
+                                               mode or self.kb.IMPORT_ADD_AND_UPDATE, on_progress)
+            if status_code != 201:
+                self.log.error('status=failed, action=apply, msg="Content patch import failed", '
+                               'db="{}", code={}'.format(self.db_name, status_code))
+                raise ContentPatchError('Content patch import failed', status_code)
+            ret['imported'] = object_ids
+
+        if remove_deleted:
+            for i in self.get_deletions():
+                r = self.kb.delete_content_item(self.db_name, i['id'], i['item_type'])
+                if r.status_code == 204:
+                    ret['removed'].add(i['id'])
+
+        self.log.info('status=success, action=apply, msg="Content patch applied", db="{}", '
+                      'imported={}, removed={}'.format(self.db_name, len(ret['imported']), len(ret['removed'])))
+
+        return ret
+
+    def commit(self):
+        """
+        Сохранить снимок KB после apply как базу для следующего diff
+
+        :return:
+        """
+        current = KBSnapshot()
+        for i in self.__list_objects():
+            current.objects[i.get('id')] = i
+            # после apply в KB локальная версия объекта
+            if i.get('guid') in self.__local:
+                current.bodies[i.get('id')] = self.__local[i.get('guid')]
+
+        if self.store_path is not None:
+            current.save(self.store_path)
+        self.snapshot = current
+
+    def __list_objects(self):
+        filters, group_id = self.__scope
+        for i in self.kb.get_all_objects(self.db_name, filters, group_id):
+            if i.get('object_kind') in OBJECT_KIND_TO_CONTENT_TYPE:
+                yield i
+
+    def __local_hashes(self) -> dict:
+        ret = {}
+        for obj_type in self.pack.NAMES:
+            for object_id, rule in self.pack.NAMES[obj_type]['LIST'].items():
+                loaded_for_hash = isinstance(rule, LazyRule) and not rule.is_loaded
+                ret[object_id] = object_hash(rule)
+                if loaded_for_hash:
+                    rule.evict()
+
+        return ret
+
+    def __remote_hashes(self, objects: list) -> dict:
+        """
+        Хэши объектов KB: из снимка, если строка листинга не изменилась, иначе по экспорту
+
+        :param objects: строки листинга KnowledgeBase.get_all_objects
+        :return: {'ObjectId': хэш}
+        """
+        ret = {}
+        required = set()
+        for obj in objects:
+            kb_id = obj.get('id')
+            previous = self.snapshot.objects.get(kb_id)
+            if previous is not None and previous.get('hash') == obj.get('hash') and kb_id in self.snapshot.bodies:
+                ret[obj.get('guid')] = self.snapshot.bodies[kb_id]
+            else:
+                required.add(obj.get('guid'))
+
+        if required:
+            ret.update(self.__export_hashes(required))
+
+        return ret
+
+    def __export_hashes(self, object_ids: set) -> dict:
+        _, group_id = self.__scope
+        if group_id is not None:
+            group_ids = [group_id]
+        else:
+            group_ids = [k for k, v in self.kb.get_groups_list(self.db_name).items() if v.get('parent_id') is None]
+
+        ret = {}
+        with TemporaryDirectory() as tmp_dir:
+            for i in group_ids:
+                kb_path = os.path.join(tmp_dir, f'{i}.kb')
+                if self.kb.export_group(self.db_name, i, kb_path) == 0:
+                    continue
+                pack = ContentPack(kb_path, lazy=True)
+                try:
+                    for obj_type in pack.NAMES:
+                        for object_id, rule in pack.NAMES[obj_type]['LIST'].items():
+                            if object_id in object_ids and object_id not in ret:
+                                ret[object_id] = object_hash(rule)
+                                rule.evict()
+                finally:
+                    pack.close()
+
+        self.log.info('status=success, action=diff, msg="Got {} of {} objects from KB export", '
+                      'db="{}"'.format(len(ret), len(object_ids), self.db_name))
+
+        return ret
@@ -0,0 +1,220 @@
+# coding: utf-8
+
+import os
+import json
+import yaml
+import shutil
+
+from hashlib import sha256
+
+from mpsiemlib.common import LoggingHandler, MPContentTypes
+
+# Маппинг ObjectKind из листинга KB в тип контента для KnowledgeBase.get_rule
+OBJECT_KIND_TO_CONTENT_TYPE = {
+    'NormalizationRule': MPContentTypes.NORMALIZATION,
+    'CorrelationRule': MPContentTypes.CORRELATION,
+    'EnrichmentRule': MPContentTypes.ENRICHMENT,
+    'AggregationRule': MPContentTypes.AGGREGATION,
+    'TabularList': MPContentTypes.TABLE,
+}
+
+# Поля тела объекта, меняющиеся при установке и компиляции
+BODY_STATUS_FIELDS = ('deployment_status', 'compilation_status', 'compilation_sdk', 'hash')
+
+
+def body_hash(body: dict) -> str:
+    """
+    Хэш тела объекта из KnowledgeBase.get_rule или get_table_info: код, имя,
+    папка, описания, наборы установки и остальные поля, кроме статусов установки и компиляции
+
+    :param body: описание объекта
+    :return: sha256
+    """
+    body = {k: v for k, v in body.items() if k not in BODY_STATUS_FIELDS}
+    return sha256(json.dumps(body, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+class KBSnapshot:
+    """
+    Снимок листинга объектов KB
+    """
+
+    def __init__(self, objects=None, bodies=None):
+        # {'KB ID': строка листинга KnowledgeBase.get_all_objects}
+        self.objects = objects if objects is not None else {}
+        # {'KB ID': хэш тела объекта}
+        self.bodies = bodies if bodies is not None else {}
+
+    @staticmethod
+    def load(path):
+        """
+        Загрузка снимка из локального хранилища
+
+        :param path: файл снимка
+        :return: KBSnapshot, пустой если файла нет
+        """
+        if not os.path.isfile(path):
+            return KBSnapshot()
+
+        with open(path, 'rt', encoding='utf-8') as snapshot_file:
+            data = json.load(snapshot_file)
+
+        return KBSnapshot(data.get('objects'), data.get('bodies'))
+
+    def save(self, path):
+        """
+        Сохранение снимка в локальное хранилище
+
+        :param path: файл снимка
+        :return:
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wt', encoding='utf-8') as snapshot_file:
+            json.dump({'objects': self.objects, 'bodies': self.bodies}, snapshot_file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def diff(self, other):
+        """
+        Изменения в другом снимке относительно текущего
+
+        :param other: более новый KBSnapshot
+        :return: {'added': {'KB ID'}, 'removed': {'KB ID'}, 'modified': {'KB ID'}}
+        """
+        old_ids = set(self.objects)
+        new_ids = set(other.objects)
+        modified = {i for i in old_ids & new_ids if self.objects[i].get('hash') != other.objects[i].get('hash')}
+
+        return {'added': new_ids - old_ids,
+                'removed': old_ids - new_ids,
+                'modified': modified}
+
+
+class KBDeltaSync(LoggingHandler):
+    """
+    Инкрементальная синхронизация контента KB.
+
+    Листинг объектов сравнивается со снимком предыдущего запуска, тела запрашиваются
+    только для добавленных и измененных объектов.
+
+    Usage:
+        sync = KBDeltaSync(kb_module, 'dev', 'dev.snapshot.json')
+        sync.refresh()
+        sync.fetch_changed()
+        sync.dump_changed_to_work_copy(ContentPack('dev.kb'), 'work_copy/Content')
+        sync.commit()
+    """
+
+    def __init__(self, kb_module, db_name: str, store_path: str):
+        LoggingHandler.__init__(self)
+        self.kb = kb_module
+        self.db_name = db_name
+        self.store_path = store_path
+        self.snapshot = KBSnapshot.load(store_path)
+        self.current = None
+        self.delta = None
+
+    def refresh(self, filters=None) -> dict:
+        """
+        Получить листинг KB и вычислить изменения с прошлой синхронизации
+
+        :param filters: см KnowledgeBase.get_all_objects
+        :return: {'added': {'KB ID'}, 'removed': {'KB ID'}, 'modified': {'KB ID'}}
+        """
+        current = KBSnapshot()
+        for i in self.kb.get_all_objects(self.db_name, filters):
+            current.objects[i.get('id')] = i
+
+        self.delta = self.snapshot.diff(current)
+        # Хэши тел неизменившихся объектов переносятся из прошлого снимка
+        current.bodies = {k: v for k, v in self.snapshot.bodies.items()
+                          if k in current.objects and k not in self.delta['modified']}
+        self.current = current
+
+        self.log.info('status=success, action=refresh, msg="Got KB delta", db="{}", '
+                      'added={}, removed={}, modified={}'.format(self.db_name,
+                                                                 len(self.delta['added']),
+                                                                 len(self.delta['removed']),
+                                                                 len(self.delta['modified'])))
+
+        return self.delta
+
+    def fetch_changed(self) -> dict:
+        """
+        Получить тела добавленных и измененных объектов.
+        Объекты, у которых тело не изменилось (см body_hash), исключаются из delta['modified'].
+
+        :return: {'KB ID': описание объекта из get_rule или get_table_info}
+        """
+        ret = {}
+        unchanged = set()
+        for obj_id in self.delta['added'] | self.delta['modified']:
+            obj = self.current.objects[obj_id]
+            content_type = OBJECT_KIND_TO_CONTENT_TYPE.get(obj.get('object_kind'))
+            if content_type is None:
+                self.log.error('status=failed, action=fetch_changed, msg="Unsupported object kind {}", '
+                               'db="{}", id="{}"'.format(obj.get('object_kind'), self.db_name, obj_id))
+                continue
+
+            if content_type == MPContentTypes.TABLE:
+                body = self.kb.get_table_info(self.db_name, obj_id)
+            else:
+                body = self.kb.get_rule(self.db_name, content_type, obj_id)
+
+            obj_hash = body_hash(body)
+            if obj_id in self.delta['modified'] and self.snapshot.bodies.get(obj_id) == obj_hash:
+                unchanged.add(obj_id)
+            self.current.bodies[obj_id] = obj_hash
+            ret[obj_id] = body
+
+        self.delta['modified'] -= unchanged
+
+        return ret
+
+    def changed_guids(self) -> set:
+        """
+        ObjectId добавленных и измененных объектов
+
+        :return: {'LOC-CR-1'}
+        """
+        return {self.current.objects[i].get('guid') for i in self.delta['added'] | self.delta['modified']}
+
+    def dump_changed_to_work_copy(self, pack, work_copy_content: str, remove_deleted=True):
+        """
+        Выгрузить в рабочую копию только изменившиеся объекты
+
+        :param pack: ContentPack с актуальным контентом
+        :param work_copy_content: каталог Content рабочей копии
+        :param remove_deleted: удалить из рабочей копии объекты, удаленные из KB,
+            и прежние каталоги переименованных или перемещенных объектов
+        :return:
+        """
+        pack.dump_pack_to_tree_folder(work_copy_content, object_ids=self.changed_guids())
+
+        if not remove_deleted:
+            return
+
+        moved = {i for i in self.delta['modified'] if self.__object_path(self.snapshot.objects[i]) !=
+                 self.__object_path(self.current.objects[i])}
+        for obj_id in self.delta['removed'] | moved:
+            obj = self.snapshot.objects[obj_id]
+            obj_path = os.path.join(work_copy_content, *self.__object_path(obj))
+            id_path = os.path.join(obj_path, 'id.yaml')
+            if not os.path.isfile(id_path):
+                continue
+            with open(id_path, 'rt') as idfile:
+                if yaml.safe_load(idfile).get('id') != obj.get('guid'):
+                    continue
+            shutil.rmtree(obj_path)
+
+    @staticmethod
+    def __object_path(obj: dict) -> tuple:
+        return obj.get('folder_path', ''), obj.get('name', '')
+
+    def commit(self):
+        """
+        Сохранить текущий снимок как базу для следующей синхронизации
+
+        :return:
+        """
+        self.current.save(self.store_path)
+        self.snapshot = self.current
@@ -0,0 +1,160 @@
+# coding: utf-8
+
+import threading
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Optional, List
+
+from mpsiemlib.common import LoggingHandler
+
+
+class KBDeployQueue(LoggingHandler):
+    """
+    Очередь установок контента KB.
+
+    Установки запускаются по мере завершения предыдущих, но не больше
+    Settings.kb_deploy_concurrency одновременно. Статусы всех запущенных
+    установок опрашиваются одним OperationWaiter модуля KnowledgeBase.
+    Все установки запускаются в потоке очереди, ошибка запуска возвращается
+    через Future установки. После работы очередь закрывается close().
+
+    Usage:
+        def progress(job, status):
+            print(job['name'], status['percentage'], status['errors'])
+
+        with KBDeployQueue(kb_module, 'dev', on_progress=progress) as queue:
+            for group_id in groups:
+                queue.install_objects_by_group_id(group_id)
+            statuses = queue.wait()
+    """
+
+    def __init__(self, kb_module, db_name: str, max_concurrent: Optional[int] = None,
+                 on_progress: Optional[Callable[[dict, dict], None]] = None):
+        """
+        :param kb_module: модуль KnowledgeBase
+        :param db_name: имя БД
+        :param max_concurrent: количество одновременных установок, по умолчанию
+            Settings.kb_deploy_concurrency
+        :param on_progress: функция (job, status), вызываемая при каждой проверке статуса
+            установки, см KnowledgeBase.get_deploy_status
+        """
+        LoggingHandler.__init__(self)
+        self.kb = kb_module
+        self.db_name = db_name
+        self.max_concurrent = max_concurrent or kb_module.settings.kb_deploy_concurrency
+        self.on_progress = on_progress
+        # [{'name': 'group ...', 'deploy_id': '...', 'status': {...}, 'future': Future}]
+        self.jobs = []
+        self.__pending = deque()
+        self.__running = 0
+        self.__lock = threading.Lock()
+        # установки запускаются в отдельном потоке: колбэк завершения выполняется
+        # в потоке OperationWaiter и не должен блокировать опрос остальных операций модуля
+        self.__starter = ThreadPoolExecutor(max_workers=1, thread_name_prefix='KBDeployQueue')
+
+    def install_objects(self, guids_list: list, do_remove=False) -> Future:
+        """
+        Поставить в очередь инсталляцию/деинсталляцию объектов, см KnowledgeBase.install_objects
+
+        :param guids_list: список ID элементов контента
+        :param do_remove: False - инсталляция контента, True - деинсталляция контента
+        :return: Future со статусом установки
+        """
+        operation = 'uninstall' if do_remove else 'install'
+        return self.__submit('{} {} objects'.format(operation, len(guids_list)),
+                             lambda: self.kb.install_objects(self.db_name, guids_list, do_remove))
+
+    def install_objects_by_group_id(self, group_id: Optional[str]) -> Future:
+        """
+        Поставить в очередь установку набора, см KnowledgeBase.install_objects_by_group_id
+
+        :param group_id: ID набора, None для установки всего контента
+        :return: Future со статусом установки
+        """
+        return self.__submit('group {}'.format(group_id),
+                             lambda: self.kb.install_objects_by_group_id(self.db_name, group_id))
+
+    def wait(self, timeout: Optional[float] = None) -> List[dict]:
+        """
+        Дождаться завершения всех установок
+
+        :param timeout: максимальное время ожидания (сек)
+        :return: статусы установок в порядке постановки в очередь
+        """
+        wait([i['future'] for i in self.jobs], timeout=timeout)
+
+        return [i['status'] for i in self.jobs]
+
+    def close(self):
+        """
+        Дождаться завершения всех установок и остановить поток запуска установок
+        """
+        self.wait()
+        self.__starter.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __submit(self, name: str, start: Callable[[], str]) -> Future:
+        job = {'name': name, 'start': start, 'deploy_id': None, 'status': None, 'future': Future()}
+        with self.__lock:
+            self.jobs.append(job)
+            self.__pending.append(job)
+
+        self.__starter.submit(self.__schedule)
+
+        return job['future']
+
+    def __schedule(self):
+        while True:
+            with self.__lock:
+                if self.__running >= self.max_concurrent or len(self.__pending) == 0:
+                    return
+                job = self.__pending.popleft()
+                self.__running += 1
+
+            self.log.info('status=prepare, action=deploy, msg="Start {}", db="{}"'.format(job['name'], self.db_name))
+            try:
+                job['deploy_id'] = job['start']()
+                deploy = self.kb.wait_deploy(self.db_name, job['deploy_id'],
+                                             on_progress=lambda status, j=job: self.__progress(j, status))
+            except Exception as err:
+                self.__finish(job, None, err)
+                continue
+            deploy.add_done_callback(lambda f, j=job: self.__finish(j, f.result() if f.exception() is None else None,
+                                                                    f.exception()))
+
+    def __progress(self, job: dict, status: dict):
+        job['status'] = status
+        if self.on_progress is None:
+            return
+        try:
+            self.on_progress(job, status)
+        except Exception as err:
+            self.log.error('status=failed, action=deploy, msg="Progress callback failed", '
+                           'db="{}", error="{}"'.format(self.db_name, err))
+
+    def __finish(self, job: dict, status: Optional[dict], error: Optional[BaseException]):
+        with self.__lock:
+            self.__running -= 1
+        # следующая установка ставится в поток запуска до завершения Future,
+        # чтобы close() после wait() не остановил поток раньше
+        self.__starter.submit(self.__schedule)
+
+        if error is not None:
+            self.log.error('status=failed, action=deploy, msg="{} failed", db="{}", '
+                           'error="{}"'.format(job['name'], self.db_name, error))
+            job['future'].set_exception(error)
+        else:
+            job['status'] = status
+            if status.get('deployment_status') == 'succeeded':
+                self.log.info('status=success, action=deploy, msg="{} succeed", '
+                              'db="{}"'.format(job['name'], self.db_name))
+            else:
+                self.log.error('status=failed, action=deploy, msg="{} failed. Errors: {}", '
+                               'db="{}"'.format(job['name'], status.get('errors'), self.db_name))
+            job['future'].set_result(status)
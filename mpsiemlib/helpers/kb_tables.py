@@ -0,0 +1,164 @@
+# coding: utf-8
+
+import io
+import os
+import csv
+import json
+
+from typing import Iterable, Optional, Union
+
+from mpsiemlib.common import LoggingHandler
+
+from .content_helpers import LazyRule
+from .table_loader import iter_table_rows
+
+
+class KBTableExporter(LoggingHandler):
+    """
+    Выгрузка содержимого табличных списков KB в файлы CSV или JSONL.
+
+    Страницы запрашиваются параллельно (см KnowledgeBase.get_table_pages).
+    Заголовок CSV строится по полям табличного списка (KnowledgeBase.get_table_info),
+    поля строк, которых нет в схеме, не выгружаются.
+    После каждой записанной страницы рядом с файлом сохраняется курсор
+    (<файл>.cursor): прерванная выгрузка продолжается с последней записанной
+    страницы, уже выгруженные таблицы пропускаются.
+
+    Usage:
+        exporter = KBTableExporter(kb_module, 'dev')
+        exporter.export_tables('snapshots/2024-01-01', file_format='jsonl')
+    """
+
+    CURSOR_SUFFIX = '.cursor'
+    CSV_DELIMITER = ';'
+
+    def __init__(self, kb_module, db_name: str):
+        LoggingHandler.__init__(self)
+        self.kb = kb_module
+        self.db_name = db_name
+
+    def export_table(self, table_id: str, path: str, file_format: Optional[str] = None,
+                     filters: Optional[dict] = None, resume: bool = True) -> int:
+        """
+        Выгрузить содержимое табличного списка в файл
+
+        :param table_id: KB ID табличного списка
+        :param path: файл для выгрузки
+        :param file_format: 'csv' или 'jsonl', по умолчанию по расширению файла
+        :param filters: см KnowledgeBase.get_table_data
+        :param resume: продолжить прерванную выгрузку по курсору
+        :return: количество строк в файле
+        """
+        file_format = file_format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        cursor_path = path + self.CURSOR_SUFFIX
+        cursor = self.__load_cursor(cursor_path) if resume else None
+        if cursor is None or cursor.get('table_id') != table_id or not os.path.isfile(path):
+            cursor = {'table_id': table_id, 'offset': 0, 'size': 0, 'fieldnames': None, 'done': False}
+        if cursor['done']:
+            self.log.info('status=success, action=export_table, msg="Table {} already exported", '
+                          'db="{}", path="{}"'.format(table_id, self.db_name, path))
+            return cursor['offset']
+
+        with open(path, 'r+b' if cursor['size'] else 'wb') as data_file:
+            # недописанная страница отбрасывается
+            data_file.truncate(cursor['size'])
+            data_file.seek(cursor['size'])
+            if file_format == 'csv' and cursor['fieldnames'] is None:
+                cursor['fieldnames'] = [i.get('name') for i in
+                                        self.kb.get_table_info(self.db_name, table_id).get('fields')]
+                data_file.write(self.__encode_header(cursor['fieldnames']))
+            for offset, rows in self.kb.get_table_pages(self.db_name, table_id, filters, cursor['offset']):
+                data_file.write(self.__encode_rows(rows, file_format, cursor))
+                data_file.flush()
+                cursor['offset'] = offset
+                cursor['size'] = data_file.tell()
+                self.__save_cursor(cursor_path, cursor)
+
+        cursor['done'] = True
+        self.__save_cursor(cursor_path, cursor)
+
+        self.log.info('status=success, action=export_table, msg="Table {} exported", '
+                      'db="{}", path="{}", lines={}'.format(table_id, self.db_name, path, cursor['offset']))
+
+        return cursor['offset']
+
+    def export_tables(self, out_dir: str, file_format: str = 'csv', table_ids: Optional[Iterable[str]] = None,
+                      resume: bool = True) -> dict:
+        """
+        Выгрузить содержимое табличных списков в каталог, файл на таблицу <имя>.<file_format>
+
+        :param out_dir: каталог для выгрузки
+        :param file_format: 'csv' или 'jsonl'
+        :param table_ids: KB ID табличных списков, None - все табличные списки БД
+        :param resume: см export_table
+        :return: {'KB ID': путь к файлу}
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        tables = {i.get('id'): i.get('name') for i in self.kb.get_tables_list(self.db_name)}
+        if table_ids is not None:
+            tables = {i: tables.get(i, i) for i in table_ids}
+
+        ret = {}
+        for table_id, name in tables.items():
+            path = os.path.join(out_dir, f'{name}.{file_format}')
+            self.export_table(table_id, path, file_format, resume=resume)
+            ret[table_id] = path
+
+        return ret
+
+    def __encode_rows(self, rows: list, file_format: str, cursor: dict) -> bytes:
+        if file_format != 'csv':
+            return ''.join(json.dumps(i, ensure_ascii=False) + '\n' for i in rows).encode('utf-8')
+
+        stream = io.StringIO()
+        writer = csv.DictWriter(stream, fieldnames=cursor['fieldnames'], delimiter=self.CSV_DELIMITER,
+                                restval='', extrasaction='ignore')
+        writer.writerows(rows)
+
+        return stream.getvalue().encode('utf-8')
+
+    def __encode_header(self, fieldnames: list) -> bytes:
+        stream = io.StringIO()
+        csv.writer(stream, delimiter=self.CSV_DELIMITER).writerow(fieldnames)
+
+        return stream.getvalue().encode('utf-8')
+
+    @staticmethod
+    def __load_cursor(path: str) -> Optional[dict]:
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rt', encoding='utf-8') as cursor_file:
+            return json.load(cursor_file)
+
+    @staticmethod
+    def __save_cursor(path: str, cursor: dict):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wt', encoding='utf-8') as cursor_file:
+            json.dump(cursor, cursor_file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def set_table_defaults(pack, table_name: str, rows: Union[str, Iterable], source_format: Optional[str] = None):
+    """
+    Заменить значения по умолчанию табличного списка в наборе установки, например
+    строками, выгруженными KBTableExporter. Загрузка в KB - через ContentPatch или
+    KnowledgeBase.import_group. Типы значений сохраняются только при выгрузке в JSONL.
+
+    :param pack: ContentPack
+    :param table_name: имя табличного списка
+    :param rows: см table_loader.iter_table_rows
+    :param source_format: см table_loader.iter_table_rows
+    :return: TablularList
+    """
+    for object_id, tlist in pack.tlists.items():
+        if tlist.name != table_name:
+            continue
+        if isinstance(tlist, LazyRule):
+            # измененный список не должен быть выгружен из памяти
+            tlist = tlist.load()
+            pack.tlists[object_id] = tlist
+        tlist.code.setdefault('defaults', {})['LOC'] = list(iter_table_rows(rows, source_format))
+        tlist.hasDefaults = True
+        return tlist
+
+    raise Exception(f'Table list {table_name} not found in content pack')
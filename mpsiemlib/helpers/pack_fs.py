@@ -0,0 +1,163 @@
+# coding: utf-8
+
+import io
+import os
+import posixpath
+
+from abc import ABC, abstractmethod
+from zipfile import ZipFile
+
+
+class PackFS(ABC):
+    """
+    Файловая система набора установки: каталог на диске или архив .kb.
+
+    Пути относительные, разделитель '/', корень - пустая строка.
+    """
+
+    @staticmethod
+    def join(*parts):
+        return posixpath.join(*[i for i in parts if i])
+
+    @abstractmethod
+    def isfile(self, path):
+        pass
+
+    @abstractmethod
+    def isdir(self, path):
+        pass
+
+    def exists(self, path):
+        return self.isfile(path) or self.isdir(path)
+
+    @abstractmethod
+    def listdir(self, path=''):
+        pass
+
+    @abstractmethod
+    def open_bytes(self, path):
+        pass
+
+    def open(self, path, encoding='utf-8', newline=None):
+        """
+        Открыть файл на чтение в текстовом режиме, аналог open(path, 'rt')
+
+        :param path: относительный путь
+        :param encoding: кодировка
+        :param newline: см open
+        :return: текстовый файловый объект
+        """
+        return io.TextIOWrapper(self.open_bytes(path), encoding=encoding, newline=newline)
+
+    def read_bytes(self, path):
+        with self.open_bytes(path) as data_file:
+            return data_file.read()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DirFS(PackFS):
+    """
+    Каталог на диске.
+
+    Если задан include, видны только перечисленные пути (вместе с вложенными
+    файлами) и каталоги, ведущие к ним. Так часть рабочей копии читается как
+    отдельный набор установки без копирования.
+    """
+
+    def __init__(self, root, include=None):
+        self.root = root
+        self.include = None
+        self.__parents = set()
+        if include is not None:
+            self.include = {posixpath.normpath(i.replace('\\', '/')).strip('/') for i in include}
+            for i in self.include:
+                parent = posixpath.dirname(i)
+                while parent:
+                    self.__parents.add(parent)
+                    parent = posixpath.dirname(parent)
+
+    def __full_path(self, path):
+        return os.path.join(self.root, *path.split('/')) if path else self.root
+
+    def __is_visible(self, path):
+        if self.include is None or not path or path in self.__parents:
+            return True
+        while path:
+            if path in self.include:
+                return True
+            path = posixpath.dirname(path)
+        return False
+
+    def isfile(self, path):
+        return self.__is_visible(path) and os.path.isfile(self.__full_path(path))
+
+    def isdir(self, path):
+        return self.__is_visible(path) and os.path.isdir(self.__full_path(path))
+
+    def listdir(self, path=''):
+        if not self.__is_visible(path):
+            raise FileNotFoundError(path)
+        return [i for i in os.listdir(self.__full_path(path)) if self.__is_visible(self.join(path, i))]
+
+    def open_bytes(self, path):
+        if not self.__is_visible(path):
+            raise FileNotFoundError(path)
+        return open(self.__full_path(path), 'rb')
+
+    def open(self, path, encoding='utf-8', newline=None):
+        if not self.__is_visible(path):
+            raise FileNotFoundError(path)
+        return open(self.__full_path(path), 'rt', encoding=encoding, newline=newline)
+
+
+class ZipFS(PackFS):
+    """
+    Архив набора установки. Файлы читаются напрямую из архива, без распаковки на диск.
+    """
+
+    def __init__(self, zip_path):
+        self.zip_path = zip_path
+        self.__zip = ZipFile(zip_path)
+        self.__files = {}  # {'correlations/LOC-CR-1/rule.co': имя в архиве}
+        self.__dirs = {'': set()}  # {'correlations': {'LOC-CR-1'}}
+        for info in self.__zip.infolist():
+            path = info.filename.replace('\\', '/').strip('/')
+            if not path:
+                continue
+            if not info.is_dir():
+                self.__files[path] = info.filename
+            parent, name = posixpath.split(path)
+            self.__dirs.setdefault(parent, set()).add(name)
+            # каталоги, у которых в архиве нет собственных записей
+            while parent:
+                parent, name = posixpath.split(parent)
+                self.__dirs.setdefault(parent, set()).add(name)
+            if info.is_dir():
+                self.__dirs.setdefault(path, set())
+
+    def isfile(self, path):
+        return path in self.__files
+
+    def isdir(self, path):
+        return path in self.__dirs
+
+    def listdir(self, path=''):
+        if path not in self.__dirs:
+            raise FileNotFoundError(path)
+        return sorted(self.__dirs[path])
+
+    def open_bytes(self, path):
+        if path not in self.__files:
+            raise FileNotFoundError(path)
+        return self.__zip.open(self.__files[path])
+
+    def close(self):
+        self.__zip.close()
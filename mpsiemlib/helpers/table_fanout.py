@@ -0,0 +1,99 @@
+# coding: utf-8
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List
+
+from mpsiemlib.common import LoggingHandler, ModuleNames
+
+
+class TablesFanOut(LoggingHandler):
+    """
+    Операции с табличными списками сразу на нескольких конвейерах.
+
+    Операция выполняется на всех конвейерах одновременно, ошибка на одном
+    конвейере не прерывает остальные. Результат - словарь по конвейерам:
+    {'siem_id': {'result': результат метода Tables, 'error': None или текст ошибки}}
+
+    Usage:
+        fan_out = TablesFanOut(worker)  # все конвейеры
+        results = fan_out.set_table_row('table_name', add_rows=rows)
+        failed = TablesFanOut.get_failed(results)
+    """
+
+    def __init__(self, worker, siem_ids: Optional[List[str]] = None, max_workers: Optional[int] = None):
+        """
+        :param worker: MPSIEMWorker
+        :param siem_ids: UUID конвейеров, None - все конвейеры, см Conveyor.get_conveyor_list
+        :param max_workers: количество одновременных запросов, по умолчанию по числу конвейеров
+        """
+        LoggingHandler.__init__(self)
+        self.tables = worker.get_module(ModuleNames.TABLES)
+        if siem_ids is None:
+            siem_ids = [i.get('id') for i in worker.get_module(ModuleNames.CONVEYOR).get_conveyor_list()]
+        self.siem_ids = list(siem_ids)
+        self.max_workers = max_workers or max(len(self.siem_ids), 1)
+
+    def set_table_data(self, table_name: str, data: bytes) -> dict:
+        """
+        См Tables.set_table_data. Данные передаются в bytes, файловый объект
+        нельзя прочитать несколько раз.
+        """
+        return self.run('set_table_data', table_name, data)
+
+    def set_table_row(self, table_name: str, add_rows: Optional[List[dict]] = None,
+                      remove_rows: Optional[List[dict]] = None) -> dict:
+        """
+        См Tables.set_table_row
+        """
+        return self.run('set_table_row', table_name, add_rows=add_rows, remove_rows=remove_rows)
+
+    def sync_table(self, table_name: str, rows: List[dict]) -> dict:
+        """
+        См Tables.sync_table. Строки передаются списком, итератор нельзя прочитать несколько раз.
+        """
+        return self.run('sync_table', table_name, rows)
+
+    def truncate_table(self, table_name: str) -> dict:
+        """
+        См Tables.truncate_table
+        """
+        return self.run('truncate_table', table_name)
+
+    def run(self, operation: str, *args, **kwargs) -> dict:
+        """
+        Выполнить метод Tables на всех конвейерах
+
+        :param operation: имя метода Tables, принимающего параметр siem_id
+        :param args: параметры метода
+        :param kwargs: параметры метода
+        :return: {'siem_id': {'result': value, 'error': None}}
+        """
+        method = getattr(self.tables, operation)
+
+        def call(siem_id):
+            try:
+                return {'result': method(*args, siem_id=siem_id, **kwargs), 'error': None}
+            except Exception as err:
+                self.log.error('status=failed, action={}, msg="Operation failed on conveyor", '
+                               'conveyor_id="{}", error="{}"'.format(operation, siem_id, err))
+                return {'result': None, 'error': str(err)}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = dict(zip(self.siem_ids, executor.map(call, self.siem_ids)))
+
+        failed = self.get_failed(results)
+        self.log.info('status={}, action={}, msg="Operation done on {} of {} conveyors", '
+                      'failed="{}"'.format('success' if not failed else 'failed', operation,
+                                           len(results) - len(failed), len(results), ','.join(failed)))
+
+        return results
+
+    @staticmethod
+    def get_failed(results: dict) -> List[str]:
+        """
+        Конвейеры, на которых операция завершилась ошибкой
+
+        :param results: результат run
+        :return: ['siem_id']
+        """
+        return [k for k, v in results.items() if v['error'] is not None]
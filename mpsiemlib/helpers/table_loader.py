@@ -0,0 +1,188 @@
+# coding: utf-8
+
+import io
+import csv
+import json
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterable, Iterator, Optional, Union
+
+import requests
+
+from mpsiemlib.common import LoggingHandler
+
+
+class UTCTimestampFormatter:
+    """
+    Перевод timestamp в формат загрузки табличных списков '%d.%m.%Y %H:%M:%S' (UTC).
+
+    Дата вычисляется один раз на сутки и кэшируется, время суток собирается
+    арифметикой, без datetime на каждую ячейку.
+    """
+
+    SECONDS_PER_DAY = 86400
+
+    def __init__(self):
+        self.__days = {}
+
+    def __call__(self, timestamp: int) -> str:
+        day, seconds = divmod(timestamp, self.SECONDS_PER_DAY)
+        date = self.__days.get(day)
+        if date is None:
+            date = time.strftime('%d.%m.%Y', time.gmtime(day * self.SECONDS_PER_DAY))
+            self.__days[day] = date
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+
+        return f'{date} {hours:02d}:{minutes:02d}:{seconds:02d}'
+
+
+def iter_table_rows(source: Union[str, Iterable], source_format: Optional[str] = None,
+                    csv_delimiter: str = ';') -> Iterator[dict]:
+    """
+    Строки для загрузки в табличный список
+
+    :param source: путь к файлу .jsonl/.csv, открытый на чтение текстовый файл или
+        итератор по строкам JSON либо словарям
+    :param source_format: 'jsonl' или 'csv', по умолчанию определяется по расширению файла
+    :param csv_delimiter: разделитель полей CSV
+    :return: итератор по строкам {'field': 'value'}
+    """
+    if isinstance(source, str):
+        source_format = source_format or ('csv' if source.lower().endswith('.csv') else 'jsonl')
+        with open(source, 'rt', encoding='utf-8-sig', newline='' if source_format == 'csv' else None) as data_file:
+            yield from iter_table_rows(data_file, source_format, csv_delimiter)
+        return
+
+    if source_format == 'csv':
+        yield from csv.DictReader(source, delimiter=csv_delimiter)
+        return
+
+    for i in source:
+        if isinstance(i, dict):
+            yield i
+        elif i.strip():
+            yield json.loads(i)
+
+
+class TableLoader(LoggingHandler):
+    """
+    Потоковая загрузка данных в табличный список через Tables.set_table_data.
+
+    Строки пишутся в CSV пачками размером около Settings.tables_upload_batch_bytes,
+    до Settings.tables_upload_concurrency пачек загружаются одновременно.
+
+    По умолчанию пачка не отправляется повторно. Если задан
+    Settings.tables_upload_retries, пачка, не загруженная из-за ошибки сети или
+    ответа 5xx, отправляется повторно до указанного числа раз. Загрузка не
+    идемпотентна: если сервер уже записал строки и вернул ошибку, повторная
+    отправка их задублирует (доставка "хотя бы один раз"). Ответ 4xx (ошибка в
+    данных) не повторяется.
+
+    Usage:
+        loader = TableLoader(worker.get_module(ModuleNames.TABLES), 'table_name')
+        loader.load('export.jsonl')
+    """
+
+    def __init__(self, tables_module, table_name: str, siem_id=None):
+        LoggingHandler.__init__(self)
+        self.tables = tables_module
+        self.table_name = table_name
+        self.siem_id = siem_id
+        self.settings = tables_module.settings
+        self.__format_timestamp = UTCTimestampFormatter()
+        self.__datetime_fields = None
+
+    def load(self, source: Union[str, Iterable], source_format: Optional[str] = None,
+             csv_delimiter: str = ';') -> int:
+        """
+        Загрузить строки в табличный список
+
+        :param source: см iter_table_rows
+        :param source_format: см iter_table_rows
+        :param csv_delimiter: см iter_table_rows
+        :return: количество отправленных строк
+        """
+        # API экспортирует время в timestamp, но для загрузки данных его надо перевести в нужный формат
+        table_info = self.tables.get_table_info(self.table_name, self.siem_id)
+        self.__datetime_fields = {i.get('name') for i in table_info.get('fields') if i.get('type') == 'datetime'}
+
+        batch_size = self.settings.tables_upload_batch_bytes
+        rows_count = 0
+        batches = 0
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.settings.tables_upload_concurrency) as executor:
+            try:
+                stream, writer = None, None
+                for row in iter_table_rows(source, source_format, csv_delimiter):
+                    row = self.__prepare_row(row)
+                    if writer is None:
+                        stream = io.StringIO()
+                        writer = csv.DictWriter(stream, fieldnames=list(row.keys()), delimiter=';',
+                                                quoting=csv.QUOTE_NONNUMERIC)
+                        writer.writeheader()
+                    writer.writerow(row)
+                    rows_count += 1
+
+                    if stream.tell() >= batch_size:
+                        running = self.__submit(executor, running, stream.getvalue().encode('utf-8'))
+                        batches += 1
+                        stream, writer = None, None
+
+                if writer is not None:
+                    running = self.__submit(executor, running, stream.getvalue().encode('utf-8'))
+                    batches += 1
+
+                for i in running:
+                    i.result()
+            except BaseException:
+                for i in running:
+                    i.cancel()
+                raise
+
+        self.log.info('status=success, action=load_table, msg="Loaded {} rows to table {}", '
+                      'batches={}, conveyor_id="{}"'.format(rows_count, self.table_name, batches, self.siem_id))
+
+        return rows_count
+
+    def __prepare_row(self, row: dict) -> dict:
+        # если мы пытаемся загрузить обратно то, что экспортировали через sdk
+        row.pop('_id', None)  # при вставке не нужен _id
+        for k, v in row.items():
+            if v is None:  # все None значения меняются на строку "null"
+                row[k] = 'null'
+            elif type(v) is int and k in self.__datetime_fields:
+                row[k] = self.__format_timestamp(v)
+
+        return row
+
+    def __submit(self, executor, running: set, data: bytes) -> set:
+        # не больше tables_upload_concurrency пачек в памяти сверх загружаемых
+        if len(running) >= self.settings.tables_upload_concurrency:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for i in done:
+                i.result()
+        running.add(executor.submit(self.__upload, data))
+
+        return running
+
+    def __upload(self, data: bytes):
+        retries = self.settings.tables_upload_retries
+        for attempt in range(retries + 1):
+            try:
+                self.tables.set_table_data(self.table_name, data, self.siem_id)
+                return
+            except requests.RequestException as err:
+                if attempt == retries or not self.__is_retryable(err):
+                    raise
+                self.log.error('status=failed, action=load_table, msg="Batch upload to table {} failed, retry {}", '
+                               'error="{}"'.format(self.table_name, attempt + 1, err))
+                time.sleep(2 ** attempt)
+
+    @staticmethod
+    def __is_retryable(err: requests.RequestException) -> bool:
+        # ошибки в данных (4xx) повторная отправка не исправит
+        if isinstance(err, (requests.ConnectionError, requests.Timeout)):
+            return True
+        return isinstance(err, requests.HTTPError) and err.response is not None and err.response.status_code >= 500
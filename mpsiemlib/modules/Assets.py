@@ -1,10 +1,13 @@
-﻿import time
+﻿import codecs
+
 from datetime import datetime
-from typing import List, Tuple, Optional, Iterator, Union
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import List, Tuple, Optional, Iterator, Iterable, Union, BinaryIO, Callable
 
 import pytz
+import requests
 
-from mpsiemlib.common import ModuleInterface, MPSIEMAuth, LoggingHandler, Settings
+from mpsiemlib.common import ModuleInterface, MPSIEMAuth, LoggingHandler, Settings, OperationWaiter
 from mpsiemlib.common import exec_request, get_metrics_start_time, get_metrics_took_time
 
 
@@ -26,6 +29,9 @@ class Assets(ModuleInterface, LoggingHandler):
     __api_assets_v2_import_operation = '/api/assets_processing/v2/csv/import_operation'
     __api_assets_v1_removeassets = '/api/assets_processing/v1/asset_operations/removeAssets'
 
+    # Состояния завершенной операции импорта
+    IMPORT_FINAL_STATES = ('completed', 'failed', 'error', 'cancelled', 'canceled')
+
     def __init__(self, auth: MPSIEMAuth, settings: Settings):
         ModuleInterface.__init__(self, auth, settings)
         LoggingHandler.__init__(self)
@@ -36,6 +42,7 @@ class Assets(ModuleInterface, LoggingHandler):
         self.__default_utc_offset = '{0}:{1}'.format(siem_tz[:-2], siem_tz[-2:])  # convert to +HH:MM
         self.__scopes = {}
         self.__groups = {}
+        self.__waiter = OperationWaiter(settings)
         self.log.debug('status=success, action=prepare, msg="Assets Module init"')
 
     def get_scopes_list(self, do_refresh=False) -> dict:
@@ -253,6 +260,109 @@ class Assets(ModuleInterface, LoggingHandler):
 
         return r.iter_lines(decode_unicode=True)
 
+    def export_assets_csv(self, token: str, output: Union[str, BinaryIO], chunk_size: Optional[int] = None,
+                          add_bom: bool = False) -> int:
+        """Выгрузить активы в CSV без разбора на строки.
+
+        Данные запрашиваются со сжатием gzip и пишутся блоками по chunk_size
+        байт. При обрыве соединения, таймауте или ошибке сервера (5xx)
+        выгрузка запрашивается заново с последнего полученного байта
+        (заголовок Range), но не больше Settings.assets_export_retries раз.
+        Ошибки 4xx не повторяются.
+
+        :param token: Токен запроса
+        :param output: имя файла или открытый на запись бинарный файловый объект
+        :param chunk_size: размер блока, по умолчанию Settings.assets_export_chunk_size
+        :param add_bom: записать в начало UTF-8 BOM (для Excel), если сервер его не передал
+        :return: количество записанных байт
+        """
+        self.log.debug('status=prepare, action=export_assets_csv, msg="Try to export assets csv by token {}", '
+                       'hostname="{}"'.format(token, self.__core_hostname))
+
+        url = 'https://{}{}'.format(self.__core_hostname, self.__api_assets_trm_export_csv)
+        params = {'pdqlToken': token}
+        chunk_size = chunk_size or self.settings.assets_export_chunk_size
+
+        output_file = open(output, 'wb') if isinstance(output, str) else output
+        received = 0  # байт получено от сервера, без добавленного BOM
+        written = 0
+        retries = 0
+        start_time = get_metrics_start_time()
+        try:
+            while True:
+                # Range считается по несжатому содержимому, поэтому продолжение запрашивается без gzip
+                headers = {'Accept-Encoding': 'gzip'} if received == 0 else \
+                    {'Accept-Encoding': 'identity', 'Range': f'bytes={received}-'}
+                try:
+                    try:
+                        r = exec_request(self.__core_session,
+                                         url,
+                                         method='GET',
+                                         timeout=self.settings.connection_timeout,
+                                         params=params,
+                                         headers=headers,
+                                         stream=True)
+                    except requests.HTTPError as err:
+                        # соединение оборвалось после последнего блока: продолжать нечего
+                        if received != 0 and self.__is_range_complete(err.response, received):
+                            break
+                        raise
+                    with r:
+                        # сервер без поддержки Range отдает выгрузку целиком, уже записанное пропускаем
+                        skip = received if received != 0 and r.status_code != 206 else 0
+                        for chunk in r.iter_content(chunk_size):
+                            if skip:
+                                if len(chunk) <= skip:
+                                    skip -= len(chunk)
+                                    continue
+                                chunk = chunk[skip:]
+                                skip = 0
+                            if received == 0 and add_bom and not chunk.startswith(codecs.BOM_UTF8):
+                                written += output_file.write(codecs.BOM_UTF8)
+                            output_file.write(chunk)
+                            received += len(chunk)
+                            written += len(chunk)
+                    break
+                except requests.RequestException as err:
+                    retries += 1
+                    if retries > self.settings.assets_export_retries or not self.__is_export_retryable(err):
+                        raise
+                    self.log.error('status=failed, action=export_assets_csv, msg="Connection lost, resume from {} '
+                                   'bytes", hostname="{}", error="{}"'.format(received, self.__core_hostname, err))
+        finally:
+            if isinstance(output, str):
+                output_file.close()
+        took_time = get_metrics_took_time(start_time)
+
+        self.log.info('status=success, action=export_assets_csv, msg="Assets exported", '
+                      'hostname="{}", bytes={}, retries={}'.format(self.__core_hostname, written, retries))
+        self.log.info('hostname="{}", metric=export_assets_csv, took={}ms, bytes={}'.format(self.__core_hostname,
+                                                                                            took_time,
+                                                                                            written))
+
+        return written
+
+    @staticmethod
+    def __is_export_retryable(err: requests.RequestException) -> bool:
+        # ошибки запроса (4xx: токен устарел, задача не найдена) повторный запрос не исправит
+        if isinstance(err, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)):
+            return True
+        return isinstance(err, requests.HTTPError) and err.response is not None and err.response.status_code >= 500
+
+    @staticmethod
+    def __is_range_complete(response, received: int) -> bool:
+        """Ответ 416 на Range с полной длиной выгрузки, равной уже полученной.
+
+        :param response: ответ на запрос с Range
+        :param received: количество полученных байт
+        :return: выгрузка получена целиком
+        """
+        if response is None or response.status_code != 416:
+            return False
+        # Content-Range: bytes */<полная длина>
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        return total.isdigit() and int(total) == received
+
     def import_assets_from_csv(self,
                                content: bytes,
                                scope_id: str,
@@ -280,18 +390,17 @@ class Assets(ModuleInterface, LoggingHandler):
                 error_log = self.__import_assets_get_logfile(resp['id'])
             resp2 = self.__import_assets_from_csv_start(resp['id'], group_id)
             if resp2 == 200:
-                for i in range(int(round(timeout / 10))):
-                    time.sleep(10)
-                    self.log.debug('Try to check operation status')
-                    import_status = self.__import_assets_get_status(resp['id'])
-                    if import_status.get('state') == 'completed':
-                        success_install = True
-                        break
+                import_status = self.__waiter.wait(lambda: self.__import_assets_check_status(resp['id']),
+                                                   timeout=timeout,
+                                                   name=f'assets import {resp["id"]}',
+                                                   raise_on_timeout=False)
+                success_install = import_status is not None and import_status.get('state') == 'completed'
 
         if not success_install:
             self.log.error('status=failed, action=import_assets_from_csv, msg="Can not import assets", '
                            'error="{}", hostname="{}"'.format(error_log, self.__core_hostname))
 
+        import_status = import_status or {}
         counter_imported = import_status.get('succeedCount')
         self.log.info('status=success, action=import_assets_from_csv, '
                       'msg="Assets have been imported", imported_assets={}, updated_groups="{}", '
@@ -301,6 +410,140 @@ class Assets(ModuleInterface, LoggingHandler):
 
         return success_install, counter_imported, error_log
 
+    def import_assets_from_csv_parts(self,
+                                     source: Union[str, Iterable[str]],
+                                     scope_id: str,
+                                     group_id: str,
+                                     part_rows: Optional[int] = None,
+                                     timeout: Optional[int] = None) -> dict:
+        """Импорт большого CSV в MP по частям.
+
+        CSV читается построчно и разбивается на части по
+        Settings.assets_import_part_rows записей (запись со значением в
+        кавычках на нескольких строках не разрывается), в каждую часть
+        добавляется заголовок. Части загружаются параллельно (не больше
+        Settings.assets_concurrency одновременно), операции импорта
+        опрашиваются общим OperationWaiter модуля.
+
+        :param source: путь к файлу CSV или итератор по строкам CSV с переводами строк (первая строка - заголовок)
+        :param scope_id: ID инфраструктуры, куда импортируются активы
+        :param group_id: ID группы, куда импортируются активы
+        :param part_rows: количество записей в части, по умолчанию Settings.assets_import_part_rows
+        :param timeout: Время ожидания импорта каждой части (сек), по умолчанию Settings.operations_timeout
+        :return: {'parts': 100, 'succeedCount': 999990, 'failedParts': [номер части],
+            'errors': {номер части: журнал ошибок CSV}}
+        """
+        self.log.debug('status=prepare, action=import_assets_from_csv_parts, '
+                       'msg="Try to import new assets from CSV by parts", '
+                       'hostname="{}"'.format(self.__core_hostname))
+
+        part_rows = part_rows or self.settings.assets_import_part_rows
+        parts = {}
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.settings.assets_concurrency) as executor:
+            # не больше assets_concurrency частей в памяти сверх загружаемых
+            for index, content in enumerate(self.__iter_csv_parts(source, part_rows)):
+                if len(running) >= self.settings.assets_concurrency:
+                    _, running = wait(running, return_when=FIRST_COMPLETED)
+                future = executor.submit(self.__import_assets_part, index, content, scope_id, group_id, timeout)
+                parts[index] = future
+                running.add(future)
+
+        ret = {'parts': len(parts), 'succeedCount': 0, 'failedParts': [], 'errors': {}}
+        for index, future in parts.items():
+            try:
+                import_future, error_log = future.result()
+            except Exception as err:
+                self.log.error('status=failed, action=import_assets_from_csv_parts, msg="Can not upload part {}", '
+                               'error="{}", hostname="{}"'.format(index, err, self.__core_hostname))
+                import_future, error_log = None, None
+            if error_log:
+                ret['errors'][index] = error_log
+            import_status = self.__future_result(import_future)
+            if import_status is None or import_status.get('state') != 'completed':
+                ret['failedParts'].append(index)
+                continue
+            ret['succeedCount'] += import_status.get('succeedCount') or 0
+
+        self.log.info('status={}, action=import_assets_from_csv_parts, '
+                      'msg="Assets have been imported", parts={}, failed_parts={}, imported_assets={}, '
+                      'hostname="{}"'.format('success' if not ret['failedParts'] else 'failed',
+                                             ret['parts'],
+                                             len(ret['failedParts']),
+                                             ret['succeedCount'],
+                                             self.__core_hostname))
+
+        return ret
+
+    def __import_assets_part(self, index: int, content: bytes, scope_id: str, group_id: str,
+                             timeout: Optional[int]) -> Tuple[Optional[Future], Optional[str]]:
+        """Загрузить и запустить импорт части CSV.
+
+        :return: Future операции импорта (None, если импорт не запущен), журнал ошибок
+        """
+        error_log = None
+        resp = self.__import_assets_from_csv_prepare(content, scope_id)
+        operation_id = resp.get('id')
+        if operation_id is None:
+            return None, error_log
+        if resp.get('isLogFileCreated'):
+            error_log = self.__import_assets_get_logfile(operation_id)
+        if self.__import_assets_from_csv_start(operation_id, group_id) != 200:
+            return None, error_log
+
+        future = self.__waiter.submit(lambda: self.__import_assets_check_status(operation_id),
+                                      timeout=timeout,
+                                      name=f'assets import {operation_id} part {index}')
+
+        return future, error_log
+
+    @staticmethod
+    def __iter_csv_parts(source: Union[str, Iterable[str]], part_rows: int) -> Iterator[bytes]:
+        """Разбить CSV на части с заголовком в каждой.
+
+        Части делятся по записям CSV: запись со значением в кавычках,
+        содержащим перевод строки, не разрывается. Строки передаются без
+        изменений, перевод строки (как в заголовке) добавляется только в конец
+        записи без него. Итератор должен возвращать строки вместе с переводами
+        строк, как файл, открытый с newline=''.
+        """
+        if isinstance(source, str):
+            with open(source, 'rt', encoding='utf-8-sig', newline='') as csv_file:
+                yield from Assets.__iter_csv_parts(csv_file, part_rows)
+            return
+
+        header = None
+        newline = '\r\n'
+        record = []
+        quotes = 0
+        part = []
+        for line in source:
+            if not record and not line.strip():
+                continue
+            record.append(line)
+            # нечетное число кавычек - значение в кавычках продолжается на следующей строке
+            quotes += line.count('"')
+            if quotes % 2:
+                continue
+            row = ''.join(record)
+            record = []
+            quotes = 0
+
+            if header is None:
+                newline = row[len(row.rstrip('\r\n')):] or newline
+                header = row if row.endswith(('\n', '\r')) else row + newline
+                continue
+            part.append(row if row.endswith(('\n', '\r')) else row + newline)
+            if len(part) >= part_rows:
+                yield ''.join([header] + part).encode('utf-8')
+                part = []
+
+        # незакрытая кавычка в конце файла: запись передается как есть, ошибку вернет сервер
+        if record and header is not None:
+            part.append(''.join(record))
+        if part:
+            yield ''.join([header] + part).encode('utf-8')
+
     def __import_assets_from_csv_prepare(self, content, scope_id: str) -> dict:
         """Подготовить операцию импорта.
 
@@ -570,16 +813,16 @@ class Assets(ModuleInterface, LoggingHandler):
         operation = 'operations' if operation_type == 'create' else 'removeOperation'
 
         url = f"https://{self.__core_hostname}{self.__api_assets_processing_v2_groups}/{operation}/{operation_id}"
-        r = None
-        for i in range(int(round(timeout / 10))):
-            time.sleep(10)
+
+        def check():
             self.log.debug('Try to check operation status')
-            r = exec_request(self.__core_session,
-                             url,
-                             method='GET',
-                             timeout=self.settings.connection_timeout)
-            if r.status_code == 200:
-                break
+            response = exec_request(self.__core_session,
+                                    url,
+                                    method='GET',
+                                    timeout=self.settings.connection_timeout)
+            return response.status_code == 200, response
+
+        r = self.__waiter.wait(check, timeout=timeout, name=f'group {operation_id}', raise_on_timeout=False)
 
         resp = r.text.strip('"') if operation_type == 'create' else r.json()
 
@@ -734,19 +977,68 @@ class Assets(ModuleInterface, LoggingHandler):
 
         operation_id = self.__delete_assets_by_ids(asset_ids)
 
+        status = None
         if operation_id is not None:
-            for i in range(30):
-                time.sleep(1)
-                status = self.__remove_assets_get_status(operation_id=operation_id)
-                self.log.warning(f'status: {status}')
-                if status is not None:
-                    break
+            status = self.__waiter.wait(lambda: self.__operation_result(self.__remove_assets_get_status(operation_id)),
+                                        timeout=30,
+                                        name=f'assets remove {operation_id}',
+                                        raise_on_timeout=False)
 
         self.log.info('status=success, action=delete_assets_by_ids, '
                       'msg="Deleting finished", status={}, '
                       'hostname="{}"'.format(status, self.__core_hostname))
         return status
 
+    def delete_assets_by_ids_batch(self, asset_ids: list, batch_size: Optional[int] = None,
+                                   timeout: Optional[int] = None) -> dict:
+        """Удаление большого количества активов по id.
+
+        Список разбивается на пачки по Settings.assets_delete_batch_size,
+        операции удаления запускаются параллельно (не больше
+        Settings.assets_concurrency одновременно) и опрашиваются общим
+        OperationWaiter модуля.
+
+        :param asset_ids: Список ID активов, которые необходимо удалить
+        :param batch_size: размер пачки, по умолчанию Settings.assets_delete_batch_size
+        :param timeout: Время ожидания каждой операции (сек), по умолчанию Settings.operations_timeout
+        :return: {"totalCount":100000,"succeedCount":99990,"failedCount":10,
+            "unconfirmedIds":[ID активов из пачек, статус удаления которых не получен]}
+        """
+        batch_size = batch_size or self.settings.assets_delete_batch_size
+        batches = [asset_ids[i:i + batch_size] for i in range(0, len(asset_ids), batch_size)]
+
+        self.log.debug('status=prepare, action=delete_assets_by_ids_batch, '
+                       'msg="Try to delete {} asset(s) in {} batches", '
+                       'hostname="{}"'.format(len(asset_ids), len(batches), self.__core_hostname))
+
+        def submit(batch):
+            operation_id = self.__delete_assets_by_ids(batch)
+            if operation_id is None:
+                return None
+            return self.__waiter.submit(lambda: self.__operation_result(self.__remove_assets_get_status(operation_id)),
+                                        timeout=timeout,
+                                        name=f'assets remove {operation_id}')
+
+        futures = self.__map_concurrent(submit, batches, 'delete_assets_by_ids_batch')
+
+        ret = {'totalCount': len(asset_ids), 'succeedCount': 0, 'failedCount': 0, 'unconfirmedIds': []}
+        for batch, future in zip(batches, futures):
+            status = self.__future_result(future)
+            if status is None:
+                ret['unconfirmedIds'].extend(batch)
+                continue
+            ret['succeedCount'] += status.get('succeedCount') or 0
+            ret['failedCount'] += status.get('failedCount') or 0
+
+        self.log.info('status={}, action=delete_assets_by_ids_batch, '
+                      'msg="Deleting finished", succeed={}, failed={}, unconfirmed={}, '
+                      'hostname="{}"'.format('success' if not ret['unconfirmedIds'] else 'failed',
+                                             ret['succeedCount'],
+                                             ret['failedCount'],
+                                             len(ret['unconfirmedIds']),
+                                             self.__core_hostname))
+        return ret
+
     def __change_asset_configuration_by_id(self, asset_id: str, params: dict) -> dict:
         """Получить статус операции изменения актива.
 
@@ -809,19 +1101,96 @@ class Assets(ModuleInterface, LoggingHandler):
 
         ticket_id = self.__change_asset_configuration_by_id(asset_id, config)
 
+        status = None
         if ticket_id is not None:
-            for i in range(15):
-                time.sleep(2)
-                status = self.__change_assets_get_status(ticket_id=ticket_id)
-                self.log.warning("status: {}".format(status))
-                if status is not None:
-                    break
+            status = self.__waiter.wait(lambda: self.__operation_result(self.__change_assets_get_status(ticket_id)),
+                                        timeout=30,
+                                        name=f'asset change {ticket_id}',
+                                        raise_on_timeout=False)
 
         self.log.info('status=success, action=change_asset_configuration_by_id, '
                       'msg="Editing finished", status={}, '
                       'hostname="{}"'.format(status, self.__core_hostname))
         return status
 
+    def change_assets_configuration_by_ids(self, asset_ids: list, config: Union[dict, Callable[[str], dict]],
+                                           timeout: Optional[int] = None) -> dict:
+        """Изменение нескольких активов по id.
+
+        Запросы изменения отправляются параллельно, не больше
+        Settings.assets_concurrency одновременно. Статусы всех операций
+        опрашиваются общим OperationWaiter модуля.
+
+        :param asset_ids: Список ID активов, повторяющиеся ID изменяются один раз
+        :param config: конфигурация для всех активов или функция asset_id -> конфигурация
+        :param timeout: Время ожидания каждой операции изменения (сек), по умолчанию Settings.operations_timeout
+        :return: {'asset_id': {"isSuccessful":true,"assetId":"..."} или None}
+        """
+        asset_ids = list(dict.fromkeys(asset_ids))
+        self.log.debug('status=prepare, action=change_assets_configuration_by_ids, '
+                       'msg="Try to change {} asset(s)", '
+                       'hostname="{}"'.format(len(asset_ids), self.__core_hostname))
+
+        def submit(asset_id):
+            ticket_id = self.__change_asset_configuration_by_id(asset_id,
+                                                                config(asset_id) if callable(config) else config)
+            if ticket_id is None:
+                return None
+            return self.__waiter.submit(lambda: self.__operation_result(self.__change_assets_get_status(ticket_id)),
+                                        timeout=timeout,
+                                        name=f'asset change {ticket_id}')
+
+        futures = self.__map_concurrent(submit, asset_ids, 'change_assets_configuration_by_ids')
+        ret = {asset_id: self.__future_result(future) for asset_id, future in zip(asset_ids, futures)}
+
+        failed = sum(1 for i in ret.values() if i is None or not i.get('isSuccessful', True))
+        self.log.info('status=success, action=change_assets_configuration_by_ids, '
+                      'msg="Editing finished", total={}, failed={}, '
+                      'hostname="{}"'.format(len(ret), failed, self.__core_hostname))
+        return ret
+
+    def __map_concurrent(self, func: Callable, items: list, action: str) -> list:
+        """Выполнить func для каждого элемента, не больше Settings.assets_concurrency одновременно.
+
+        Ошибка одного элемента не прерывает остальные, его результат - None.
+
+        :return: результаты в порядке items
+        """
+        def call(item):
+            try:
+                return func(item)
+            except Exception as err:
+                self.log.error('status=failed, action={}, msg="Operation failed", item="{}", error="{}", '
+                               'hostname="{}"'.format(action, item, err, self.__core_hostname))
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.settings.assets_concurrency) as executor:
+            return list(executor.map(call, items))
+
+    def __future_result(self, future: Optional[Future]):
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except TimeoutError:
+            return future.last_result
+        except Exception:
+            return None
+
+    def __import_assets_check_status(self, operation_id: str) -> Tuple[bool, Optional[dict]]:
+        self.log.debug('Try to check operation status')
+        import_status = self.__import_assets_get_status(operation_id)
+        if import_status is None:
+            return False, None
+        # завершившийся ошибкой импорт не ждем до истечения timeout
+        done = str(import_status.get('state')).lower() in self.IMPORT_FINAL_STATES or \
+            import_status.get('errorModel') is not None
+        return done, import_status
+
+    @staticmethod
+    def __operation_result(status: Optional[dict]) -> Tuple[bool, Optional[dict]]:
+        return status is not None, status
+
     def get_asset_configuration_by_id(self, asset_id: str) -> dict:
         """Получение информации об активе по id.
 
@@ -847,6 +1216,25 @@ class Assets(ModuleInterface, LoggingHandler):
                 'hostname="{}"'.format(r.status_code, self.__core_hostname))
         return resp
 
+    def get_assets_configuration_by_ids(self, asset_ids: list) -> dict:
+        """Получение информации о нескольких активах по id.
+
+        Запросы выполняются параллельно, не больше Settings.assets_concurrency одновременно.
+
+        :param asset_ids: Список ID активов, повторяющиеся ID запрашиваются один раз
+        :return: {'asset_id': { dict with asset config } или None при ошибке}
+        """
+        asset_ids = list(dict.fromkeys(asset_ids))
+        configs = self.__map_concurrent(self.get_asset_configuration_by_id, asset_ids,
+                                        'get_assets_configuration_by_ids')
+        ret = dict(zip(asset_ids, configs))
+
+        self.log.info('status=success, action=get_assets_configuration_by_ids, msg="Got {} asset configurations", '
+                      'failed={}, hostname="{}"'.format(len(ret),
+                                                        sum(1 for i in configs if not i),
+                                                        self.__core_hostname))
+        return ret
+
     def get_queries(self) -> dict:
         """Получить все запросы.
 
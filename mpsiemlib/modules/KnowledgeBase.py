@@ -1,10 +1,14 @@
 import os
+import json
 import time
 
 from hashlib import sha256
-from typing import Iterator, Optional
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator, Optional, Callable, Union, BinaryIO
 
 from mpsiemlib.common import ModuleInterface, MPSIEMAuth, LoggingHandler, MPComponents, Settings, MPContentTypes
+from mpsiemlib.common import OperationWaiter, UploadReader
 from mpsiemlib.common import exec_request, get_metrics_start_time, get_metrics_took_time
 
 
@@ -83,6 +87,10 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
     DEPLOYMENT_TIMEOUT = 10
     # Попытки проверки статуса при неизменном проценте
     DEPLOYMENT_RETRIES = 10
+    # Статусы незавершенной установки
+    DEPLOYMENT_PENDING_STATUSES = ('', 'running')
+    # Поля листинга, меняющиеся при установке и компиляции, не входят в хэш объекта
+    LISTING_STATUS_FIELDS = ('DeploymentStatus', 'CompilationStatus')
 
     def __init__(self, auth: MPSIEMAuth, settings: Settings):
         ModuleInterface.__init__(self, auth, settings)
@@ -93,6 +101,8 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
         self.__groups = {}
         self.__folders = {}
         self.__packs = {}
+        self.__objects_index = {}
+        self.__waiter = OperationWaiter(settings)
         self.log.debug('status=success, action=prepare, msg="KB Module init"')
 
     def install_objects(self, db_name: str, guids_list: list, do_remove=False) -> str:
@@ -185,44 +195,85 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
     def install_objects_sync(self, db_name: str, guids_list: list,
                              do_remove=False,
                              timeout: int = DEPLOYMENT_TIMEOUT,
-                             max_retries: int = DEPLOYMENT_RETRIES):
+                             max_retries: int = DEPLOYMENT_RETRIES) -> dict:
         """Синхронный вариант инсталляции/деинсталляции контента из SIEM.
 
         :param db_name: имя БД
         :param guids_list: список ID элементов контента
         :param do_remove: False - инсталляция контента, True - деинсталляция контента
-        :param timeout: таймаут между попытками проверки статуса установки
-        :param max_retries: максимальное количество попыток проверки статуса установки.
+        :param timeout: таймаут, определяющий допустимое время без изменения процента установки
+        :param max_retries: допустимое время без изменения процента установки в единицах timeout.
                             Если процент установки меняется - счетчик сбрасывается
-        :return:
+        :return: статус установки, см get_deploy_status (раньше метод ничего не возвращал).
+            Если установка не завершилась за Settings.kb_deploy_timeout или процент
+            установки не менялся timeout * max_retries сек, исключение не выбрасывается:
+            возвращается последний полученный статус, в errors записывается причина
+            ('Deploy timed out' или 'Deploy stalled at N%'). Успех установки проверяется
+            по deployment_status == 'succeeded'
         """
 
         operation = 'Uninstall' if do_remove else 'Install'
 
         deploy_id = self.install_objects(db_name, guids_list, do_remove)
-        retries = max_retries
-        last_percentage = 0
-        while retries > 0:
-            time.sleep(timeout)
+        deploy = self.wait_deploy(db_name, deploy_id, timeout * max_retries)
+        try:
+            status = deploy.result()
+        except TimeoutError:
+            status = dict(deploy.last_result or {}, errors='Deploy timed out')
+        if status.get('deployment_status') == 'succeeded':
+            self.log.info(
+                'status=success, action=install_objects_sync, msg="{} succeed", '
+                'hostname="{}", db="{}"'.format(operation, self.__kb_hostname, db_name))
+        else:
+            self.log.error(
+                'status=failure, action=install_objects_sync, msg="{} failed. Errors: {}", '
+                'hostname="{}", db="{}"'.format(operation, status.get('errors'), self.__kb_hostname, db_name))
+
+        return status
+
+    def wait_deploy(self, db_name: str, deploy_id: str,
+                    stall_timeout: int = DEPLOYMENT_TIMEOUT * DEPLOYMENT_RETRIES,
+                    on_progress: Optional[Callable[[dict], None]] = None) -> Future:
+        """Асинхронное ожидание завершения установки/удаления контента.
+
+        Статус опрашивается общим OperationWaiter модуля, поэтому можно
+        ожидать несколько установок одновременно.
+
+        :param db_name: Имя БД
+        :param deploy_id: Идентификатор процесса установки/удаления
+        :param stall_timeout: допустимое время без изменения процента
+            установки (сек), после которого ожидание прекращается
+        :param on_progress: функция, вызываемая с результатом каждой проверки
+            статуса (в потоке OperationWaiter)
+        :return: Future со статусом установки, см get_deploy_status
+        """
+        progress = {'percentage': -1, 'time': time.monotonic()}
+
+        def check():
             status = self.get_deploy_status(db_name, deploy_id)
-            deployment_status = status.get('deployment_status')
-            if deployment_status == 'succeeded':
-                self.log.info(
-                    'status=success, action=install_objects_sync, msg="{} succeed", '
-                    'hostname="{}", db="{}"'.format(operation, self.__kb_hostname, db_name))
-                break
-            elif deployment_status == 'running':
-                percentage = int(status.get('percentage'))
-                if percentage > last_percentage:
-                    retries = max_retries
-                else:
-                    retries -= 1
-            else:
-                errors = status.get('errors')
-                self.log.error(
-                    'status=failure, action=install_objects_sync, msg="{} failed. Errors: {}", '
-                    'hostname="{}", db="{}"'.format(operation, errors, self.__kb_hostname, db_name))
-                break
+            if on_progress is not None:
+                on_progress(status)
+            if status.get('deployment_status') not in self.DEPLOYMENT_PENDING_STATUSES:
+                return True, status
+            now = time.monotonic()
+            percentage = self.__parse_percentage(status.get('percentage'))
+            if percentage > progress['percentage']:
+                progress['percentage'] = percentage
+                progress['time'] = now
+            elif now - progress['time'] > stall_timeout:
+                status['errors'] = 'Deploy stalled at {}%'.format(percentage)
+                return True, status
+            return False, status
+
+        return self.__waiter.submit(check, timeout=self.settings.kb_deploy_timeout, name=f'deploy {deploy_id}')
+
+    @staticmethod
+    def __parse_percentage(value) -> int:
+        # KB может вернуть Percentage: null, get_deploy_status отдает его строкой
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return 0
 
     def get_deploy_status(self, db_name: str, deploy_id: str) -> dict:
         """Получить общий статус установки контента.
@@ -609,7 +660,9 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
             "sort": [{"name": "objectId", "order": 0, "type": 1}],
             "groupId": null, }
         :param group_id: Идентификатор набора установки
-        :return: {"param1": "value1", "param2": "value2"}
+        :return: {"param1": "value1", "param2": "value2"}. Поле hash - хэш
+            строки листинга без статусов установки и компиляции
+            (LISTING_STATUS_FIELDS), меняется при изменении объекта в KB
         """
         self.log.info('status=prepare, action=get_all_objects, msg="Try to get objects list", '
                       'hostname="{}", db="{}", filters="{}"'.format(self.__kb_hostname, db_name, filters))
@@ -650,7 +703,8 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
                        'origin_id': i.get('OriginId'),
                        'compilation_sdk': i.get('CompilationStatus', {}).get('SdkVersion'),
                        'compilation_status': i.get('CompilationStatus', {}).get('CompilationStatusId'),
-                       'deployment_status': i.get('DeploymentStatus', '').lower()}
+                       'deployment_status': i.get('DeploymentStatus', '').lower(),
+                       'hash': self.__listing_hash(i)}
         took_time = get_metrics_took_time(start_time)
 
         self.log.info('status=success, action=get_all_objects, msg="Query executed, response have been read", '
@@ -661,6 +715,10 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
         self.log.info(
             f'hostname="{self.__kb_hostname}", metric=get_all_objects, took={took_time}ms, objects={line_counter}')
 
+    def __listing_hash(self, row: dict) -> str:
+        row = {k: v for k, v in row.items() if k not in self.LISTING_STATUS_FIELDS}
+        return sha256(json.dumps(row, sort_keys=True).encode('utf-8')).hexdigest()
+
     def __iterate_objects(self, url: str, params: dict, headers: dict, offset: int, limit: int):
         params['withoutGroups'] = False
         params['recursive'] = True
@@ -856,6 +914,66 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
                                                                                          took_time,
                                                                                          line_counter))
 
+    def get_table_pages(self, db_name: str, table_id: str, filters: Optional[dict] = None, offset: int = 0,
+                        prefetch: Optional[int] = None) -> Iterator[tuple]:
+        """Постраничная выгрузка содержимого табличного списка KB. Следующие
+        страницы запрашиваются параллельно, пока обрабатывается текущая.
+
+        :param db_name: Имя БД
+        :param table_id: KB ID табличного списка
+        :param filters: см get_table_data
+        :param offset: номер строки, с которой начинается выгрузка (для продолжения
+            прерванной выгрузки)
+        :param prefetch: количество одновременно запрашиваемых страниц, по умолчанию
+            Settings.kb_table_prefetch
+        :return: Iterator[(offset следующей страницы, [строки])]
+        """
+        api_url = self.__api_table_rows.format(table_id)
+
+        url = f'https://{self.__kb_hostname}:{self.__kb_port}{api_url}'
+        headers = {'Content-Database': db_name,
+                   'Content-Locale': 'RUS'}
+        params = {'sort': None}
+
+        if filters is not None:
+            params.update(filters)
+
+        limit = self.settings.kb_objects_batch_size
+        prefetch = prefetch or self.settings.kb_table_prefetch
+
+        def get_page(page_offset):
+            # params у каждого запроса свои
+            return self.__iterate_table_rows(url, dict(params), headers, page_offset, limit)
+
+        line_counter = 0
+        start_time = get_metrics_start_time()
+        with ThreadPoolExecutor(max_workers=prefetch) as executor:
+            pages = deque()
+            next_offset = offset
+            try:
+                while True:
+                    while len(pages) < prefetch:
+                        pages.append((next_offset, executor.submit(get_page, next_offset)))
+                        next_offset += limit
+                    page_offset, page = pages.popleft()
+                    rows = page.result()
+                    for i in rows:
+                        i.pop('Id')
+                    line_counter += len(rows)
+                    yield page_offset + len(rows), rows
+                    if len(rows) < limit:
+                        break
+            finally:
+                for _, page in pages:
+                    page.cancel()
+        took_time = get_metrics_took_time(start_time)
+
+        self.log.info('status=success, action=get_table_pages, msg="Query executed, response have been read", '
+                      'hostname="{}", lines={}, db="{}"'.format(self.__kb_hostname, line_counter, db_name))
+        self.log.info('hostname="{}", metric=get_table_pages, took={}ms, lines={}'.format(self.__kb_hostname,
+                                                                                          took_time,
+                                                                                          line_counter))
+
     def __iterate_table_rows(self, url: str, params: dict, headers: dict, offset: int, limit: int):
         params['skip'] = offset
         params['take'] = limit
@@ -1164,18 +1282,29 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
         return self.__get_group_children_tree(groups, group_id)
 
     def export_group(self, db_name: str, group_id: str, local_filepath: str,
-                     export_format: Optional[str] = EXPORT_FORMAT_KB
+                     export_format: Optional[str] = EXPORT_FORMAT_KB,
+                     on_progress: Optional[Callable[[int], None]] = None
                      ) -> int:
         """Экспортировать набор установки.
 
+        Экспорт записывается на диск по частям, не загружаясь в память целиком.
+
         :param db_name: имя БД
         :param group_id: ID набора установки
         :param local_filepath: файл в который сохранить набор установки
         :param export_format: формат экспорта (KB / SIEM Lite)
+        :param on_progress: функция, вызываемая с количеством записанных байт
+            после каждого блока
         :return: размер созданного файла
         """
         group_path = self.get_group_path_by_id(db_name, group_id)
 
+        # Не экспортировать пустой пак (в него попадают все ПТшные макросы)
+        if self.is_group_empty(db_name, group_id):
+            self.log.info('status=success, action=export_group, msg="group {} with id {} is empty", '
+                          'hostname="{}", db="{}"'.format(group_path, group_id, self.__kb_hostname, db_name))
+            return 0
+
         headers = {'Content-Locale': 'RUS'}
 
         params = {
@@ -1191,67 +1320,75 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
                          method='POST',
                          timeout=self.settings.connection_timeout,
                          headers=headers,
-                         json=params)
+                         json=params,
+                         stream=True)
 
         retval = 0
-        if r.status_code == 201:
-
-            # Не экспортировать пустой пак (в него попадают все ПТшные макросы)
-            is_group_empty = self.is_group_empty(db_name, group_id)
-            if not is_group_empty:
+        with r:
+            if r.status_code == 201:
                 with open(local_filepath, 'wb') as kbfile:
-                    retval = kbfile.write(r.content)
+                    for chunk in r.iter_content(chunk_size=self.settings.kb_transfer_chunk_size):
+                        retval += kbfile.write(chunk)
+                        if on_progress is not None:
+                            on_progress(retval)
 
                 self.log.info('status=success, action=export_group, msg="group {} with id {} exported to {}", '
                               'hostname="{}", db="{}"'.format(group_path, group_id, local_filepath, self.__kb_hostname,
                                                               db_name))
             else:
-                self.log.info('status=success, action=export_group, msg="group {} with id {} is empty", '
-                              'hostname="{}", db="{}"'.format(group_path, group_id, self.__kb_hostname, db_name))
-
-
-        else:
-            self.log.error('status=failed, action=export_group, msg="failed to export group {}", '
-                           'hostname="{}", db="{}"'.format(group_id, self.__kb_hostname, db_name))
+                self.log.error('status=failed, action=export_group, msg="failed to export group {}", '
+                               'hostname="{}", db="{}"'.format(group_id, self.__kb_hostname, db_name))
 
         return retval
 
-    def import_group(self, db_name: str, filepath: str, mode: Optional[str] = IMPORT_ADD_AND_UPDATE) -> int:
+    def import_group(self, db_name: str, filepath: Union[str, BinaryIO], mode: Optional[str] = IMPORT_ADD_AND_UPDATE,
+                     on_progress: Optional[Callable[[int, int], None]] = None) -> int:
         """Импортировать набор установки.
 
+        Файл загружается потоково, без чтения в память целиком.
+
         :param db_name: имя БД
-        :param filepath: имя файла набора установки
+        :param filepath: имя файла набора установки или открытый на чтение
+            бинарный файловый объект
         :param mode: режим импорта
+        :param on_progress: функция (отправлено байт, всего байт), вызываемая
+            по ходу загрузки файла
         :return: response_code
         """
         headers = {'Content-Database': db_name,
                    'Content-Locale': 'RUS',
                    'Content-Type': 'application/octet-stream'}
 
-        filename = os.path.basename(filepath)
+        if isinstance(filepath, str):
+            filename = os.path.basename(filepath)
+        else:
+            filename = os.path.basename(getattr(filepath, 'name', None) or 'content.kb')
 
         url = (f'https://{self.__kb_hostname}:{self.__kb_port}{self.__api_temp_file_storage_upload}?'
                f'fileName={filename}&storageType=Temp')
 
         uploaded_id = ""
-        with open(filepath, 'rb') as kbfile:
-
+        kbfile = open(filepath, 'rb') if isinstance(filepath, str) else filepath
+        try:
             r = exec_request(self.__kb_session,
                              url,
                              method='POST',
                              timeout=self.settings.connection_timeout,
                              headers=headers,
-                             data=kbfile,
+                             data=UploadReader(kbfile, on_progress, self.settings.kb_transfer_chunk_size),
                              )
+        finally:
+            if isinstance(filepath, str):
+                kbfile.close()
 
-            if r.status_code == 201:
-                # Upload successful
-                uploaded_id = r.json().get('UploadId')
-                self.log.info('status=success, action=upload_file, msg="file {} uploaded", '
-                              'hostname="{}", db="{}"'.format(filepath, self.__kb_hostname, db_name))
-            else:
-                self.log.error('status=failed, action=upload_file, msg="failed to upload file {}", '
-                               'hostname="{}", db="{}"'.format(filepath, self.__kb_hostname, db_name))
+        if r.status_code == 201:
+            # Upload successful
+            uploaded_id = r.json().get('UploadId')
+            self.log.info('status=success, action=upload_file, msg="file {} uploaded", '
+                          'hostname="{}", db="{}"'.format(filename, self.__kb_hostname, db_name))
+        else:
+            self.log.error('status=failed, action=upload_file, msg="failed to upload file {}", '
+                           'hostname="{}", db="{}"'.format(filename, self.__kb_hostname, db_name))
 
         if uploaded_id:
             # make import
@@ -1278,10 +1415,10 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
             if r.status_code == 201:
                 # Upload successful
                 self.log.info('status=success, action=import_file, msg="file {} imported", '
-                              'hostname="{}", db="{}"'.format(filepath, self.__kb_hostname, db_name))
+                              'hostname="{}", db="{}"'.format(filename, self.__kb_hostname, db_name))
             else:
                 self.log.error('status=failed, action=import_file, msg="failed to import file {}", '
-                               'hostname="{}", db="{}"'.format(filepath, self.__kb_hostname, db_name))
+                               'hostname="{}", db="{}"'.format(filename, self.__kb_hostname, db_name))
 
             return r.status_code
         else:
@@ -1370,6 +1507,23 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
             self.log.error('status=failed, action=get_linked_groups, msg="can not get group links for {}", '
                            'hostname="{}", db="{}"'.format(content_item_id, self.__kb_hostname, db_name))
 
+    def get_objects_index(self, db_name: str, do_refresh=False) -> dict:
+        """Получить индекс объектов БД.
+
+        :param db_name: Имя БД
+        :param do_refresh: Обновить кэш
+        :return: {'id': {'name': 'value', 'guid': 'value', 'object_kind': 'value'}}
+        """
+        if do_refresh or db_name not in self.__objects_index:
+            index = {}
+            for i in self.get_all_objects(db_name):
+                index[i.get('id')] = {'name': i.get('name'),
+                                      'guid': i.get('guid'),
+                                      'object_kind': i.get('object_kind')}
+            self.__objects_index[db_name] = index
+
+        return self.__objects_index[db_name]
+
     def link_content_to_groups(self, db_name: str, content_items_ids: list, group_ids: list):
         """Связать идентификаторы контента с идентификаторами наборов
         установки.
@@ -1379,9 +1533,45 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
         :param group_ids: идентификаторы наборов установки
         :return:
         """
+        self.__link_content(db_name, content_items_ids, group_ids)
+
+    def link_content_to_groups_batch(self, db_name: str, groups_items: dict):
+        """Пакетное связывание контента с наборами установки. Элементы
+        контента с одинаковым набором групп объединяются в один запрос.
+
+        :param db_name: Имя БД
+        :param groups_items: {'group_id': ['content_item_id']}
+        :return: количество выполненных запросов
+        """
+        # для каждого элемента контента собираем все его наборы установки
+        item_groups = {}
+        for group_id, items_ids in groups_items.items():
+            for item_id in items_ids:
+                item_groups.setdefault(item_id, set()).add(group_id)
+
+        # элементы с одинаковым набором групп связываются одной операцией
+        batches = {}
+        for item_id, group_ids in item_groups.items():
+            batches.setdefault(frozenset(group_ids), []).append(item_id)
+
+        limit = self.settings.kb_objects_batch_size
+        requests_count = 0
+        for group_ids, items_ids in batches.items():
+            for offset in range(0, len(items_ids), limit):
+                self.__link_content(db_name, items_ids[offset:offset + limit], sorted(group_ids))
+                requests_count += 1
 
-        # получить перечень обновляемых объектов
-        content_item_names = [obj['name'] for obj in self.get_all_objects(db_name) if obj['id'] in content_items_ids]
+        self.log.info('status=success, action=link_content_to_groups_batch, '
+                      'msg="{} items linked to {} groups with {} requests", '
+                      'hostname="{}", db="{}"'.format(len(item_groups), len(groups_items), requests_count,
+                                                      self.__kb_hostname, db_name))
+
+        return requests_count
+
+    def __link_content(self, db_name: str, content_items_ids: list, group_ids: list):
+        # имена объектов нужны только для журнала, берем их из кэша
+        objects_index = self.get_objects_index(db_name)
+        content_item_names = [objects_index.get(i, {}).get('name', i) for i in content_items_ids]
 
         # получить имя набора установки с которым осуществляется связывание
         group_names = [group_data.get('name', '') for group_id, group_data in self.get_groups_list(db_name).items() if
@@ -1447,24 +1637,50 @@ class KnowledgeBase(ModuleInterface, LoggingHandler):
             # Создать путь в дереве наборов установки
             group_id = self.create_group_path(db_name, kb_meta['group_path'])
 
-            # Есть связанные элементы контента
-            if 'kb_tree' in kb_meta and kb_meta['kb_tree']:
-                contend_guid_strs = []
-                for content_type in kb_meta['kb_tree']:
-                    for content_path in kb_meta['kb_tree'][content_type]:
-                        key = (content_type, content_path)
-
-                        # Пробуем найти маппинг (Type, Path)->GUID
-                        if key in obj_map:
-                            contend_guid_strs.append(obj_map[key])
-                        else:
-                            self.log.error('status=failed, action=map_id_to_guid, msg="can not find object {}", '
-                                           'hostname="{}", db="{}"'.format(key, self.__kb_hostname,
-                                                                           db_name))
-
-                if contend_guid_strs:
-                    # Связать контент с набором установки
-                    self.link_content_to_groups(db_name, contend_guid_strs, [group_id, ])
+            contend_guid_strs = self.__map_kb_tree_to_ids(db_name, obj_map, kb_meta)
+            if contend_guid_strs:
+                # Связать контент с набором установки
+                self.link_content_to_groups(db_name, contend_guid_strs, [group_id, ])
+
+    def process_kb_metadata_batch(self, db_name, obj_map, kb_metas: list):
+        """Пакетная обработка метаданных наборов установки: сначала
+        создаются все наборы, затем контент связывается с ними минимальным
+        количеством запросов.
+
+        :param db_name: Имя БД
+        :param obj_map: {(content_type, content_path): 'content_item_id'}
+        :param kb_metas: список метаданных наборов установки (Groups/*.yaml)
+        :return:
+        """
+        groups_items = {}
+        for kb_meta in kb_metas:
+            if 'group_path' not in kb_meta or not kb_meta['group_path']:
+                continue
+            group_id = self.create_group_path(db_name, kb_meta['group_path'])
+            contend_guid_strs = self.__map_kb_tree_to_ids(db_name, obj_map, kb_meta)
+            if contend_guid_strs:
+                groups_items.setdefault(group_id, []).extend(contend_guid_strs)
+
+        if groups_items:
+            self.link_content_to_groups_batch(db_name, groups_items)
+
+    def __map_kb_tree_to_ids(self, db_name, obj_map, kb_meta) -> list:
+        contend_guid_strs = []
+        # Есть связанные элементы контента
+        if 'kb_tree' in kb_meta and kb_meta['kb_tree']:
+            for content_type in kb_meta['kb_tree']:
+                for content_path in kb_meta['kb_tree'][content_type]:
+                    key = (content_type, content_path)
+
+                    # Пробуем найти маппинг (Type, Path)->GUID
+                    if key in obj_map:
+                        contend_guid_strs.append(obj_map[key])
+                    else:
+                        self.log.error('status=failed, action=map_id_to_guid, msg="can not find object {}", '
+                                       'hostname="{}", db="{}"'.format(key, self.__kb_hostname,
+                                                                       db_name))
+
+        return contend_guid_strs
 
     def get_folder_path_by_id(self, db_name: str, folder_id: str) -> str:
         """Получить путь в дереве папок по ID папки.
@@ -1,13 +1,171 @@
+import copy
+import time
+import threading
+
 from datetime import datetime
-from typing import Iterator, List, Optional, Any
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Iterable, List, Optional, Any
 
 from mpsiemlib.common import ModuleInterface, MPSIEMAuth, LoggingHandler, MPComponents, Settings
 from mpsiemlib.common import exec_request, get_metrics_start_time, get_metrics_took_time
 
 
+TABLE_ADD_TIME_FORMAT = '%d.%m.%Y %H:%M:%S'
+
+
+@lru_cache(maxsize=65536)
+def _parse_table_datetime(value: str) -> int:
+    return round(datetime.strptime(value, TABLE_ADD_TIME_FORMAT).timestamp())
+
+
+def _to_table_number(value):
+    return value if type(value) is int else int(value)
+
+
+def _to_table_datetime(value):
+    return value if type(value) is int else _parse_table_datetime(value)
+
+
+def _split_table_rows(add: Optional[list], remove: Optional[list], size: int) -> List[dict]:
+    """
+    Параметры запросов изменения строк таблицы, не больше size строк в запросе.
+    Если строк больше size, сначала идут запросы на удаление, затем на добавление.
+
+    :param add: закодированные строки для добавления или None
+    :param remove: закодированные строки для удаления или None
+    :param size: максимальное количество строк в запросе
+    :return: [{'add': list | None, 'remove': list | None}]
+    """
+    if len(add or ()) + len(remove or ()) <= size:
+        return [{'add': add, 'remove': remove}]
+
+    return [{'add': None, 'remove': remove[i:i + size]} for i in range(0, len(remove or ()), size)] + \
+           [{'add': add[i:i + size], 'remove': None} for i in range(0, len(add or ()), size)]
+
+
+class TableRowEncoder:
+    """Кодирование строк табличного списка для построчной вставки/удаления.
+
+    В API значения передаются списком, позиция значения определяется
+    порядком полей в схеме. Позиции полей, конвертеры типов и обязательные
+    поля вычисляются один раз на схему, разбор строк с датой кэшируется.
+    """
+
+    CONVERTERS = {'number': _to_table_number,
+                  'datetime': _to_table_datetime}
+
+    def __init__(self, fields: List[dict]):
+        """
+        :param fields: поля схемы, см Tables.get_table_info
+        """
+        self.fields = [i.get('name') for i in fields]
+        # в какой позиции во вставляемом списке должен находится каждый атрибут
+        self.positions = {name: pos for pos, name in enumerate(self.fields)}
+        self.converters = {i.get('name'): self.CONVERTERS.get(i.get('type')) for i in fields}
+        # перед вставкой надо убедиться, что присутствуют ключевые поля и все поля, где запрещен null
+        self.key_fields = [i.get('name') for i in fields if i.get('primaryKey')]
+        self.not_nullable_fields = [i.get('name') for i in fields if not i.get('nullable')]
+        self.__required = frozenset(self.key_fields) | frozenset(self.not_nullable_fields)
+
+    def encode(self, row: dict) -> list:
+        """
+        :param row: {"field1": "value"}
+        :return: значения в порядке полей схемы
+        """
+        if not row.keys() >= self.__required:
+            self.__raise_missing(row)
+
+        ret = [None] * len(self.fields)
+        positions = self.positions
+        converters = self.converters
+        for k, v in row.items():
+            pos = positions.get(k)
+            if pos is None:
+                raise Exception(f'Key {k} not found in schema {positions.keys()}')
+            # Конвертируем типы данных т.к. при построчной вставке есть особенности
+            converter = converters[k]
+            ret[pos] = v if converter is None else converter(v)
+
+        return ret
+
+    def encode_rows(self, rows: Iterable[dict]) -> List[list]:
+        return [self.encode(r) for r in rows]
+
+    def __raise_missing(self, row: dict):
+        keys = set(self.key_fields)
+        if not keys.issubset(row.keys()):
+            raise Exception(f'Key fields {keys} not found in {row}')
+        raise Exception(f'Not nullable fields {set(self.not_nullable_fields)} not found in {row}')
+
+
+class TableSchemaRegistry:
+    """Реестр табличных списков: имя <-> ID, описания таблиц и кодировщики
+    строк. Общий для всех экземпляров Tables, записи разделены по адресу
+    Core и конвейеру и устаревают через ttl сек. Записи возвращаются по
+    ссылке и не должны изменяться, наружу Tables отдает их копии."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # {(hostname, siem_id): (время загрузки, {'name': свойства}, {'id': 'name'})}
+        self.__lists = {}
+        # {(hostname, siem_id, 'name'): (время загрузки, описание, TableRowEncoder)}
+        self.__schemas = {}
+
+    def set_tables(self, scope: tuple, tables: dict):
+        ids = {str(v.get('id')): k for k, v in tables.items()}
+        with self.__lock:
+            self.__lists[scope] = (time.monotonic(), tables, ids)
+
+    def get_tables(self, scope: tuple, ttl: float) -> Optional[tuple]:
+        """
+        :return: ({'name': свойства}, {'id': 'name'}) или None, если список устарел
+        """
+        entry = self.__lists.get(scope)
+        if entry is None or time.monotonic() - entry[0] > ttl:
+            return None
+        return entry[1], entry[2]
+
+    def set_schema(self, scope: tuple, table_name: str, table_info: dict) -> tuple:
+        schema = (table_info, TableRowEncoder(table_info.get('fields') or []))
+        with self.__lock:
+            self.__schemas[scope + (table_name,)] = (time.monotonic(),) + schema
+        return schema
+
+    def get_schema(self, scope: tuple, table_name: str, ttl: float) -> Optional[tuple]:
+        """
+        :return: (описание, TableRowEncoder) или None, если описание устарело
+        """
+        entry = self.__schemas.get(scope + (table_name,))
+        if entry is None or time.monotonic() - entry[0] > ttl:
+            return None
+        return entry[1], entry[2]
+
+    def invalidate(self, scope: Optional[tuple] = None, table_name: Optional[str] = None):
+        """
+        Сбросить кэш
+
+        :param scope: (hostname, siem_id), None - все
+        :param table_name: имя таблицы, None - список таблиц и все описания scope
+        :return:
+        """
+        with self.__lock:
+            if scope is None:
+                self.__lists.clear()
+                self.__schemas.clear()
+            elif table_name is not None:
+                self.__schemas.pop(scope + (table_name,), None)
+            else:
+                self.__lists.pop(scope, None)
+                for i in [i for i in self.__schemas if i[:2] == scope]:
+                    del self.__schemas[i]
+
+
 class Tables(ModuleInterface, LoggingHandler):
     """Tables module."""
-    __table_add_time_format = '%d.%m.%Y %H:%M:%S'
+
+    # Кэш списка таблиц и их схем, см Settings.tables_schema_ttl
+    schema_registry = TableSchemaRegistry()
 
     __api_table_info = '/api/events/v2/table_lists/{}?siem_id={}'
     __api_table_search = '/api/events/v2/table_lists/{}/content/search?siem_id={}'
@@ -26,14 +184,14 @@ class Tables(ModuleInterface, LoggingHandler):
         self.__core_session = auth.connect(MPComponents.CORE)
         self.__core_hostname = auth.creds.core_hostname
         self.__core_version = auth.get_core_version()
-        self.__tables_cache = {}
+        self.__core_major_version = int(self.__core_version.split('.')[0])
         self.log.debug('status=success, action=prepare, msg="Table Module init"')
 
     def get_tables_list(self, siem_id=None) -> dict:
         """Получить список всех установленных табличных списков :param siem_id:
         UUID конвейера.
 
-        :return: {'id': 'name'}
+        :return: {'name': {'id': 'UUID', 'type': 'fill type', ...}}
         """
         self.log.debug('status=prepare, action=get_tables_list, msg="Try to get table list", '
                        'hostname="{}", conveyor_id="{}"'.format(self.__core_hostname, siem_id))
@@ -41,20 +199,35 @@ class Tables(ModuleInterface, LoggingHandler):
         api_url = self.__api_table_list.format(siem_id)
         url = f'https://{self.__core_hostname}{api_url}'
         rq = exec_request(self.__core_session, url, method='GET', timeout=self.settings.connection_timeout)
-        self.__tables_cache.clear()
+        tables = {}
         response = rq.json()
         for i in response:
-            self.__tables_cache[i['name']] = {'id': i.get('token'),
-                                              'type': i.get('fillType').lower(),
-                                              'editable': i.get('editable'),
-                                              'ttl_enabled': i.get('ttlEnabled'),
-                                              'notifications': i.get('notifications')}
+            tables[i['name']] = {'id': i.get('token'),
+                                 'type': i.get('fillType').lower(),
+                                 'editable': i.get('editable'),
+                                 'ttl_enabled': i.get('ttlEnabled'),
+                                 'notifications': i.get('notifications')}
+        self.schema_registry.set_tables(self.__scope(siem_id), tables)
 
         self.log.info('status=success, action=get_table_list, msg="Found {} tables", '
-                      'hostname="{}", conveyor_id="{}"'.format(len(self.__tables_cache), self.__core_hostname,
+                      'hostname="{}", conveyor_id="{}"'.format(len(tables), self.__core_hostname,
                                                                siem_id))
 
-        return self.__tables_cache
+        # изменение результата вызывающим не должно затронуть общий кэш
+        return copy.deepcopy(tables)
+
+    def __scope(self, siem_id) -> tuple:
+        return self.__core_hostname, siem_id
+
+    def __get_tables(self, siem_id, table_name: Optional[str] = None, table_id: Optional[str] = None) -> tuple:
+        """Список таблиц из кэша. Список загружается заново, если он устарел
+        или в нем нет искомой таблицы."""
+        tables = self.schema_registry.get_tables(self.__scope(siem_id), self.settings.tables_schema_ttl)
+        if tables is None or (table_name is not None and table_name not in tables[0]) or \
+                (table_id is not None and table_id not in tables[1]):
+            by_name = self.get_tables_list(siem_id)
+            tables = by_name, {str(v.get('id')): k for k, v in by_name.items()}
+        return tables
 
     def get_table_data(self, table_name: str, filters=None, siem_id=None) -> Iterator[dict]:
         """Итеративно загружаем содержимое табличного списка.
@@ -140,7 +313,7 @@ class Tables(ModuleInterface, LoggingHandler):
         api_url = self.__api_table_import.format(table_name, siem_id)
 
         url = f'https://{self.__core_hostname}{api_url}'
-        if int(self.__core_version.split('.')[0]) < 25:
+        if self.__core_major_version < 25:
             headers = {'Content-Type': 'application/x-www-form-urlencoded'}
         else:
             headers = {'Content-Type': 'text/csv; charset=utf-8'}
@@ -184,13 +357,47 @@ class Tables(ModuleInterface, LoggingHandler):
                                                                          siem_id,
                                                                          imported_records))
 
-    def get_table_info(self, table_name, siem_id=None) -> dict:
-        """Получить метаданные по табличке.
+    def get_table_info(self, table_name, siem_id=None, do_refresh=False) -> dict:
+        """Получить метаданные по табличке. Метаданные кэшируются на
+        Settings.tables_schema_ttl сек.
 
         :param table_name: Имя таблицы
         :param siem_id: UUID конвейера
+        :param do_refresh: запросить метаданные, даже если они есть в кэше
         :return: {'property': 'value'}
         """
+        # изменение результата вызывающим не должно затронуть общий кэш
+        return copy.deepcopy(self.__get_table_schema(table_name, siem_id, do_refresh)[0])
+
+    def get_row_encoder(self, table_name, siem_id=None) -> TableRowEncoder:
+        """Кодировщик строк таблицы для построчной вставки, см set_table_row.
+
+        :param table_name: Имя таблицы
+        :param siem_id: UUID конвейера
+        :return: TableRowEncoder
+        """
+        return self.__get_table_schema(table_name, siem_id)[1]
+
+    def invalidate_cache(self, table_name: Optional[str] = None, siem_id=None):
+        """Сбросить кэш метаданных таблиц.
+
+        :param table_name: Имя таблицы, None - все таблицы конвейера
+        :param siem_id: UUID конвейера
+        :return:
+        """
+        self.schema_registry.invalidate(self.__scope(siem_id), table_name)
+
+    def __get_table_schema(self, table_name, siem_id=None, do_refresh=False) -> tuple:
+        schema = None
+        if not do_refresh:
+            schema = self.schema_registry.get_schema(self.__scope(siem_id), table_name,
+                                                     self.settings.tables_schema_ttl)
+        if schema is None:
+            schema = self.schema_registry.set_schema(self.__scope(siem_id), table_name,
+                                                     self.__request_table_info(table_name, siem_id))
+        return schema
+
+    def __request_table_info(self, table_name, siem_id=None) -> dict:
         self.log.debug('status=prepare, action=get_table_info, msg="Try to get table info for {}", '
                        'hostname="{}", conveyor_id="{}"'.format(table_name, self.__core_hostname, siem_id))
 
@@ -200,7 +407,7 @@ class Tables(ModuleInterface, LoggingHandler):
         rq = exec_request(self.__core_session, url, method='GET', timeout=self.settings.connection_timeout)
         response = dict(rq.json())
 
-        table_info = self.__tables_cache.get(table_name)
+        table_info = dict(self.__get_tables(siem_id, table_name=table_name)[0].get(table_name))
         table_info['size_max'] = response.get('maxSize')
         table_info['size_typical'] = response.get('typicalSize')
         table_info['ttl'] = response.get('ttl')
@@ -250,33 +457,33 @@ class Tables(ModuleInterface, LoggingHandler):
         :param siem_id: UUID конвейера
         :return: UUID
         """
-        if len(self.__tables_cache) == 0:
-            self.get_tables_list(siem_id)
-        table_id = self.__tables_cache.get(table_name)
-        if table_id is None:
+        table = self.__get_tables(siem_id, table_name=table_name)[0].get(table_name)
+        if table is None:
             raise Exception(f'Table list {table_name} not found in cache')
-        return table_id.get('id')
+        return table.get('id')
 
     def get_table_name_by_id(self, table_id: str, siem_id=None):
         """Получение имени таблицы по её ID.
 
-        :param table_id: Имя таблицы
+        :param table_id: ID таблицы
         :param siem_id: UUID конвейера
         :return: str
         """
-        if len(self.__tables_cache) == 0:
-            self.get_tables_list(siem_id)
-        for table in self.__tables_cache.items():
-            if str(table[1].get('id')) == table_id:
-                return table[0]
-            else:
-                raise Exception(f'Table with ID="{table_id}" not found in cache')
+        table_name = self.__get_tables(siem_id, table_id=str(table_id))[1].get(str(table_id))
+        if table_name is None:
+            raise Exception(f'Table with ID="{table_id}" not found in cache')
+        return table_name
 
     def set_table_row(self, table_name: str, add_rows: Optional[List[dict]] = None,
                       remove_rows: Optional[List[dict]] = None, siem_id=None):
         """Опасная (без остановки правил) работа со строками, установленных в
         SIEM таблиц.
 
+        Если строк больше Settings.tables_rows_request_size, изменения
+        отправляются несколькими запросами: сначала удаление, затем добавление.
+        Такое изменение не атомарно: при ошибке в одном из запросов изменения
+        из предыдущих запросов остаются в таблице.
+
         :param table_name: Имя таблицы
         :param add_rows: [{"field1": "value"}]
         :param remove_rows: [{"field1": "value"}]
@@ -293,47 +500,26 @@ class Tables(ModuleInterface, LoggingHandler):
 
         # в API добавление/удаление строк идет без явного маппинга на название полей.
         # маппинг определяется позицией значения в массиве, это неприемлемо
-        table_info = self.get_table_info(table_name, siem_id)
+        table_info, encoder = self.__get_table_schema(table_name, siem_id)
         if table_info.get('type') not in ['correlationrule', 'enrichmentrule']:
             raise Exception('Unsupported table type to add/remove row')
 
-        row_matrix = []  # шаблон для вставки нужного размера, заполненный None
-        fields_types = {}
-        attrs_position = {}  # в какой позиции во вставляемом списке должен находится каждый атрибут
-        key_fields = set()  # перед вставкой надо убедиться, что присутствуют ключевые поля
-        not_nullable_fields = set()  # перед вставкой надо убедиться, что заданы все поля где запрещен null
-        counter = 0
-        for i in table_info.get('fields'):  # определяем в каких позициях должны быть атрибуты
-            name = i.get('name')
-            attrs_position[name] = counter
-            fields_types[name] = i.get('type')
-
-            row_matrix.append(None)
-            if i.get('primaryKey'):
-                key_fields.add(name)
-            if not i.get('nullable'):
-                not_nullable_fields.add(name)
-            counter += 1
-
-        params = {'add': None, 'remove': None}
-        if add_rows is not None:
-            params['add'] = self.__prepare_rows(add_rows,
-                                                row_matrix,
-                                                attrs_position,
-                                                key_fields,
-                                                not_nullable_fields,
-                                                fields_types)
-        if remove_rows is not None:
-            params['remove'] = self.__prepare_rows(remove_rows,
-                                                   row_matrix,
-                                                   attrs_position,
-                                                   key_fields,
-                                                   not_nullable_fields,
-                                                   fields_types)
-
-        table_id = table_info.get('id')
-        api_url = self.__api_table_add_row.format(table_id, siem_id)
-        url = f'https://{self.__core_hostname}{api_url}'
+        # все строки кодируются до отправки, чтобы ошибка в данных не оставила таблицу изменённой частично
+        add = encoder.encode_rows(add_rows) if add_rows is not None else None
+        remove = encoder.encode_rows(remove_rows) if remove_rows is not None else None
+
+        url = f'https://{self.__core_hostname}{self.__api_table_add_row.format(table_info.get("id"), siem_id)}'
+        for params in _split_table_rows(add, remove, self.settings.tables_rows_request_size):
+            self.__put_table_rows(url, table_name, params, siem_id)
+
+        self.log.info('status=success, action=set_table_row, msg="Added {} rows Removed {} rows in table {}", '
+                      'hostname="{}", conveyor_id="{}"'.format(len(add_rows) if add_rows is not None else 0,
+                                                               len(remove_rows) if remove_rows is not None else 0,
+                                                               table_name,
+                                                               self.__core_hostname,
+                                                               siem_id))
+
+    def __put_table_rows(self, url: str, table_name: str, params: dict, siem_id=None):
         rq = exec_request(self.__core_session,
                           url, method='PUT',
                           timeout=self.settings.connection_timeout,
@@ -346,43 +532,88 @@ class Tables(ModuleInterface, LoggingHandler):
                                                                                 self.__core_hostname,
                                                                                 siem_id,
                                                                                 response.get('results')))
+            # схема таблицы могла измениться
+            self.invalidate_cache(table_name, siem_id)
             raise Exception('Got error while manipulate with table rows')
 
-        self.log.info('status=success, action=set_table_row, msg="Added {} rows Removed {} rows in table {}", '
-                      'hostname="{}", conveyor_id="{}"'.format(len(add_rows) if add_rows is not None else 0,
-                                                               len(remove_rows) if remove_rows is not None else 0,
-                                                               table_name,
-                                                               self.__core_hostname,
-                                                               siem_id))
+    def sync_table(self, table_name: str, rows: Iterable[dict], siem_id=None) -> dict:
+        """Привести содержимое табличного списка к rows, изменив только
+        отличающиеся строки. Строки сравниваются по первичному ключу (по всем
+        полям, если ключа нет) и отправляются через set_table_row. Обновленная
+        строка удаляется и добавляется заново. Системные поля, имя которых
+        начинается с "_" (например, _last_changed), не сравниваются.
+
+        Синхронизация не атомарна: удаление и добавление идут разными
+        запросами, а большие списки строк делятся на части по
+        Settings.tables_rows_request_size. При ошибке таблица остается
+        измененной частично, повторный вызов sync_table доводит ее до rows.
+
+        :param table_name: Имя таблицы
+        :param rows: итератор по строкам [{"field1": "value"}]
+        :param siem_id: UUID конвейера
+        :return: {'added': int, 'removed': int, 'updated': int}
+        """
+        table_info, encoder = self.__get_table_schema(table_name, siem_id)
+        if table_info.get('type') not in ['correlationrule', 'enrichmentrule']:
+            raise Exception('Unsupported table type to add/remove row')
+
+        fields = encoder.fields
+        # системные поля (_last_changed и др.) заполняет сервер, в сравнении строк они не участвуют
+        data_positions = [encoder.positions[i] for i in fields if not i.startswith('_')]
+        key_positions = [encoder.positions[i] for i in encoder.key_fields if not i.startswith('_')] or data_positions
+
+        def row_key(row):
+            return tuple(row[i] for i in key_positions)
+
+        def row_data(row):
+            return tuple(row[i] for i in data_positions)
+
+        def row_dict(row):
+            return {k: v for k, v in zip(fields, row) if v is not None}
+
+        # {ключ: строка в порядке полей схемы}
+        new_rows = {}
+        for row in rows:
+            encoded = tuple(encoder.encode(row))
+            new_rows[row_key(encoded)] = encoded
+
+        filters = {'select': fields,
+                   'where': '',
+                   'orderBy': [{'field': '_last_changed',
+                                'sortOrder': 'descending'}],
+                   'timeZone': 0}
+        add_rows = []
+        remove_rows = []
+        updated = 0
+        seen = set()
+        for row in self.get_table_data(table_name, filters, siem_id):
+            current = tuple(row.get(i) for i in fields)
+            key = row_key(current)
+            seen.add(key)
+            new_row = new_rows.get(key)
+            if new_row is not None and row_data(new_row) == row_data(current):
+                continue
+            remove_rows.append(row_dict(current))
+            if new_row is not None:
+                add_rows.append(row_dict(new_row))
+                updated += 1
+        add_rows.extend(row_dict(v) for k, v in new_rows.items() if k not in seen)
+
+        # сначала удаление, иначе обновленные строки конфликтуют по ключу
+        if remove_rows:
+            self.set_table_row(table_name, remove_rows=remove_rows, siem_id=siem_id)
+        if add_rows:
+            self.set_table_row(table_name, add_rows=add_rows, siem_id=siem_id)
+
+        ret = {'added': len(add_rows) - updated, 'removed': len(remove_rows) - updated, 'updated': updated}
+        self.log.info('status=success, action=sync_table, msg="Table {} synchronized", '
+                      'hostname="{}", conveyor_id="{}", added={}, removed={}, updated={}'.format(table_name,
+                                                                                                self.__core_hostname,
+                                                                                                siem_id,
+                                                                                                ret['added'],
+                                                                                                ret['removed'],
+                                                                                                ret['updated']))
 
-    def __prepare_rows(self, rows: List[dict], matrix: list, positions: dict, keys: set, not_nulls: set,
-                       fields_types: dict):
-        ret = list()
-        for r in rows:
-            tpl = matrix.copy()
-
-            if len(keys.intersection(set(r.keys()))) != len(keys):
-                raise Exception(f'Key fields {keys} not found in {r}')
-            if len(not_nulls.intersection(set(r.keys()))) != len(not_nulls):
-                raise Exception(f'Not nullable fields {not_nulls} not found in {r}')
-
-            for k, v in r.items():
-                pos = positions.get(k)
-                if pos is None:
-                    raise Exception(f'Key {k} not found in schema {positions.keys()}')
-
-                # Конвертируем типы данных т.к. при построчной вставке есть особенности
-                field_type = fields_types.get(k)
-                # converted = None
-                if field_type == 'number' and type(v) is not int:
-                    converted = int(v)
-                elif field_type == 'datetime' and type(v) is not int:
-                    converted = round(datetime.strptime(v, self.__table_add_time_format).timestamp())
-                else:
-                    converted = v
-
-                tpl[pos] = converted
-            ret.append(tpl)
         return ret
 
     def whitelist_rows_exists(self, table_name: str, rows: List[list]) -> List[bool]:
@@ -392,21 +623,10 @@ class Tables(ModuleInterface, LoggingHandler):
         :param rows: [["Subrule_Unix_PortForwarding", "445", "alert_context"]]
         :return:
         """
-        if int(self.__core_version.split('.')[0]) < 27:
-            raise Exception(f'SIEM version {self.__core_version} not supported whitelist API')
-
         self.log.debug('status=prepare, action=whitelist_rows_exists, msg="Check data available in whitelist {}", '
                        'hostname="{}"'.format(table_name, self.__core_hostname))
 
-        table_info = self.get_table_info(table_name)
-        table_id = table_info.get('id')
-        api_url = self.__api_whitelist_row_exists.format(table_id)
-        url = f'https://{self.__core_hostname}{api_url}'
-        response = exec_request(self.__core_session,
-                                url, method='POST',
-                                timeout=self.settings.connection_timeout,
-                                json=rows).json()
-        return response
+        return self.__whitelist_request(self.__api_whitelist_row_exists, table_name, rows).json()
 
     def insert_whitelist_rows(self, table_name: str, rows: List[list], siem_id=None):
         """Вставка данных в белый список.
@@ -416,21 +636,10 @@ class Tables(ModuleInterface, LoggingHandler):
         :param siem_id: str
         :return:
         """
-        if int(self.__core_version.split('.')[0]) < 27:
-            raise Exception(f'SIEM version {self.__core_version} not supported whitelist API')
-
         self.log.debug('status=prepare, action=insert_whitelist_rows, msg="Insert data to whitelist {}", '
                        'hostname="{}"'.format(table_name, self.__core_hostname))
 
-        table_info = self.get_table_info(table_name)
-        table_id = table_info.get('id')
-        api_url = self.__api_whitelist_insert.format(table_id)
-        url = f'https://{self.__core_hostname}{api_url}'
-        response = exec_request(self.__core_session,
-                                url, method='POST',
-                                timeout=self.settings.connection_timeout,
-                                json=rows)
-        return response.text
+        return self.__whitelist_request(self.__api_whitelist_insert, table_name, rows).text
 
     def remove_whitelist_rows(self, table_name: str, rows: List[list], siem_id=None):
         """Удаление данных из белого списка.
@@ -440,21 +649,66 @@ class Tables(ModuleInterface, LoggingHandler):
         :param siem_id: str
         :return:
         """
-        if int(self.__core_version.split('.')[0]) < 27:
-            raise Exception(f'SIEM version {self.__core_version} not supported whitelist API')
-
         self.log.debug('status=prepare, action=remove_whitelist_rows, msg="Remove data from whitelist {}", '
                        'hostname="{}"'.format(table_name, self.__core_hostname))
 
-        table_info = self.get_table_info(table_name)
-        table_id = table_info.get('id')
-        api_url = self.__api_whitelist_remove.format(table_id)
-        url = f'https://{self.__core_hostname}{api_url}'
-        response = exec_request(self.__core_session,
-                                url, method='POST',
-                                timeout=self.settings.connection_timeout,
-                                json=rows)
-        return response.text
+        return self.__whitelist_request(self.__api_whitelist_remove, table_name, rows).text
+
+    def whitelist_rows_exists_batch(self, table_name: str, rows: List[list]) -> List[bool]:
+        """Проверка нахождения строк в белых списках. Строки отправляются
+        пачками по Settings.whitelist_batch_size, до
+        Settings.whitelist_concurrency пачек одновременно.
+
+        :param table_name: Имя таблицы
+        :param rows: [["Subrule_Unix_PortForwarding", "445", "alert_context"]]
+        :return: результаты проверки в порядке rows
+        """
+        ret = []
+        for response in self.__whitelist_batch(self.__api_whitelist_row_exists, table_name, rows):
+            ret.extend(response.json())
+
+        return ret
+
+    def insert_whitelist_rows_batch(self, table_name: str, rows: List[list]) -> List[str]:
+        """Вставка данных в белый список пачками, см whitelist_rows_exists_batch.
+
+        :param table_name: Имя таблицы
+        :param rows: [["Subrule_Unix_PortForwarding", "445", "alert_context"]]
+        :return: ответы сервера по каждой пачке
+        """
+        return [i.text for i in self.__whitelist_batch(self.__api_whitelist_insert, table_name, rows)]
+
+    def remove_whitelist_rows_batch(self, table_name: str, rows: List[list]) -> List[str]:
+        """Удаление данных из белого списка пачками, см whitelist_rows_exists_batch.
+
+        :param table_name: Имя таблицы
+        :param rows: [["Subrule_Unix_PortForwarding", "445", "alert_context"]]
+        :return: ответы сервера по каждой пачке
+        """
+        return [i.text for i in self.__whitelist_batch(self.__api_whitelist_remove, table_name, rows)]
+
+    def __whitelist_batch(self, api: str, table_name: str, rows: List[list]) -> list:
+        size = self.settings.whitelist_batch_size
+        chunks = [rows[i:i + size] for i in range(0, len(rows), size)]
+        self.log.debug('status=prepare, action=whitelist_batch, msg="Send {} rows to whitelist {} in {} requests", '
+                       'hostname="{}"'.format(len(rows), table_name, len(chunks), self.__core_hostname))
+        if len(chunks) <= 1:
+            return [self.__whitelist_request(api, table_name, i) for i in chunks]
+
+        # ID таблицы определяется один раз, до запуска параллельных запросов
+        self.get_table_id_by_name(table_name)
+        with ThreadPoolExecutor(max_workers=self.settings.whitelist_concurrency) as executor:
+            return list(executor.map(lambda chunk: self.__whitelist_request(api, table_name, chunk), chunks))
+
+    def __whitelist_request(self, api: str, table_name: str, rows: List[list]):
+        if self.__core_major_version < 27:
+            raise Exception(f'SIEM version {self.__core_version} not supported whitelist API')
+
+        url = f'https://{self.__core_hostname}{api.format(self.get_table_id_by_name(table_name))}'
+        return exec_request(self.__core_session,
+                            url, method='POST',
+                            timeout=self.settings.connection_timeout,
+                            json=rows)
 
     def close(self):
         if self.__core_session is not None:
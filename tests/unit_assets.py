@@ -87,6 +87,19 @@ class AssetsTestCase(unittest.TestCase):
 
         self.assertTrue(counter == (request_size + 1))
 
+    def test_get_assets_configuration_by_ids(self):
+        group_id = self.__module.get_group_id_by_name("Root")
+        token = self.__module.create_assets_request(pdql='select(Host.@id as id)',
+                                                    group_ids=[group_id],
+                                                    include_nested=True)
+
+        hosts = [x.strip('"') for x in self.__module.get_assets_list_stream(token=token)]
+        hosts = hosts[1:11]
+
+        ret = self.__module.get_assets_configuration_by_ids(hosts)
+
+        self.assertTrue(list(ret) == hosts and all(ret.values()))
+
     def test_static_group(self):
         group_name = 'sdk-test-' + (''.join(choice(ascii_uppercase) for i in range(12)))  # случайное имя
         parent_id = self.__module.get_group_id_by_name("Root")
@@ -0,0 +1,230 @@
+import io
+import os
+import sys
+import codecs
+import unittest
+
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import requests
+
+from mpsiemlib.common import LoggingHandler, Settings, OperationWaiter
+from mpsiemlib.modules import Assets
+
+ASSETS_MODULE = sys.modules['mpsiemlib.modules.Assets']
+CSV_DATA = b'"id";"name"\r\n' + b''.join(b'"%d";"host-%d"\r\n' % (i, i) for i in range(5000))
+
+
+def http_error(status_code: int, headers: dict = None) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return requests.HTTPError(response=response)
+
+
+def make_assets() -> Assets:
+    # Assets без подключения к Core, запросы подменяются в тестах
+    assets = Assets.__new__(Assets)
+    LoggingHandler.__init__(assets)
+    assets.settings = Settings()
+    assets._Assets__core_hostname = 'core'
+    assets._Assets__core_session = None
+    return assets
+
+
+class FakeStreamResponse:
+    """
+    Потоковый ответ, обрывающийся после drop_after байт
+    """
+
+    def __init__(self, status_code: int, body: bytes, drop_after: int = None):
+        self.status_code = status_code
+        self.body = body
+        self.drop_after = drop_after
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            if self.drop_after is not None and i >= self.drop_after:
+                raise requests.exceptions.ChunkedEncodingError('Connection broken')
+            yield self.body[i:i + chunk_size]
+        if self.drop_after is not None and self.drop_after >= len(self.body):
+            raise requests.exceptions.ChunkedEncodingError('Connection broken')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.closed = True
+
+
+class ExportAssetsCsvTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.assets = make_assets()
+        self.headers = []
+        self.responses = []
+
+    def __export(self, respond, **kwargs):
+        def exec_request(session, url, method='GET', timeout=30, **params):
+            self.headers.append(params['headers'])
+            response = respond(len(self.headers), params['headers'])
+            self.responses.append(response)
+            return response
+
+        output = io.BytesIO()
+        with mock.patch.object(ASSETS_MODULE, 'exec_request', exec_request):
+            written = self.assets.export_assets_csv('token', output, chunk_size=4096, **kwargs)
+
+        return written, output.getvalue()
+
+    def test_gzip(self):
+        written, data = self.__export(lambda attempt, headers: FakeStreamResponse(200, CSV_DATA), add_bom=True)
+
+        self.assertTrue(data == codecs.BOM_UTF8 + CSV_DATA and written == len(data) and
+                        self.headers == [{'Accept-Encoding': 'gzip'}] and self.responses[0].closed)
+
+    def test_range_resume(self):
+        def respond(attempt, headers):
+            if attempt == 1:
+                return FakeStreamResponse(200, CSV_DATA, drop_after=40000)
+            return FakeStreamResponse(206, CSV_DATA[int(headers['Range'][6:-1]):])
+
+        written, data = self.__export(respond)
+
+        self.assertTrue(data == CSV_DATA and written == len(CSV_DATA) and
+                        self.headers[1] == {'Accept-Encoding': 'identity', 'Range': 'bytes=40960-'} and
+                        all(i.closed for i in self.responses))
+
+    def test_range_not_supported(self):
+        def respond(attempt, headers):
+            return FakeStreamResponse(200, CSV_DATA, drop_after=40000 if attempt == 1 else None)
+
+        written, data = self.__export(respond)
+
+        self.assertTrue(data == CSV_DATA and len(self.headers) == 2)
+
+    def test_range_complete(self):
+        def respond(attempt, headers):
+            if attempt == 1:
+                return FakeStreamResponse(200, CSV_DATA, drop_after=len(CSV_DATA))
+            raise http_error(416, {'Content-Range': f'bytes */{len(CSV_DATA)}'})
+
+        written, data = self.__export(respond)
+
+        self.assertTrue(data == CSV_DATA and len(self.headers) == 2)
+
+    def test_client_error_not_retried(self):
+        def respond(attempt, headers):
+            raise http_error(401)
+
+        with self.assertRaises(requests.HTTPError):
+            self.__export(respond)
+
+        self.assertEqual(len(self.headers), 1)
+
+    def test_server_error_retried(self):
+        def respond(attempt, headers):
+            if attempt == 1:
+                raise http_error(503)
+            return FakeStreamResponse(200, CSV_DATA)
+
+        written, data = self.__export(respond)
+
+        self.assertTrue(data == CSV_DATA and len(self.headers) == 2)
+
+
+class DeleteAssetsBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.assets = make_assets()
+        self.assets.settings.assets_delete_batch_size = 3
+        self.assets.settings.operations_poll_first = 0.01
+        self.assets.settings.operations_poll_max = 0.02
+        self.assets._Assets__waiter = OperationWaiter(self.assets.settings)
+        self.assets._Assets__delete_assets_by_ids = self.__delete_assets_by_ids
+        self.assets._Assets__remove_assets_get_status = self.__remove_assets_get_status
+        self.batches = []
+        self.operations = {}
+
+    def __delete_assets_by_ids(self, asset_ids):
+        self.batches.append(list(asset_ids))
+        if 'not-started' in asset_ids:
+            return None
+        if 'broken' in asset_ids:
+            raise Exception('Connection refused')
+        operation_id = f'operation-{asset_ids[0]}'
+        self.operations[operation_id] = asset_ids
+        return operation_id
+
+    def __remove_assets_get_status(self, operation_id):
+        asset_ids = self.operations[operation_id]
+        if 'hanging' in asset_ids:
+            return None
+        failed = sum(1 for i in asset_ids if i.startswith('locked'))
+        return {'totalCount': len(asset_ids), 'succeedCount': len(asset_ids) - failed, 'failedCount': failed}
+
+    def test_batches(self):
+        asset_ids = [f'asset-{i}' for i in range(7)] + ['locked-1']
+        ret = self.assets.delete_assets_by_ids_batch(asset_ids)
+
+        self.assertEqual(sorted(len(i) for i in self.batches), [2, 3, 3])
+        self.assertEqual(sorted(i for batch in self.batches for i in batch), sorted(asset_ids))
+        self.assertEqual(ret, {'totalCount': 8, 'succeedCount': 7, 'failedCount': 1, 'unconfirmedIds': []})
+
+    def test_unconfirmed(self):
+        asset_ids = ['asset-1', 'asset-2', 'not-started', 'broken', 'asset-3', 'asset-4', 'hanging']
+        ret = self.assets.delete_assets_by_ids_batch(asset_ids, batch_size=2, timeout=0.1)
+
+        self.assertEqual(ret, {'totalCount': 7, 'succeedCount': 4, 'failedCount': 0,
+                               'unconfirmedIds': ['not-started', 'broken', 'hanging']})
+
+
+class CsvPartsTestCase(unittest.TestCase):
+    HEADER = '"@Host";"@Description"\r\n'
+    ROWS = ['"host-1";"one line"\r\n',
+            '"host-2";"first line\n',
+            'second line\r\n',
+            'third ""quoted"" line"\r\n',
+            '"host-3";"last"']
+
+    @staticmethod
+    def __parts(source, part_rows):
+        return [i.decode('utf-8') for i in Assets._Assets__iter_csv_parts(source, part_rows)]
+
+    def test_multiline_value(self):
+        parts = self.__parts(iter([self.HEADER] + self.ROWS), 1)
+
+        self.assertEqual(parts, [self.HEADER + self.ROWS[0],
+                                 self.HEADER + ''.join(self.ROWS[1:4]),
+                                 self.HEADER + self.ROWS[4] + '\r\n'])
+
+    def test_part_boundary(self):
+        parts = self.__parts(iter([self.HEADER] + self.ROWS), 2)
+
+        self.assertEqual(parts, [self.HEADER + ''.join(self.ROWS[:4]), self.HEADER + self.ROWS[4] + '\r\n'])
+
+    def test_file(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'assets.csv')
+            with open(path, 'wb') as csv_file:
+                csv_file.write(codecs.BOM_UTF8 + ''.join([self.HEADER] + self.ROWS).encode('utf-8'))
+            parts = self.__parts(path, 10)
+
+        self.assertEqual(parts, [self.HEADER + ''.join(self.ROWS) + '\r\n'])
+
+    def test_lines_without_newline(self):
+        parts = self.__parts(iter(['"@Host"', '"host-1"', '"host-2"']), 1)
+
+        self.assertEqual(parts, ['"@Host"\r\n"host-1"\r\n', '"@Host"\r\n"host-2"\r\n'])
+
+    def test_line_endings_unchanged(self):
+        rows = ['"@Host";"@Description"\n', '"host-1";"first\r', 'second"\n', '"host-2";"bare cr"\r']
+        parts = self.__parts(iter(rows), 10)
+
+        self.assertEqual(parts, [''.join(rows)])
+
+
+if __name__ == '__main__':
+    unittest.main()
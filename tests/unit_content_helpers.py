@@ -0,0 +1,294 @@
+import io
+import os
+import pickle
+import shutil
+import zipfile
+import unittest
+
+from types import SimpleNamespace
+from tempfile import TemporaryDirectory
+
+from mpsiemlib.helpers import ContentDependencyIndex, ContentPack, ContentPatch, ContentPatchError, LazyRule, \
+    RuleLexer, YAMLParseCache, ZipFS, content_folder_to_work_copy, work_copy_to_content_folder
+
+TEST_KB = os.path.join(os.path.dirname(__file__), 'test.kb')
+
+
+class ContentPackTestCase(unittest.TestCase):
+
+    def test_lazy_pack_equals_eager(self):
+        eager = ContentPack(TEST_KB)
+        lazy = ContentPack(TEST_KB, lazy=True)
+        try:
+            is_lazy = all(isinstance(i, LazyRule) for i in lazy.cr_rules.values())
+            is_equal = {k: (v.name, v.code, v.meta, v.i18n_ru) for k, v in eager.cr_rules.items()} == \
+                       {k: (v.name, v.code, v.meta, v.i18n_ru) for k, v in lazy.cr_rules.items()}
+        finally:
+            lazy.close()
+
+        self.assertTrue(is_lazy and is_equal and len(eager.cr_rules) > 0)
+
+    def test_lazy_name_does_not_load(self):
+        pack = ContentPack(TEST_KB, lazy=True)
+        try:
+            names = [i.name for i in pack.cr_rules.values()]
+            is_loaded = any(i.is_loaded for i in pack.cr_rules.values())
+        finally:
+            pack.close()
+
+        self.assertTrue(names == ['TestRule'] and not is_loaded)
+
+    def test_lazy_evict(self):
+        pack = ContentPack(TEST_KB, lazy=True)
+        try:
+            rule = pack.cr_rules['LOC-CR-166']
+            code = rule.code
+            is_loaded = rule.is_loaded
+            pack.evict()
+            is_evicted = not rule.is_loaded
+            is_reloaded = rule.code == code
+        finally:
+            pack.close()
+
+        self.assertTrue(is_loaded and is_evicted and is_reloaded)
+
+    def test_lazy_close(self):
+        pack = ContentPack(TEST_KB, lazy=True)
+        pack.close()
+        pack.close()
+
+        with self.assertRaises(ValueError):
+            pack.cr_rules['LOC-CR-166'].load()
+
+    def test_code_without_comments_reset(self):
+        rule = ContentPack(TEST_KB).cr_rules['LOC-CR-166']
+        before = rule.code_without_comments
+        rule.code = 'rule Changed: Event # comment'
+
+        self.assertTrue('TestRule' in before and rule.code_without_comments == 'rule Changed: Event ')
+
+    def test_dump_to_kb_file(self):
+        pack = ContentPack(TEST_KB)
+        kb_file = io.BytesIO()
+        pack.dump_to_kb_file(kb_file)
+        kb_file.seek(0)
+        fs = ZipFS(kb_file)
+        try:
+            dumped = ContentPack(fs)
+        finally:
+            fs.close()
+
+        def rules(content_pack):
+            return {k: (v.name, v.code, v.meta, v.i18n_ru) for k, v in content_pack.cr_rules.items()}
+
+        self.assertTrue(len(pack.cr_rules) > 0 and rules(pack) == rules(dumped))
+        self.assertTrue(pack.kb_tree == dumped.kb_tree and pack.taxonomy == dumped.taxonomy and
+                        pack.origins == dumped.origins and pack.event_categories == dumped.event_categories and
+                        pack.tags == dumped.tags and pack.properties == dumped.properties)
+
+    def test_rule_lexer_overlapping_tokens(self):
+        code = 'id = "Name"\nsrc.ip = $ip\nquery q(ip) from Hosts where filter::Is_Admin()\n'
+        tokens = RuleLexer('formula_name', 'event_field', 'query', 'macro', 'insert_into').scan(code)
+
+        self.assertEqual(tokens, {'formula_name': ['Name'], 'event_field': ['id', 'src.ip'], 'query': ['Hosts'],
+                                  'macro': ['Is_Admin'], 'insert_into': []})
+
+    def test_pack_pickle(self):
+        pack = pickle.loads(pickle.dumps(ContentPack(TEST_KB)))
+
+        self.assertEqual(pack.cr_rules['LOC-CR-166'].name, 'TestRule')
+
+    def test_yaml_cache(self):
+        with TemporaryDirectory() as tmp:
+            cache_dir = os.path.join(tmp, 'cache')
+            first = ContentPack(TEST_KB, cache_dir=cache_dir)
+            second = ContentPack(TEST_KB, cache_dir=cache_dir)
+            is_cached = any(name.endswith('.marshal') for _, _, names in os.walk(cache_dir) for name in names)
+
+        self.assertTrue(is_cached and first.cr_rules['LOC-CR-166'].meta == second.cr_rules['LOC-CR-166'].meta)
+
+    @unittest.skipUnless(os.name == 'posix', 'POSIX permissions')
+    def test_yaml_cache_shared_dir(self):
+        with TemporaryDirectory() as tmp:
+            os.chmod(tmp, 0o777)
+            with self.assertRaises(Exception):
+                YAMLParseCache(tmp)
+
+    def test_content_folder_to_work_copy_workers(self):
+        with TemporaryDirectory() as tmp:
+            content_folder = os.path.join(tmp, 'content')
+            os.mkdir(content_folder)
+            for i in ('first.kb', 'second.kb'):
+                shutil.copyfile(TEST_KB, os.path.join(content_folder, i))
+
+            files = []
+            for workers in (None, 2):
+                work_copy = os.path.join(tmp, f'work_copy_{workers}')
+                content_folder_to_work_copy(content_folder, work_copy, workers=workers)
+                files.append(sorted(os.path.relpath(os.path.join(root, name), work_copy)
+                                    for root, _, names in os.walk(work_copy) for name in names))
+
+        self.assertTrue(len(files[0]) > 0 and files[0] == files[1])
+
+    def test_work_copy_to_content_folder_incremental(self):
+        with TemporaryDirectory() as tmp:
+            content_folder = os.path.join(tmp, 'content')
+            os.mkdir(content_folder)
+            shutil.copyfile(TEST_KB, os.path.join(content_folder, 'test.kb'))
+            work_copy = os.path.join(tmp, 'work_copy')
+            content_folder_to_work_copy(content_folder, work_copy)
+
+            # второй набор установки со вторым правилом
+            content = os.path.join(work_copy, 'Content')
+            first = [os.path.relpath(root, content).replace(os.sep, '/')
+                     for root, _, names in os.walk(content) if 'rule.co' in names][0]
+            second = os.path.join(content, os.path.dirname(first), 'second')
+            shutil.copytree(os.path.join(content, first), second)
+            for name, old, new in (('id.yaml', 'LOC-CR-166', 'LOC-CR-167'),
+                                   ('metainfo.yaml', 'LOC-CR-166', 'LOC-CR-167'),
+                                   ('rule.co', 'TestRule', 'SecondRule')):
+                with open(os.path.join(second, name), 'rt', encoding='utf-8') as src:
+                    data = src.read().replace(old, new)
+                with open(os.path.join(second, name), 'wt', encoding='utf-8') as dst:
+                    dst.write(data)
+            for group, path in (('first', first), ('second', os.path.dirname(first) + '/second')):
+                with open(os.path.join(work_copy, 'Groups', f'{group}.yaml'), 'wt', encoding='utf-8') as dst:
+                    dst.write(f'kb_tree:\n  correlation:\n  - {path}\n')
+
+            build_folder = os.path.join(tmp, 'build')
+            kb_paths = [os.path.join(build_folder, f'{i}.kb') for i in ('first', 'second')]
+
+            def build():
+                # время изменения сбрасывается, чтобы отличить перезаписанные файлы
+                for i in kb_paths:
+                    if os.path.isfile(i):
+                        os.utime(i, (0, 0))
+                work_copy_to_content_folder(work_copy, build_folder, incremental=True)
+                return [os.path.getmtime(i) != 0 for i in kb_paths]
+
+            is_built = build()
+            is_rebuilt = build()
+            with open(os.path.join(second, 'rule.co'), 'at', encoding='utf-8') as rule_file:
+                rule_file.write('\n# changed')
+            is_changed = build()
+            rules = [list(ContentPack(i).cr_rules) for i in kb_paths]
+            is_state = os.path.isfile(os.path.join(build_folder, '.build_state.json'))
+
+        self.assertEqual((is_built, is_rebuilt, is_changed), ([True, True], [False, False], [False, True]))
+        self.assertTrue(rules == [['LOC-CR-166'], ['LOC-CR-167']] and is_state)
+
+
+class ContentDependencyIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # набор установки в памяти: правила и табличные списки с атрибутами ContentPack
+        def rule(object_id, **attributes):
+            return SimpleNamespace(ObjectId=object_id, **attributes)
+
+        pack = SimpleNamespace()
+        pack.tlists = {i: SimpleNamespace(ObjectId=i, name=name)
+                       for i, name in (('TL-1', 'Hosts'), ('TL-2', 'Users'), ('TL-3', 'Ports'))}
+        pack.NAMES = {'correlation': {'LIST': {
+            'CR-1': rule('CR-1', query_tlists={'Hosts', 'Users'}, macros=set()),
+            'CR-2': rule('CR-2', query_tlists={'Ports'}, macros={'Is_Admin'}),
+            'CR-3': rule('CR-3', query_tlists=set(), macros=set())}},
+            'enrichment': {'LIST': {
+                'ER-1': rule('ER-1', query_tlists=set(), insert_into_tables={'Hosts'}, remove_from_tables=set(),
+                             macros=set())}}}
+        self.index = ContentDependencyIndex(pack)
+
+    def test_dependents(self):
+        self.assertTrue(self.index.get_dependents(ContentDependencyIndex.READS_TABLE, 'Hosts') == {'CR-1'} and
+                        self.index.get_table_users('Hosts') == {'CR-1', 'ER-1'} and
+                        self.index.get_dependencies('CR-1', ContentDependencyIndex.READS_TABLE) == {'Hosts', 'Users'})
+
+    def test_closure(self):
+        self.assertEqual(self.index.get_closure({'CR-1'}), {'CR-1', 'TL-1', 'TL-2'})
+        self.assertEqual(self.index.get_closure({'TL-1'}, reverse=True), {'TL-1', 'CR-1', 'ER-1'})
+
+    def test_deploy_closure(self):
+        # измененный табличный список: правила, которые его используют, и их остальные табличные списки
+        self.assertEqual(self.index.get_deploy_closure({'TL-1'}), {'TL-1', 'CR-1', 'ER-1', 'TL-2'})
+
+    def test_deploy_closure_macro(self):
+        self.assertEqual(self.index.get_deploy_closure(set(), macros={'Is_Admin'}), {'CR-2', 'TL-3'})
+
+
+class FakeKnowledgeBase:
+    """
+    KB, экспортирующая набор установки из файла
+    """
+
+    IMPORT_ADD_AND_UPDATE = 'update'
+
+    def __init__(self, kb_path, kb_hash='hash'):
+        self.kb_path = kb_path
+        self.kb_hash = kb_hash
+        self.exports = 0
+        self.import_status = 201
+
+    def get_all_objects(self, db_name, filters=None, group_id=None):
+        yield {'id': 'kb-1', 'guid': 'LOC-CR-166', 'object_kind': 'CorrelationRule', 'name': 'TestRule',
+               'hash': self.kb_hash}
+
+    def export_group(self, db_name, group_id, local_filepath):
+        self.exports += 1
+        shutil.copyfile(self.kb_path, local_filepath)
+        return os.path.getsize(local_filepath)
+
+    def import_group(self, db_name, filepath, mode=None, on_progress=None):
+        return self.import_status
+
+
+class ContentPatchTestCase(unittest.TestCase):
+
+    def test_diff_unchanged(self):
+        kb = FakeKnowledgeBase(TEST_KB)
+        changes = ContentPatch(kb, 'dev', ContentPack(TEST_KB)).diff(group_id='group')
+
+        self.assertEqual(changes['unchanged'], {'LOC-CR-166'})
+
+    def test_diff_description_changed(self):
+        with TemporaryDirectory() as tmp:
+            kb_path = os.path.join(tmp, 'kb.kb')
+            with zipfile.ZipFile(TEST_KB) as src, zipfile.ZipFile(kb_path, 'w') as dst:
+                for i in src.namelist():
+                    data = src.read(i)
+                    if i == 'correlations/LOC-CR-166/i18n/i18n_ru.yaml':
+                        data = 'Description: Changed'.encode('utf-8')
+                    dst.writestr(i, data)
+            changes = ContentPatch(FakeKnowledgeBase(kb_path), 'dev', ContentPack(TEST_KB)).diff(group_id='group')
+
+        self.assertEqual(changes['modified'], {'LOC-CR-166'})
+
+    def test_diff_snapshot(self):
+        with TemporaryDirectory() as tmp:
+            store_path = os.path.join(tmp, 'patch.json')
+            kb = FakeKnowledgeBase(TEST_KB)
+            patch = ContentPatch(kb, 'dev', ContentPack(TEST_KB), store_path)
+            patch.diff(group_id='group')
+            patch.commit()
+            changes = ContentPatch(kb, 'dev', ContentPack(TEST_KB), store_path).diff(group_id='group')
+
+        self.assertTrue(kb.exports == 1 and changes['unchanged'] == {'LOC-CR-166'})
+
+    def test_apply_failed(self):
+        with TemporaryDirectory() as tmp:
+            kb_path = os.path.join(tmp, 'kb.kb')
+            with zipfile.ZipFile(TEST_KB) as src, zipfile.ZipFile(kb_path, 'w') as dst:
+                for i in src.namelist():
+                    if not i.startswith('correlations/'):
+                        dst.writestr(i, src.read(i))
+            kb = FakeKnowledgeBase(kb_path)
+            kb.import_status = 400
+            patch = ContentPatch(kb, 'dev', ContentPack(TEST_KB))
+            patch.diff(group_id='group')
+
+            with self.assertRaises(ContentPatchError) as err:
+                patch.apply()
+
+        self.assertEqual(err.exception.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,7 @@ from tempfile import TemporaryDirectory
 from uuid import UUID
 
 from mpsiemlib.common import *
+from mpsiemlib.helpers import KBDeltaSync, KBDeployQueue
 from mpsiemlib.modules import MPSIEMWorker
 from tests.helpers import gen_lowercase_string, gen_uppercase_string
 from tests.settings import creds, settings
@@ -208,6 +209,26 @@ class KBTestCase(unittest.TestCase):
         content_item = self.__module.get_content_items_by_group_id(db_name, new_group_id_str, False)[0]
         self.assertEqual('installed', content_item.get('deployment_status', ''))
 
+    def test_deploy_queue(self):
+        db_name = self.__choose_deployable_db()
+
+        group_ids = []
+        for i in range(2):
+            group_id = self.__module.create_group(db_name, gen_uppercase_string(12))  # случайное имя
+            self.__module.create_co_rule(db_name, gen_lowercase_string(20), self.__test_co_rule, 'Descr', None,
+                                         group_ids=[group_id, ])
+            group_ids.append(group_id)
+
+        progress = []
+        with KBDeployQueue(self.__module, db_name, on_progress=lambda job, status: progress.append(status)) as queue:
+            for group_id in group_ids:
+                queue.install_objects_by_group_id(group_id)
+            statuses = queue.wait()
+
+        self.assertEqual(len(group_ids), len(statuses))
+        self.assertTrue(all(i.get('deployment_status') == 'succeeded' for i in statuses))
+        self.assertTrue(len(progress) >= len(group_ids))
+
     @unittest.skip('Not Implemented')
     def test_deploy_group(self):
         db_name = self.__choose_deployable_db()
@@ -488,6 +509,30 @@ class KBTestCase(unittest.TestCase):
 
         self.assertCountEqual(group_ids, [child_group_id_str, second_group_id_str])
 
+    def test_link_content_to_groups_batch(self):
+        db_name = self.__choose_deployable_db()
+
+        first_group_id_str = self.__module.create_group(db_name, gen_uppercase_string(12))
+        second_group_id_str = self.__module.create_group(db_name, gen_uppercase_string(12))
+
+        folder_name = gen_uppercase_string(12)  # случайное имя
+        new_folder_id_str = self.__module.create_folder(db_name, folder_name, None)
+
+        code = self.__test_co_rule
+        first_rule_id_str = self.__module.create_co_rule(db_name, gen_lowercase_string(20), code, 'Descr',
+                                                         new_folder_id_str)
+        second_rule_id_str = self.__module.create_co_rule(db_name, gen_lowercase_string(20), code, 'Descr',
+                                                          new_folder_id_str)
+
+        requests_count = self.__module.link_content_to_groups_batch(db_name, {
+            first_group_id_str: [first_rule_id_str, second_rule_id_str],
+            second_group_id_str: [first_rule_id_str, second_rule_id_str]
+        })
+
+        self.assertEqual(requests_count, 1)
+        self.assertCountEqual(self.__module.get_linked_groups(db_name, second_rule_id_str),
+                              [first_group_id_str, second_group_id_str])
+
     def test_get_folder_path_by_id(self):
         db_name = self.__choose_deployable_db()
         root_folder_name = gen_uppercase_string(12)  # случайное имя
@@ -628,6 +673,29 @@ class KBTestCase(unittest.TestCase):
         rule_ids = [obj['id'] for obj in rule_data]
         self.assertCountEqual([root_rule_id_str, child_rule_id_str], rule_ids)
 
+    def test_delta_sync(self):
+        db_name = self.__choose_deployable_db()
+
+        with TemporaryDirectory() as tmp_dir_name:
+            store_path = os.path.join(tmp_dir_name, 'snapshot.json')
+
+            sync = KBDeltaSync(self.__module, db_name, store_path)
+            sync.refresh()
+            sync.commit()
+
+            folder_name = gen_uppercase_string(12)  # случайное имя
+            new_folder_id_str = self.__module.create_folder(db_name, folder_name, None)
+            rule_name = gen_lowercase_string(20)  # случайное имя
+            new_rule_id_str = self.__module.create_co_rule(db_name, rule_name, self.__test_co_rule, 'Descr',
+                                                           new_folder_id_str)
+
+            sync = KBDeltaSync(self.__module, db_name, store_path)
+            delta = sync.refresh()
+            bodies = sync.fetch_changed()
+
+            self.assertIn(new_rule_id_str, delta['added'])
+            self.assertIn(new_rule_id_str, bodies)
+
 
 if __name__ == '__main__':
     unittest.main()
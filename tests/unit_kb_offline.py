@@ -0,0 +1,279 @@
+import os
+import time
+import threading
+import unittest
+
+from tempfile import TemporaryDirectory
+
+from mpsiemlib.common import LoggingHandler, Settings, OperationWaiter
+from mpsiemlib.helpers import KBDeltaSync, KBDeployQueue, KBTableExporter
+from mpsiemlib.modules import KnowledgeBase
+
+
+class FakeKB:
+    """
+    KnowledgeBase без подключения к KB: листинг и тела правил берутся из self.rules
+    """
+
+    def __init__(self):
+        self.rules = {'kb-1': {'Id': 'kb-1', 'ObjectId': 'LOC-CR-1', 'SystemName': 'Rule_1',
+                               'ObjectKind': 'CorrelationRule', 'FolderPath': 'Correlations',
+                               'DeploymentStatus': 'NotInstalled',
+                               'CompilationStatus': {'CompilationStatusId': 'Success', 'SdkVersion': '1'},
+                               'Formula': 'rule Rule_1: Event',
+                               'LocalizationRules': []}}
+        self.bodies_fetched = []
+        self.kb = KnowledgeBase.__new__(KnowledgeBase)
+        LoggingHandler.__init__(self.kb)
+        self.kb.settings = Settings()
+        self.kb._KnowledgeBase__kb_hostname = 'core'
+        self.kb._KnowledgeBase__iterate_objects = self.__iterate_objects
+
+    def __iterate_objects(self, url, params, headers, offset, limit):
+        rows = [{k: v for k, v in i.items() if k not in ('Formula', 'LocalizationRules')}
+                for i in self.rules.values()]
+        return rows[offset:offset + limit]
+
+    def get_all_objects(self, db_name, filters=None, group_id=None):
+        return self.kb.get_all_objects(db_name, filters, group_id)
+
+    def get_rule(self, db_name, content_type, rule_id):
+        self.bodies_fetched.append(rule_id)
+        rule = self.rules[rule_id]
+        return {'id': rule['Id'],
+                'guid': rule['ObjectId'],
+                'name': rule['SystemName'],
+                'formula': rule['Formula'],
+                'localization_rules': rule['LocalizationRules'],
+                'compilation_status': rule['CompilationStatus']['CompilationStatusId'],
+                'deployment_status': rule['DeploymentStatus'].lower()}
+
+
+class KBDeltaSyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.store_path = os.path.join(self.tmp.name, 'dev.snapshot.json')
+        self.kb = FakeKB()
+        self.__sync()
+        self.kb.bodies_fetched.clear()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def __sync(self):
+        sync = KBDeltaSync(self.kb, 'dev', self.store_path)
+        sync.refresh()
+        sync.fetch_changed()
+        sync.commit()
+        return sync.delta
+
+    def test_status_change(self):
+        self.kb.rules['kb-1']['DeploymentStatus'] = 'Installed'
+        self.kb.rules['kb-1']['CompilationStatus'] = {'CompilationStatusId': 'Failed', 'SdkVersion': '2'}
+        delta = self.__sync()
+
+        self.assertTrue(delta['modified'] == set() and self.kb.bodies_fetched == [])
+
+    def test_rename(self):
+        self.kb.rules['kb-1']['SystemName'] = 'Rule_2'
+        delta = self.__sync()
+
+        self.assertTrue(delta['modified'] == {'kb-1'} and self.kb.bodies_fetched == ['kb-1'])
+
+    def test_localization_change(self):
+        sync = KBDeltaSync(self.kb, 'dev', self.store_path)
+        sync.refresh()
+        # листинг изменился, а тело правила нет
+        sync.delta['modified'].add('kb-1')
+        sync.fetch_changed()
+        unchanged = sync.delta['modified'] == set()
+
+        self.kb.rules['kb-1']['LocalizationRules'] = [{'Description': 'Changed'}]
+        sync.refresh()
+        sync.delta['modified'].add('kb-1')
+        sync.fetch_changed()
+
+        self.assertTrue(unchanged and sync.delta['modified'] == {'kb-1'})
+
+
+class FakeDeployKB:
+    """
+    KnowledgeBase, в которой установка завершается после нескольких проверок статуса
+    """
+
+    def __init__(self):
+        self.settings = Settings()
+        self.settings.operations_poll_first = 0.01
+        self.settings.operations_poll_max = 0.02
+        self.waiter = OperationWaiter(self.settings)
+        self.start_threads = []
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def install_objects_by_group_id(self, db_name, group_id):
+        self.start_threads.append(threading.current_thread())
+        if group_id == 'broken':
+            raise Exception('Group not found')
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        return group_id
+
+    def wait_deploy(self, db_name, deploy_id, on_progress=None):
+        checks = []
+
+        def check():
+            checks.append(deploy_id)
+            status = {'deployment_status': 'succeeded' if len(checks) > 2 else 'running', 'errors': ''}
+            on_progress(status)
+            if len(checks) > 2:
+                with self.lock:
+                    self.running -= 1
+                return True, status
+            return False, status
+
+        return self.waiter.submit(check, name=deploy_id)
+
+
+class KBDeployQueueTestCase(unittest.TestCase):
+
+    def test_queue(self):
+        kb = FakeDeployKB()
+        progress = []
+        with KBDeployQueue(kb, 'dev', max_concurrent=2,
+                           on_progress=lambda job, status: progress.append(job['name'])) as queue:
+            futures = [queue.install_objects_by_group_id(str(i)) for i in range(5)]
+            statuses = queue.wait(10)
+
+        self.assertTrue(all(i['deployment_status'] == 'succeeded' for i in statuses) and
+                        all(i.done() for i in futures) and kb.max_running == 2 and len(progress) == 15)
+
+    def test_start_error(self):
+        kb = FakeDeployKB()
+        with KBDeployQueue(kb, 'dev') as queue:
+            broken = queue.install_objects_by_group_id('broken')
+            future = queue.install_objects_by_group_id('1')
+            queue.wait(10)
+
+        self.assertTrue(isinstance(broken.exception(), Exception) and future.result()['deployment_status'] ==
+                        'succeeded')
+        # все установки запускаются в потоке очереди, не в потоке вызывающего
+        self.assertTrue(all(i is not threading.current_thread() for i in kb.start_threads))
+
+    def test_close(self):
+        kb = FakeDeployKB()
+        queue = KBDeployQueue(kb, 'dev')
+        queue.install_objects_by_group_id('1')
+        queue.close()
+        time.sleep(0.1)
+
+        self.assertFalse(any(i.name.startswith('KBDeployQueue') for i in threading.enumerate()))
+
+
+class FakeTableKB:
+    """
+    KnowledgeBase без подключения к KB: страницы табличного списка берутся из self.rows
+    """
+
+    def __init__(self, rows_count: int, page_size: int = 10):
+        self.rows = [{'Id': i, 'host': f'host-{i}', 'port': i} for i in range(rows_count)]
+        self.requested = []
+        self.lock = threading.Lock()
+        self.kb = KnowledgeBase.__new__(KnowledgeBase)
+        LoggingHandler.__init__(self.kb)
+        self.kb.settings = Settings()
+        self.kb.settings.kb_objects_batch_size = page_size
+        self.kb._KnowledgeBase__kb_hostname = 'core'
+        self.kb._KnowledgeBase__iterate_table_rows = self.__iterate_table_rows
+        self.fail_at = None
+
+    def __iterate_table_rows(self, url, params, headers, offset, limit):
+        with self.lock:
+            self.requested.append(offset)
+        if offset == self.fail_at:
+            raise Exception('KB data request return None or has wrong response structure')
+        return [dict(i) for i in self.rows[offset:offset + limit]]
+
+    def get_table_pages(self, db_name, table_id, filters=None, offset=0, prefetch=None):
+        return self.kb.get_table_pages(db_name, table_id, filters, offset, prefetch)
+
+    def get_table_info(self, db_name, table_id):
+        return {'fields': [{'name': 'host'}, {'name': 'port'}, {'name': 'comment'}]}
+
+
+class TablePagesTestCase(unittest.TestCase):
+
+    def test_pages(self):
+        kb = FakeTableKB(25)
+        pages = list(kb.get_table_pages('dev', 'table-id', prefetch=3))
+
+        self.assertEqual([(offset, len(rows)) for offset, rows in pages], [(10, 10), (20, 10), (25, 5)])
+        self.assertTrue(all('Id' not in i for _, rows in pages for i in rows))
+
+    def test_exact_pages(self):
+        kb = FakeTableKB(20)
+        pages = list(kb.get_table_pages('dev', 'table-id', prefetch=2))
+
+        self.assertEqual([(offset, len(rows)) for offset, rows in pages], [(10, 10), (20, 10), (20, 0)])
+
+    def test_offset(self):
+        kb = FakeTableKB(25)
+        pages = list(kb.get_table_pages('dev', 'table-id', offset=15, prefetch=1))
+
+        self.assertTrue([offset for offset, _ in pages] == [25, 25] and pages[0][1][0]['host'] == 'host-15' and
+                        kb.requested == [15, 25])
+
+    def test_prefetch_cancel(self):
+        kb = FakeTableKB(1000)
+        pages = kb.get_table_pages('dev', 'table-id', prefetch=4)
+        next(pages)
+        pages.close()
+
+        # запрошено не больше prefetch страниц вперед, остальные отменены
+        self.assertTrue(0 in kb.requested and len(kb.requested) <= 5)
+
+    def test_page_error(self):
+        kb = FakeTableKB(50)
+        kb.fail_at = 20
+
+        with self.assertRaises(Exception):
+            list(kb.get_table_pages('dev', 'table-id', prefetch=2))
+
+
+class KBTableExporterTestCase(unittest.TestCase):
+
+    def test_csv_header_from_schema(self):
+        kb = FakeTableKB(15)
+        kb.rows[12]['comment'] = 'extra'
+        kb.rows[13]['unknown'] = 'ignored'
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'table.csv')
+            count = KBTableExporter(kb, 'dev').export_table('table-id', path)
+            with open(path, 'rt', encoding='utf-8', newline='') as csv_file:
+                lines = csv_file.read().splitlines()
+
+        self.assertTrue(count == 15 and len(lines) == 16 and lines[0] == 'host;port;comment' and
+                        lines[13] == 'host-12;12;extra' and lines[14] == 'host-13;13;')
+
+    def test_resume(self):
+        kb = FakeTableKB(30)
+        kb.fail_at = 20
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'table.csv')
+            exporter = KBTableExporter(kb, 'dev')
+            with self.assertRaises(Exception):
+                exporter.export_table('table-id', path)
+            kb.fail_at = None
+            kb.requested.clear()
+            count = exporter.export_table('table-id', path)
+            with open(path, 'rt', encoding='utf-8', newline='') as csv_file:
+                lines = csv_file.read().splitlines()
+
+        self.assertTrue(count == 30 and lines[1:] == [f'host-{i};{i};' for i in range(30)] and
+                        min(kb.requested) == 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import time
+import threading
+import unittest
+
+from mpsiemlib.common import OperationWaiter, Settings
+
+
+class FakeOperation:
+    """
+    Операция, завершающаяся после done_after проверок статуса
+    """
+
+    def __init__(self, done_after=None, error_at=None):
+        self.done_after = done_after
+        self.error_at = error_at
+        self.checks = []
+        self.threads = set()
+
+    def __call__(self):
+        self.checks.append(time.monotonic())
+        self.threads.add(threading.current_thread().name)
+        if len(self.checks) == self.error_at:
+            raise Exception('Status request failed')
+        done = self.done_after is not None and len(self.checks) >= self.done_after
+        return done, {'checks': len(self.checks), 'state': 'completed' if done else 'running'}
+
+
+class OperationWaiterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = Settings()
+        self.settings.operations_poll_first = 0.01
+        self.settings.operations_poll_factor = 2
+        self.settings.operations_poll_max = 0.08
+        self.settings.operations_timeout = 5
+        self.waiter = OperationWaiter(self.settings)
+
+    def test_completed(self):
+        operation = FakeOperation(done_after=3)
+        future = self.waiter.submit(operation, name='test')
+
+        self.assertEqual(future.result(5), {'checks': 3, 'state': 'completed'})
+        self.assertTrue(future.last_result['checks'] == 3 and operation.threads == {'OperationWaiter'})
+
+    def test_interval_growth(self):
+        operation = FakeOperation(done_after=7)
+        start = time.monotonic()
+        self.waiter.wait(operation)
+        intervals = [b - a for a, b in zip([start] + operation.checks, operation.checks)]
+
+        # 0.01, 0.02, 0.04, 0.08, далее не больше operations_poll_max
+        self.assertTrue(all(i >= 0.009 for i in intervals))
+        self.assertTrue(intervals[3] > intervals[1] * 1.5 and intervals[6] < 0.08 * 3)
+
+    def test_timeout_raise(self):
+        operation = FakeOperation()
+
+        with self.assertRaises(TimeoutError):
+            self.waiter.wait(operation, timeout=0.1)
+
+        self.assertTrue(len(operation.checks) > 1)
+
+    def test_timeout_last_result(self):
+        operation = FakeOperation()
+        result = self.waiter.wait(operation, timeout=0.1, raise_on_timeout=False)
+
+        self.assertEqual(result, {'checks': len(operation.checks), 'state': 'running'})
+
+    def test_check_error(self):
+        operation = FakeOperation(error_at=2)
+        future = self.waiter.submit(operation)
+
+        with self.assertRaises(Exception):
+            future.result(5)
+
+        self.assertEqual(len(operation.checks), 2)
+
+    def test_concurrent_operations(self):
+        operations = [FakeOperation(done_after=i) for i in range(1, 6)]
+        futures = [self.waiter.submit(i, name=str(n)) for n, i in enumerate(operations)]
+
+        self.assertEqual([i.result(5)['checks'] for i in futures], [1, 2, 3, 4, 5])
+        self.assertEqual(set().union(*(i.threads for i in operations)), {'OperationWaiter'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -77,6 +77,17 @@ class TablesTestCase(unittest.TestCase):
 
         self.assertTrue(has_all_fields and is_valid_struct)
 
+    def test_get_table_name_by_id(self):
+        tables = self.__module.get_tables_list()
+        is_valid = True
+        for name in tables:
+            table_id = self.__module.get_table_id_by_name(name)
+            if self.__module.get_table_name_by_id(table_id) != name:
+                is_valid = False
+                break
+
+        self.assertTrue(is_valid)
+
     def test_set_table_data_r27_2(self):
         self.__module.truncate_table("test_tl_r272")
 
@@ -116,6 +127,24 @@ class TablesTestCase(unittest.TestCase):
 
         self.assertTrue(is_added and is_removed)
 
+    def test_sync_table(self):
+        rows = [{'cust': 'test1',
+                 'user': 'user1',
+                 'session_stat': '12.12.2020 15:23:23'},
+                {'cust': 'test2',
+                 'user': 'user2',
+                 'session_stat': '12.12.2020 15:23:23'}
+                ]
+        self.__module.sync_table("test_tl_r272", rows)
+        ret = self.__module.sync_table("test_tl_r272", rows)
+        is_unchanged = ret == {'added': 0, 'removed': 0, 'updated': 0}
+
+        ret = []
+        for i in self.__module.get_table_data("test_tl_r272"):
+            ret.append((i.get("cust"), i.get("user")))
+
+        self.assertTrue(is_unchanged and sorted(ret) == [('test1', 'user1'), ('test2', 'user2')])
+
     def test_whitelist_rows_exists(self):
         table = 'Common_blacklist_value'
         rows = [
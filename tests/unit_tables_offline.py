@@ -0,0 +1,348 @@
+import csv
+import sys
+import time
+import unittest
+
+from datetime import datetime
+from unittest import mock
+
+import requests
+
+from mpsiemlib.common import ModuleNames, LoggingHandler, Settings
+from mpsiemlib.helpers import TablesFanOut, TableLoader, UTCTimestampFormatter
+from mpsiemlib.modules import Tables
+from mpsiemlib.modules.Tables import TableRowEncoder, TableSchemaRegistry, _split_table_rows
+
+FIELDS = [{'name': '_last_changed', 'type': 'datetime', 'primaryKey': False, 'nullable': True},
+          {'name': 'host', 'type': 'string', 'primaryKey': True, 'nullable': False},
+          {'name': 'port', 'type': 'number', 'primaryKey': False, 'nullable': False},
+          {'name': 'comment', 'type': 'string', 'primaryKey': False, 'nullable': True}]
+
+
+class TableRowEncoderTestCase(unittest.TestCase):
+
+    def test_schema(self):
+        encoder = TableRowEncoder(FIELDS)
+
+        self.assertTrue(encoder.positions == {'_last_changed': 0, 'host': 1, 'port': 2, 'comment': 3} and
+                        encoder.key_fields == ['host'] and encoder.not_nullable_fields == ['host', 'port'])
+
+    def test_encode(self):
+        encoder = TableRowEncoder(FIELDS)
+        row = encoder.encode({'port': '445', 'comment': 'smb', 'host': 'srv'})
+
+        self.assertEqual(row, [None, 'srv', 445, 'smb'])
+
+    def test_encode_datetime(self):
+        encoder = TableRowEncoder(FIELDS)
+        expected = round(datetime(2021, 3, 1, 12, 30, 15).timestamp())
+        rows = encoder.encode_rows([{'host': 'a', 'port': 1, '_last_changed': '01.03.2021 12:30:15'},
+                                    {'host': 'b', 'port': 2, '_last_changed': expected}])
+
+        self.assertTrue(rows[0][0] == expected and rows[1][0] == expected)
+
+    def test_encode_missing_key(self):
+        encoder = TableRowEncoder(FIELDS)
+
+        with self.assertRaises(Exception) as err:
+            encoder.encode({'port': 1})
+
+        self.assertIn('Key fields', str(err.exception))
+
+    def test_encode_missing_not_nullable(self):
+        encoder = TableRowEncoder(FIELDS)
+
+        with self.assertRaises(Exception) as err:
+            encoder.encode({'host': 'srv'})
+
+        self.assertIn('Not nullable fields', str(err.exception))
+
+    def test_encode_unknown_field(self):
+        encoder = TableRowEncoder(FIELDS)
+
+        with self.assertRaises(Exception):
+            encoder.encode({'host': 'srv', 'port': 1, 'unknown': 'value'})
+
+
+class SplitTableRowsTestCase(unittest.TestCase):
+
+    def test_single_request(self):
+        add = [[i] for i in range(3)]
+        remove = [[i] for i in range(2)]
+
+        self.assertEqual(_split_table_rows(add, remove, 5), [{'add': add, 'remove': remove}])
+
+    def test_remove_before_add(self):
+        add = [[i] for i in range(5)]
+        remove = [[i] for i in range(3)]
+        requests = _split_table_rows(add, remove, 2)
+
+        self.assertEqual([(len(i['add'] or ()), len(i['remove'] or ())) for i in requests],
+                         [(0, 2), (0, 1), (2, 0), (2, 0), (1, 0)])
+        self.assertEqual(sum((i['add'] or [] for i in requests), []), add)
+        self.assertEqual(sum((i['remove'] or [] for i in requests), []), remove)
+
+    def test_only_add(self):
+        add = [[i] for i in range(4)]
+        requests = _split_table_rows(add, None, 2)
+
+        self.assertEqual(requests, [{'add': add[:2], 'remove': None}, {'add': add[2:], 'remove': None}])
+
+
+class FakeJSONResponse:
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class SchemaRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Tables без подключения к Core с отдельным реестром, ответы API заданы в тесте
+        self.tables = Tables.__new__(Tables)
+        LoggingHandler.__init__(self.tables)
+        self.tables.settings = Settings()
+        self.tables.schema_registry = TableSchemaRegistry()
+        self.tables._Tables__core_hostname = 'core'
+        self.tables._Tables__core_session = None
+        self.requests = []
+
+    def __exec_request(self, session, url, method='GET', timeout=30, **kwargs):
+        self.requests.append(url)
+        if '/fields' in url or 'table_lists/table-id' in url:
+            return FakeJSONResponse({'fields': [dict(i) for i in FIELDS], 'maxSize': 100})
+        return FakeJSONResponse([{'name': 'table', 'token': 'table-id', 'fillType': 'Registry'}])
+
+    def test_info_copy(self):
+        with mock.patch.object(sys.modules['mpsiemlib.modules.Tables'], 'exec_request', self.__exec_request):
+            info = self.tables.get_table_info('table')
+            info['fields'].pop()
+            info.pop('type')
+            tables = self.tables.get_tables_list()
+            tables['table']['id'] = None
+            requests_count = len(self.requests)
+            second = self.tables.get_table_info('table')
+
+        self.assertTrue(second['fields'] == FIELDS and second['type'] == 'registry' and
+                        self.tables.get_table_id_by_name('table') == 'table-id' and
+                        len(self.requests) == requests_count)
+
+
+class SyncTableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Tables без подключения к Core: схема и содержимое таблицы заданы в тесте
+        self.current = [{'_last_changed': '01.03.2021 12:30:15', 'host': 'a', 'port': 1, 'comment': None},
+                        {'_last_changed': '01.03.2021 12:30:15', 'host': 'b', 'port': 2, 'comment': 'old'},
+                        {'_last_changed': '01.03.2021 12:30:15', 'host': 'c', 'port': 3, 'comment': None}]
+        self.changes = []
+        self.tables = Tables.__new__(Tables)
+        LoggingHandler.__init__(self.tables)
+        self.tables.settings = Settings()
+        self.tables._Tables__core_hostname = 'core'
+        self.tables._Tables__get_table_schema = lambda table_name, siem_id=None: ({'type': 'correlationrule'},
+                                                                                  TableRowEncoder(FIELDS))
+        self.tables.get_table_data = lambda table_name, filters=None, siem_id=None: iter(self.current)
+        self.tables.set_table_row = self.__set_table_row
+
+    def __set_table_row(self, table_name, add_rows=None, remove_rows=None, siem_id=None):
+        self.changes.append((add_rows, remove_rows))
+
+    def test_unchanged(self):
+        rows = [{'host': 'a', 'port': 1}, {'host': 'b', 'port': 2, 'comment': 'old'}, {'host': 'c', 'port': 3}]
+        ret = self.tables.sync_table('table', rows)
+
+        self.assertTrue(ret == {'added': 0, 'removed': 0, 'updated': 0} and self.changes == [])
+
+    def test_changed(self):
+        rows = [{'host': 'a', 'port': 1}, {'host': 'b', 'port': 2, 'comment': 'new'}, {'host': 'd', 'port': 4}]
+        ret = self.tables.sync_table('table', rows)
+
+        self.assertEqual(ret, {'added': 1, 'removed': 1, 'updated': 1})
+        self.assertEqual([[i['host'] for i in remove] for _, remove in self.changes[:1]], [['b', 'c']])
+        self.assertEqual(self.changes[1][0], [{'host': 'b', 'port': 2, 'comment': 'new'}, {'host': 'd', 'port': 4}])
+
+
+class FakeUploadTables:
+    """
+    Tables, запоминающий загруженные пачки CSV, первые failures загрузок завершаются ошибкой
+    """
+
+    def __init__(self, failures=()):
+        self.settings = Settings()
+        self.failures = list(failures)
+        self.uploads = []
+        self.attempts = 0
+
+    def get_table_info(self, table_name, siem_id=None):
+        return {'fields': [{'name': 'host', 'type': 'string'}, {'name': 'seen', 'type': 'datetime'}]}
+
+    def set_table_data(self, table_name, data, siem_id=None):
+        self.attempts += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        self.uploads.append(data.decode('utf-8'))
+
+
+def http_error(status_code: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(response=response)
+
+
+class UTCTimestampFormatterTestCase(unittest.TestCase):
+
+    def test_format(self):
+        formatter = UTCTimestampFormatter()
+        timestamps = [0, 59, 86399, 86400, 1614601815, 1614601815 + 3600]
+
+        self.assertEqual([formatter(i) for i in timestamps],
+                         [time.strftime('%d.%m.%Y %H:%M:%S', time.gmtime(i)) for i in timestamps])
+
+    def test_day_cache(self):
+        formatter = UTCTimestampFormatter()
+        with mock.patch('time.strftime', wraps=time.strftime) as strftime:
+            for i in range(0, 2 * 86400, 600):
+                formatter(1614556800 + i)
+
+        self.assertEqual(strftime.call_count, 2)
+
+
+class TableLoaderTestCase(unittest.TestCase):
+
+    def test_batches(self):
+        tables = FakeUploadTables()
+        tables.settings.tables_upload_batch_bytes = 200
+        rows = [{'host': f'host-{i}', 'seen': 1614601815, '_id': i} for i in range(50)]
+        count = TableLoader(tables, 'table').load(iter(rows))
+        loaded = [row for data in tables.uploads for row in csv.DictReader(data.splitlines(), delimiter=';')]
+
+        self.assertEqual(count, 50)
+        self.assertTrue(len(tables.uploads) > 1 and all(len(i.encode('utf-8')) < 400 for i in tables.uploads))
+        self.assertEqual(sorted(i['host'] for i in loaded), sorted(f'host-{i}' for i in range(50)))
+        self.assertTrue(all(i.keys() == {'host', 'seen'} and i['seen'] == '01.03.2021 12:30:15' for i in loaded))
+
+    def test_no_retry_by_default(self):
+        tables = FakeUploadTables(failures=[http_error(503)])
+
+        with self.assertRaises(requests.HTTPError):
+            TableLoader(tables, 'table').load(iter([{'host': 'a', 'seen': None}]))
+
+        self.assertEqual(tables.attempts, 1)
+
+    def test_retry_server_error(self):
+        tables = FakeUploadTables(failures=[requests.ConnectionError(), http_error(502)])
+        tables.settings.tables_upload_retries = 2
+        with mock.patch('time.sleep'):
+            TableLoader(tables, 'table').load(iter([{'host': 'a', 'seen': None}]))
+
+        self.assertTrue(tables.attempts == 3 and len(tables.uploads) == 1)
+
+    def test_client_error_not_retried(self):
+        tables = FakeUploadTables(failures=[http_error(400)])
+        tables.settings.tables_upload_retries = 2
+
+        with mock.patch('time.sleep'), self.assertRaises(requests.HTTPError):
+            TableLoader(tables, 'table').load(iter([{'host': 'a', 'seen': None}]))
+
+        self.assertEqual(tables.attempts, 1)
+
+
+class FakeTables:
+    """
+    Tables, запоминающий вызовы, на конвейере failed_siem_id операции завершаются ошибкой
+    """
+
+    def __init__(self, failed_siem_id=None):
+        self.failed_siem_id = failed_siem_id
+        self.calls = []
+
+    def set_table_row(self, table_name, add_rows=None, remove_rows=None, siem_id=None):
+        self.calls.append((table_name, siem_id))
+        if siem_id == self.failed_siem_id:
+            raise Exception('Got error while manipulate with table rows')
+        return len(add_rows or ())
+
+
+class FakeConveyor:
+
+    def get_conveyor_list(self):
+        return [{'id': 'siem-1'}, {'id': 'siem-2'}]
+
+
+class FakeWorker:
+
+    def __init__(self, tables):
+        self.modules = {ModuleNames.TABLES: tables, ModuleNames.CONVEYOR: FakeConveyor()}
+
+    def get_module(self, name):
+        return self.modules[name]
+
+
+class TablesFanOutTestCase(unittest.TestCase):
+
+    def test_all_conveyors(self):
+        tables = FakeTables()
+        results = TablesFanOut(FakeWorker(tables)).set_table_row('table', add_rows=[{'host': 'srv'}])
+
+        self.assertTrue(results == {'siem-1': {'result': 1, 'error': None}, 'siem-2': {'result': 1, 'error': None}}
+                        and sorted(tables.calls) == [('table', 'siem-1'), ('table', 'siem-2')])
+
+    def test_failed_conveyor(self):
+        tables = FakeTables(failed_siem_id='siem-2')
+        results = TablesFanOut(FakeWorker(tables), siem_ids=['siem-1', 'siem-2']).set_table_row('table')
+
+        self.assertTrue(TablesFanOut.get_failed(results) == ['siem-2'] and results['siem-1']['result'] == 0)
+
+
+class FakeResponse:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.text = str(len(rows))
+
+    def json(self):
+        return [row[0] % 2 == 0 for row in self.rows]
+
+
+class WhitelistBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Tables без подключения к Core, запросы к API белых списков только запоминаются
+        settings = Settings()
+        settings.whitelist_batch_size = 2
+        settings.whitelist_concurrency = 2
+        self.requests = []
+        self.tables = Tables.__new__(Tables)
+        LoggingHandler.__init__(self.tables)
+        self.tables.settings = settings
+        self.tables._Tables__core_hostname = 'core'
+        self.tables.get_table_id_by_name = lambda table_name, siem_id=None: 'table-id'
+        self.tables._Tables__whitelist_request = self.__whitelist_request
+
+    def __whitelist_request(self, api, table_name, rows):
+        self.requests.append((api, rows))
+        return FakeResponse(rows)
+
+    def test_rows_exists_order(self):
+        rows = [[i, 'alert_context'] for i in range(5)]
+        ret = self.tables.whitelist_rows_exists_batch('table', rows)
+
+        self.assertTrue(ret == [True, False, True, False, True] and
+                        sorted(len(rows) for _, rows in self.requests) == [1, 2, 2])
+
+    def test_insert_single_request(self):
+        rows = [[0, 'alert_context'], [1, 'alert_context']]
+        ret = self.tables.insert_whitelist_rows_batch('table', rows)
+
+        self.assertTrue(ret == ['2'] and self.requests == [('/api/whitelists/{}/insert', rows)])
+
+    def test_remove_empty(self):
+        self.assertTrue(self.tables.remove_whitelist_rows_batch('table', []) == [] and self.requests == [])
+
+
+if __name__ == '__main__':
+    unittest.main()